@@ -11,11 +11,14 @@ from typing import Optional
 # Importing constants and pipeline modules from the project
 from src.constants import APP_HOST, APP_PORT
 from src.pipline.prediction_pipeline import VehicleData, VehicleDataClassifier
-from src.pipline.training_pipeline import TrainPipeline
+from src.pipline.retrain_scheduler import RetrainScheduler
 
 # Initialize FastAPI application
 app = FastAPI()
 
+# Training requests go through the scheduler, so at most one run is active (also across processes)
+retrain_scheduler = RetrainScheduler(triggers=[])
+
 # Mount the 'static' directory for serving static files (like CSS)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -41,17 +44,16 @@ class DataForm:
     """
     def __init__(self, request: Request):
         self.request: Request = request
-        self.Gender: Optional[int] = None
+        self.Gender: Optional[str] = None
         self.Age: Optional[int] = None
         self.Driving_License: Optional[int] = None
         self.Region_Code: Optional[float] = None
         self.Previously_Insured: Optional[int] = None
+        self.Vehicle_Age: Optional[str] = None
+        self.Vehicle_Damage: Optional[str] = None
         self.Annual_Premium: Optional[float] = None
         self.Policy_Sales_Channel: Optional[float] = None
         self.Vintage: Optional[int] = None
-        self.Vehicle_Age_lt_1_Year: Optional[int] = None
-        self.Vehicle_Age_gt_2_Years: Optional[int] = None
-        self.Vehicle_Damage_Yes: Optional[int] = None
                 
 
     async def get_vehicle_data(self):
@@ -65,12 +67,11 @@ class DataForm:
         self.Driving_License = form.get("Driving_License")
         self.Region_Code = form.get("Region_Code")
         self.Previously_Insured = form.get("Previously_Insured")
+        self.Vehicle_Age = form.get("Vehicle_Age")
+        self.Vehicle_Damage = form.get("Vehicle_Damage")
         self.Annual_Premium = form.get("Annual_Premium")
         self.Policy_Sales_Channel = form.get("Policy_Sales_Channel")
         self.Vintage = form.get("Vintage")
-        self.Vehicle_Age_lt_1_Year = form.get("Vehicle_Age_lt_1_Year")
-        self.Vehicle_Age_gt_2_Years = form.get("Vehicle_Age_gt_2_Years")
-        self.Vehicle_Damage_Yes = form.get("Vehicle_Damage_Yes")
 
 # Route to render the main page with the form
 @app.get("/", tags=["authentication"])
@@ -83,13 +84,18 @@ async def index(request: Request):
 
 # Route to trigger the model training process
 @app.get("/train")
-async def trainRouteClient():
+def trainRouteClient():
     """
-    Endpoint to initiate the model training pipeline.
+    Endpoint to initiate the model training pipeline. A plain function, so FastAPI runs it in its
+    thread pool: the training does not block the event loop and concurrent requests are answered
+    with "already running".
     """
     try:
-        train_pipeline = TrainPipeline()
-        train_pipeline.run_pipeline()
+        status = retrain_scheduler.request_run("GET /train", wait=True)
+        if status == "merged":
+            return Response("Training is already running, the request will be served by the next run.")
+        if status != "succeeded":
+            return Response(f"Error Occurred! {retrain_scheduler.last_run['error']}")
         return Response("Training successful!!!")
 
     except Exception as e:
@@ -111,12 +117,11 @@ async def predictRouteClient(request: Request):
                                 Driving_License = form.Driving_License,
                                 Region_Code = form.Region_Code,
                                 Previously_Insured = form.Previously_Insured,
+                                Vehicle_Age = form.Vehicle_Age,
+                                Vehicle_Damage = form.Vehicle_Damage,
                                 Annual_Premium = form.Annual_Premium,
                                 Policy_Sales_Channel = form.Policy_Sales_Channel,
-                                Vintage = form.Vintage,
-                                Vehicle_Age_lt_1_Year = form.Vehicle_Age_lt_1_Year,
-                                Vehicle_Age_gt_2_Years = form.Vehicle_Age_gt_2_Years,
-                                Vehicle_Damage_Yes = form.Vehicle_Damage_Yes
+                                Vintage = form.Vintage
                                 )
 
         # Convert form data into a DataFrame for the model
@@ -0,0 +1,79 @@
+"""
+Compares the artifact file formats the pipeline can hand data over in.
+
+For each format it reports write time, file size, full and column-pruned read time and the
+peak memory added while writing and reading. Every measurement runs in a fresh process so
+peak RSS is not polluted by the previous one.
+
+    python -m benchmarks.bench_artifact_formats --rows 1000000
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.common import make_vehicle_dataframe, peak_rss_mb, print_table
+
+PRUNED_COLUMNS = ["Age", "Vintage", "Response"]
+
+
+def _write(file_format: str, rows: int, file_path: str, results) -> None:
+    from src.utils.main_utils import save_dataframe, with_file_format
+    dataframe = make_vehicle_dataframe(rows)
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    save_dataframe(with_file_format(file_path, file_format), dataframe)
+    results.put({"write_s": time.perf_counter() - start, "write_peak_mb": peak_rss_mb() - baseline})
+
+
+def _read(file_path: str, columns, results) -> None:
+    from src.utils.main_utils import load_dataframe
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    dataframe = load_dataframe(file_path, columns=columns)
+    elapsed = time.perf_counter() - start
+    results.put({"read_s": elapsed, "read_peak_mb": peak_rss_mb() - baseline, "rows": len(dataframe)})
+
+
+def _in_fresh_process(target, *args) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=target, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def run(rows: int, formats: list) -> list:
+    from src.utils.main_utils import with_file_format
+    report = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for file_format in formats:
+            file_path = with_file_format(os.path.join(tmp_dir, "data"), file_format)
+            written = _in_fresh_process(_write, file_format, rows, file_path)
+            full_read = _in_fresh_process(_read, file_path, None)
+            pruned_read = _in_fresh_process(_read, file_path, PRUNED_COLUMNS)
+            report.append({
+                "format": file_format,
+                "rows": rows,
+                "size_mb": round(os.path.getsize(file_path) / 2 ** 20, 2),
+                "write_s": round(written["write_s"], 3),
+                "read_s": round(full_read["read_s"], 3),
+                "pruned_read_s": round(pruned_read["read_s"], 3),
+                "write_peak_mb": round(written["write_peak_mb"], 1),
+                "read_peak_mb": round(full_read["read_peak_mb"], 1),
+                "pruned_read_peak_mb": round(pruned_read["read_peak_mb"], 1),
+            })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--formats", nargs="+", default=["csv", "parquet", "feather"])
+    args = parser.parse_args()
+
+    results = run(args.rows, args.formats)
+    print_table(results, list(results[0].keys()))
@@ -0,0 +1,79 @@
+"""
+Time to encode raw records with the FeatureEncoder saved in the model versus the pandas path the
+transformation and evaluation used before (Gender mapping, get_dummies, column renames), for a
+single served record up to whole training splits. Both must produce the same features.
+
+    python -m benchmarks.bench_feature_encoder --rows 1 100 10000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import make_vehicle_dataframe, print_table
+
+
+def pandas_encode(dataframe: pd.DataFrame, drop_columns: list) -> pd.DataFrame:
+    """The custom transformations as they were applied before the feature encoder"""
+    dataframe = dataframe.copy()
+    dataframe['Gender'] = dataframe['Gender'].map({'Female': 0, 'Male': 1}).astype(int)
+    dataframe = dataframe.drop([column for column in drop_columns if column in dataframe.columns], axis=1)
+    dataframe = pd.get_dummies(dataframe, drop_first=True)
+    dataframe = dataframe.rename(columns={"Vehicle_Age_< 1 Year": "Vehicle_Age_lt_1_Year",
+                                          "Vehicle_Age_> 2 Years": "Vehicle_Age_gt_2_Years"})
+    for column in ["Vehicle_Age_lt_1_Year", "Vehicle_Age_gt_2_Years", "Vehicle_Damage_Yes"]:
+        if column in dataframe.columns:
+            dataframe[column] = dataframe[column].astype('int')
+    return dataframe
+
+
+def _best_seconds(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(row_counts: list, repeat: int) -> list:
+    from src.constants import SCHEMA_FILE_PATH, TARGET_COLUMN
+    from src.entity.estimator import FeatureEncoder
+    from src.utils.main_utils import read_yaml_file, apply_schema_dtypes
+
+    schema_config = read_yaml_file(SCHEMA_FILE_PATH)
+    training_df = apply_schema_dtypes(make_vehicle_dataframe(max(row_counts + [10000])), schema_config).drop(columns=[TARGET_COLUMN])
+    encoder = FeatureEncoder(schema_config).fit(training_df)
+
+    # batches as the pipeline reads them (schema dtypes) and small batches of records as they are served
+    batches = [("dataframe", rows, training_df.iloc[:rows]) for rows in row_counts]
+    batches += [("records", rows, pd.DataFrame(training_df.iloc[:rows].astype(object).to_dict("records")))
+                for rows in row_counts if rows <= 100]
+
+    report = []
+    for source, rows, batch in batches:
+        # the pandas path depends on the categories in the batch, small batches lose dummy columns
+        legacy = pandas_encode(batch, schema_config["drop_columns"])
+        encoded = encoder.transform(batch)
+        same_columns = list(legacy.columns) == encoder.feature_names
+        same_values = same_columns and np.array_equal(legacy.to_numpy(dtype=np.float64), encoded.to_numpy())
+        pandas_s = _best_seconds(lambda: pandas_encode(batch, schema_config["drop_columns"]), repeat)
+        encoder_s = _best_seconds(lambda: encoder.transform(batch), repeat)
+        report.append({"input": source, "rows": rows,
+                       "pandas_ms": round(pandas_s * 1000, 3),
+                       "encoder_ms": round(encoder_s * 1000, 3),
+                       "speedup": round(pandas_s / encoder_s, 1),
+                       "pandas_columns_match": same_columns,
+                       "same_features": same_values})
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 100, 10_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.rows, args.repeat)
+    print_table(results, list(results[0].keys()))
@@ -0,0 +1,69 @@
+"""
+End-to-end time of validation, transformation, training and evaluation when the stages hand
+their outputs over through files versus in memory (files then written in the background or at
+the end of the run). Ingestion is simulated from synthetic data, so no MongoDB is needed.
+Every measurement runs in a fresh process.
+
+    python -m benchmarks.bench_inmemory_handoff --rows 1000000 --n-estimators 20
+"""
+import argparse
+import multiprocessing
+import tempfile
+import time
+
+from benchmarks.common import make_vehicle_dataframe, make_stage_configs, write_ingestion_artifacts, peak_rss_mb, print_table
+
+MODES = {"files": (False, "sync"), "in_memory_async": (True, "async"), "in_memory_end": (True, "end")}
+
+
+def _run(mode: str, rows: int, n_estimators: int, results) -> None:
+    from src.components.data_validation import DataValidation
+    from src.components.data_transformation import DataTransformation
+    from src.components.model_trainer import ModelTrainer
+    from src.components.model_evaluation import ModelEvaluation
+    from src.entity.config_entity import ModelEvaluationConfig
+    from src.utils.artifact_store import ArtifactStore
+
+    in_memory, persist = MODES[mode]
+    with tempfile.TemporaryDirectory() as run_dir:
+        dataframe = make_vehicle_dataframe(rows)
+        ingestion = write_ingestion_artifacts(dataframe, run_dir, keep_in_memory=in_memory)
+        configs = make_stage_configs(run_dir, _n_estimators=n_estimators)
+        store = ArtifactStore(in_memory=in_memory, persist=persist)
+
+        baseline = peak_rss_mb()
+        start = time.perf_counter()
+        validation = DataValidation(ingestion, configs["validation"]).initiate_data_validation()
+        transformation = DataTransformation(ingestion, validation, configs["transformation"], artifact_store=store).initiate_data_transformation()
+        trainer = ModelTrainer(transformation, configs["trainer"], artifact_store=store).initiate_model_trainer()
+        ModelEvaluation(ModelEvaluationConfig(), ingestion, trainer, best_model=None,
+                        data_transformation_artifact=transformation).initiate_model_evaluation()
+        pipeline_seconds = time.perf_counter() - start
+        store.close()
+        results.put({"mode": mode, "rows": rows,
+                     "pipeline_s": round(pipeline_seconds, 2),
+                     "with_persist_s": round(time.perf_counter() - start, 2),
+                     "peak_mb": round(peak_rss_mb() - baseline, 1)})
+
+
+def run(rows: int, n_estimators: int, modes: list) -> list:
+    context = multiprocessing.get_context("spawn")
+    report = []
+    for mode in modes:
+        results = context.Queue()
+        process = context.Process(target=_run, args=(mode, rows, n_estimators, results))
+        process.start()
+        report.append(results.get())
+        process.join()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--n-estimators", type=int, default=20)
+    parser.add_argument("--modes", nargs="+", default=list(MODES))
+    args = parser.parse_args()
+
+    results = run(args.rows, args.n_estimators, args.modes)
+    print_table(results, list(results[0].keys()))
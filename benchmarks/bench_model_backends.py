@@ -0,0 +1,78 @@
+"""
+Fit time, serialized model size, inference latency and metrics of every model backend, trained on
+the same transformed arrays with the trainer's default hyperparameters. Latencies are measured on
+MyModel.predict with raw records, as the web app serves them: one record, and a batch.
+
+    python -m benchmarks.bench_model_backends --rows 200000 --batch-rows 10000
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import make_vehicle_dataframe, make_stage_configs, write_ingestion_artifacts, print_table
+
+
+def _latency_ms(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def run(rows: int, batch_rows: int, backends: list, repeat: int) -> list:
+    import pandas as pd
+    from sklearn.metrics import f1_score
+    from src.components.data_transformation import DataTransformation
+    from src.components.model_trainer import ModelTrainer
+    from src.constants import TARGET_COLUMN
+    from src.entity.artifact_entity import DataValidationArtifacts
+    from src.entity.estimator import MyModel
+    from src.entity.model_backends import get_model_backend
+    from src.utils.main_utils import load_object
+
+    report = []
+    with tempfile.TemporaryDirectory() as run_dir:
+        ingestion = write_ingestion_artifacts(make_vehicle_dataframe(rows), run_dir)
+        configs = make_stage_configs(run_dir, transformation_params={"resampling_strategy": "class_weight"})
+        validation = DataValidationArtifacts(validation_status=True, message="", validation_report_file_path="")
+        transformation = DataTransformation(ingestion, validation, configs["transformation"]).initiate_data_transformation()
+        preprocessor = load_object(transformation.transformed_object_file)
+        feature_encoder = load_object(transformation.feature_encoder_file)
+        test_df = pd.read_feather(ingestion.test_file_path)
+        raw_batch = test_df.drop(columns=[TARGET_COLUMN]).iloc[:batch_rows]
+        # a record as the web app builds it, not a slice of the typed test split
+        raw_record = pd.DataFrame([raw_batch.iloc[0].to_dict()])
+
+        for name in backends:
+            trainer_config = make_stage_configs(f"{run_dir}/{name}", model_backend=name)["trainer"]
+            trainer = ModelTrainer(transformation, trainer_config)
+            X_train, y_train, X_test, y_test = trainer.load_arrays()
+            start = time.perf_counter()
+            model, _ = trainer.get_model_object_and_reported(X_train, y_train, X_test, y_test,
+                                                             class_weight=transformation.class_weight)
+            fit_seconds = time.perf_counter() - start
+            backend = get_model_backend(name)
+            my_model = MyModel(preprocessor, model, feature_encoder, backend=name)
+            predictions = my_model.predict(test_df.drop(columns=[TARGET_COLUMN]))
+            report.append({"backend": name, "train_rows": len(y_train),
+                           "train_s": round(fit_seconds, 2),
+                           "model_mb": round(len(backend.serialize(model)) / 2 ** 20, 2),
+                           "one_row_ms": round(_latency_ms(lambda: my_model.predict(raw_record), repeat), 2),
+                           f"batch_{len(raw_batch)}_ms": round(_latency_ms(lambda: my_model.predict(raw_batch), max(repeat // 10, 3)), 1),
+                           "f1": round(f1_score(test_df[TARGET_COLUMN], predictions), 4)})
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--batch-rows", type=int, default=10_000)
+    parser.add_argument("--backends", nargs="+", default=["random_forest", "hist_gradient_boosting"])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    results = run(args.rows, args.batch_rows, args.backends, args.repeat)
+    print_table(results, list(results[0].keys()))
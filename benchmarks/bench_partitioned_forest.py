@@ -0,0 +1,72 @@
+"""
+Fit time and test metrics of the forest fitted in one process versus as sub-forests on as many
+stratified partitions as there are worker processes, merged afterwards. With --queue the workers
+are task queue workers started as separate processes, as on other machines, instead of a local pool.
+
+    python -m benchmarks.bench_partitioned_forest --rows 400000 --workers 2 4 8
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import make_vehicle_dataframe, make_stage_configs, write_ingestion_artifacts, print_table
+
+
+def run(rows: int, workers_list: list, queue: bool) -> list:
+    from dataclasses import replace
+    from sklearn.metrics import accuracy_score, f1_score
+    from src.components.data_transformation import DataTransformation
+    from src.components.model_trainer import ModelTrainer
+    from src.entity.artifact_entity import DataValidationArtifacts
+
+    report = []
+    with tempfile.TemporaryDirectory() as run_dir:
+        ingestion = write_ingestion_artifacts(make_vehicle_dataframe(rows), run_dir)
+        configs = make_stage_configs(run_dir, transformation_params={"resampling_strategy": "class_weight"})
+        validation = DataValidationArtifacts(validation_status=True, message="", validation_report_file_path="")
+        transformation = DataTransformation(ingestion, validation, configs["transformation"]).initiate_data_transformation()
+
+        baseline = None
+        for workers in [1] + workers_list:
+            trainer_config = replace(configs["trainer"], partitions=workers, partition_workers=workers)
+            queue_workers = []
+            if queue and workers > 1:
+                trainer_config = replace(trainer_config, partition_queue_dir=os.path.join(run_dir, f"queue_{workers}"))
+                queue_workers = [subprocess.Popen([sys.executable, "-m", "src.components.partitioned_training",
+                                                   trainer_config.partition_queue_dir, "--idle-seconds", "2",
+                                                   "--poll-seconds", "0.05"])
+                                 for _ in range(workers)]
+            trainer = ModelTrainer(transformation, trainer_config)
+            X_train, y_train, X_test, y_test = trainer.load_arrays()
+            start = time.perf_counter()
+            model, _ = trainer.get_model_object_and_reported(X_train, y_train, X_test, y_test,
+                                                             class_weight=transformation.class_weight)
+            fit_seconds = time.perf_counter() - start
+            for worker in queue_workers:
+                worker.wait()
+
+            predictions = model.predict(X_test)
+            f1 = f1_score(y_test, predictions)
+            baseline = baseline or {"train_s": fit_seconds, "f1": f1}
+            report.append({"workers": workers, "runner": "queue" if queue_workers else ("pool" if workers > 1 else "single"),
+                           "train_rows": len(y_train), "trees": len(model.estimators_),
+                           # fit, prediction of the test split and the merge
+                           "train_s": round(fit_seconds, 2),
+                           "speedup": round(baseline["train_s"] / fit_seconds, 2),
+                           "accuracy": round(accuracy_score(y_test, predictions), 4),
+                           "f1": round(f1, 4), "f1_change": round(f1 - baseline["f1"], 4)})
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=400_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--queue", action="store_true", help="fit the partitions through a task queue directory")
+    args = parser.parse_args()
+
+    results = run(args.rows, args.workers, args.queue)
+    print_table(results, list(results[0].keys()))
@@ -0,0 +1,74 @@
+"""
+Cost and metric impact of the class imbalance strategies of the transformation stage. Every
+strategy transforms and trains on the same synthetic data in a fresh process; the test split is
+not resampled, so the metrics of all strategies are measured on the real class balance.
+
+    python -m benchmarks.bench_resampling --rows 200000 --n-estimators 20
+"""
+import argparse
+import multiprocessing
+import tempfile
+import time
+
+from benchmarks.common import make_vehicle_dataframe, make_stage_configs, write_ingestion_artifacts, peak_rss_mb, print_table
+
+STRATEGIES = {
+    "smoteenn_1_job": {"resampling_strategy": "smoteenn", "resampling_n_jobs": 1},
+    "smoteenn": {"resampling_strategy": "smoteenn"},
+    "smoteenn_partitioned": {"resampling_strategy": "smoteenn_partitioned"},
+    "random_under": {"resampling_strategy": "random_under"},
+    "class_weight": {"resampling_strategy": "class_weight"},
+    "none": {"resampling_strategy": "none"},
+}
+
+
+def _run(name: str, rows: int, n_estimators: int, results) -> None:
+    from src.components.data_transformation import DataTransformation
+    from src.components.model_trainer import ModelTrainer
+    from src.entity.artifact_entity import DataValidationArtifacts
+
+    with tempfile.TemporaryDirectory() as run_dir:
+        ingestion = write_ingestion_artifacts(make_vehicle_dataframe(rows), run_dir)
+        configs = make_stage_configs(run_dir, transformation_params={**STRATEGIES[name], "resample_test": False},
+                                     _n_estimators=n_estimators)
+        validation = DataValidationArtifacts(validation_status=True, message="", validation_report_file_path="")
+
+        baseline = peak_rss_mb()
+        start = time.perf_counter()
+        transformation = DataTransformation(ingestion, validation, configs["transformation"]).initiate_data_transformation()
+        transformation_seconds = time.perf_counter() - start
+        trainer = ModelTrainer(transformation, configs["trainer"]).initiate_model_trainer()
+        resampling = transformation.resampling_report["train"]
+        metrics = trainer.metric_artifact
+        results.put({"strategy": name, "rows": rows,
+                     "resample_s": resampling["seconds"],
+                     "transform_s": round(transformation_seconds, 2),
+                     "train_s": round(time.perf_counter() - start - transformation_seconds, 2),
+                     "peak_mb": round(peak_rss_mb() - baseline, 1),
+                     "train_rows": resampling["rows_after"],
+                     "f1": round(metrics.f1_score, 4),
+                     "precision": round(metrics.precesion_score, 4),
+                     "recall": round(metrics.recall_score, 4)})
+
+
+def run(rows: int, n_estimators: int, strategies: list) -> list:
+    context = multiprocessing.get_context("spawn")
+    report = []
+    for name in strategies:
+        results = context.Queue()
+        process = context.Process(target=_run, args=(name, rows, n_estimators, results))
+        process.start()
+        report.append(results.get())
+        process.join()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--n-estimators", type=int, default=20)
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES))
+    args = parser.parse_args()
+
+    results = run(args.rows, args.n_estimators, args.strategies)
+    print_table(results, list(results[0].keys()))
@@ -0,0 +1,75 @@
+"""
+Time and peak memory of the transformation stage with the splits in memory versus streamed
+chunk_rows rows at a time into memory mapped .npy files. The data is written once; every mode
+transforms it in a fresh process, so the peak memory of one does not hide another's.
+
+    python -m benchmarks.bench_streaming_transformation --rows 2000000 --chunk-rows 50000 200000
+"""
+import argparse
+import multiprocessing
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import make_vehicle_dataframe, make_stage_configs, write_ingestion_artifacts, peak_rss_mb, print_table
+
+
+def _run(mode: str, chunk_rows: int, resampling_strategy: str, run_dir: str, ingestion, results) -> None:
+    from src.components.data_transformation import DataTransformation
+    from src.entity.artifact_entity import DataValidationArtifacts
+    from src.utils.main_utils import load_numpy_array_data
+
+    configs = make_stage_configs(f"{run_dir}/{mode}_{chunk_rows}",
+                                 transformation_params={"streaming": mode == "streaming", "chunk_rows": chunk_rows,
+                                                        "resampling_strategy": resampling_strategy, "resample_test": False})
+    validation = DataValidationArtifacts(validation_status=True, message="", validation_report_file_path="")
+
+    # the peak RSS growth misses working sets smaller than what the imports already took, the
+    # allocations traced by tracemalloc (Python objects and numpy buffers) do not
+    baseline = peak_rss_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    transformation = DataTransformation(ingestion, validation, configs["transformation"]).initiate_data_transformation()
+    seconds = time.perf_counter() - start
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    peak = peak_rss_mb() - baseline
+
+    # what the trainer does with the saved arrays: map them instead of reading them
+    start = time.perf_counter()
+    train_arr = load_numpy_array_data(transformation.transformed_train_file, mmap_mode="r")
+    open_ms = (time.perf_counter() - start) * 1000
+    results.put({"mode": mode, "chunk_rows": chunk_rows if mode == "streaming" else "-",
+                 "rows": ingestion.train_rows + ingestion.test_rows,
+                 "train_rows_out": len(train_arr),
+                 "transform_s": round(seconds, 2),
+                 "peak_rss_mb": round(peak, 1),
+                 "peak_traced_mb": round(traced_peak / 2 ** 20, 1),
+                 "array_mb": round(train_arr.nbytes / 2 ** 20, 1),
+                 "dtype": str(train_arr.dtype),
+                 "mmap_open_ms": round(open_ms, 2)})
+
+
+def run(rows: int, chunk_rows_list: list, resampling_strategy: str) -> list:
+    context = multiprocessing.get_context("spawn")
+    report = []
+    with tempfile.TemporaryDirectory() as run_dir:
+        ingestion = write_ingestion_artifacts(make_vehicle_dataframe(rows), run_dir)
+        for mode, chunk_rows in [("in_memory", chunk_rows_list[0])] + [("streaming", size) for size in chunk_rows_list]:
+            results = context.Queue()
+            process = context.Process(target=_run, args=(mode, chunk_rows, resampling_strategy, run_dir, ingestion, results))
+            process.start()
+            report.append(results.get())
+            process.join()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-rows", type=int, nargs="+", default=[50_000, 200_000])
+    parser.add_argument("--resampling-strategy", default="random_under", help="none, class_weight or random_under")
+    args = parser.parse_args()
+
+    results = run(args.rows, args.chunk_rows, args.resampling_strategy)
+    print_table(results, list(results[0].keys()))
@@ -0,0 +1,83 @@
+"""
+Helpers shared by the benchmark scripts.
+Run the benchmarks from the project root, e.g. `python -m benchmarks.bench_artifact_formats`.
+"""
+import numpy as np
+import pandas as pd
+
+from src.utils.dag_executor import peak_rss_mb
+
+
+def make_vehicle_dataframe(rows: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Synthetic data with the columns, value ranges and class balance of Proj1-Data
+    """
+    rng = np.random.default_rng(seed)
+    age = rng.integers(20, 86, size=rows)
+    previously_insured = rng.integers(0, 2, size=rows)
+    vehicle_damage = rng.choice(["Yes", "No"], size=rows)
+    vehicle_age = rng.choice(["< 1 Year", "1-2 Year", "> 2 Years"], size=rows, p=[0.43, 0.53, 0.04])
+
+    # the response depends on the features roughly like in the real data, about 12% positives
+    logit = (-2.4 + 2.2 * (vehicle_damage == "Yes") - 3.5 * previously_insured
+             - 0.02 * np.abs(age - 42) + 0.6 * (vehicle_age != "< 1 Year"))
+    response = (rng.random(rows) < 1 / (1 + np.exp(-logit))).astype(int)
+
+    return pd.DataFrame({
+        "id": np.arange(1, rows + 1),
+        "Gender": rng.choice(["Male", "Female"], size=rows, p=[0.54, 0.46]),
+        "Age": age,
+        "Driving_License": rng.choice([0, 1], size=rows, p=[0.002, 0.998]),
+        "Region_Code": rng.integers(0, 53, size=rows).astype(float),
+        "Previously_Insured": previously_insured,
+        "Vehicle_Age": vehicle_age,
+        "Vehicle_Damage": vehicle_damage,
+        "Annual_Premium": np.round(rng.gamma(4.0, 7600.0, size=rows) + 2630.0),
+        "Policy_Sales_Channel": rng.integers(1, 164, size=rows).astype(float),
+        "Vintage": rng.integers(10, 300, size=rows),
+        "Response": response,
+    })
+
+
+def print_table(rows: list, columns: list) -> None:
+    widths = [max(len(str(column)), *(len(f"{row[column]}") for row in rows)) for column in columns]
+    print("  ".join(str(column).ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(f"{row[column]}".ljust(width) for column, width in zip(columns, widths)))
+
+
+def make_stage_configs(run_dir: str, transformation_params: dict = None, **trainer_params) -> dict:
+    """
+    Validation, transformation and trainer configs whose artifacts all go under run_dir
+    """
+    from src.entity.config_entity import DataValidationConfig, DataTransformationConfig, ModelTraninerConfig
+
+    return {
+        "validation": DataValidationConfig(artifact_dir=run_dir),
+        "transformation": DataTransformationConfig(artifact_dir=run_dir, **(transformation_params or {})),
+        "trainer": ModelTraninerConfig(artifact_dir=run_dir, **trainer_params),
+    }
+
+
+def write_ingestion_artifacts(dataframe: pd.DataFrame, run_dir: str, file_format: str = "feather", test_ratio: float = 0.25,
+                              keep_in_memory: bool = False):
+    """
+    Compacts and splits the data like DataIngestion and writes the train and test files, returning
+    their artifact. keep_in_memory also attaches the splits, as the in-memory hand-off does.
+    """
+    import os
+    from src.constants import SCHEMA_FILE_PATH
+    from src.entity.artifact_entity import DataIngestionArtifacts
+    from src.utils.main_utils import hash_split_mask, save_dataframe, with_file_format, apply_schema_dtypes, read_yaml_file
+
+    dataframe = apply_schema_dtypes(dataframe, read_yaml_file(SCHEMA_FILE_PATH))
+    test_mask = hash_split_mask(dataframe["id"].to_numpy(), test_ratio)
+    train_path = with_file_format(os.path.join(run_dir, "data_ingestion", "train.csv"), file_format)
+    test_path = with_file_format(os.path.join(run_dir, "data_ingestion", "test.csv"), file_format)
+    save_dataframe(train_path, dataframe[~test_mask])
+    save_dataframe(test_path, dataframe[test_mask])
+    artifact = DataIngestionArtifacts(trained_file_path=train_path, test_file_path=test_path,
+                                      train_rows=int((~test_mask).sum()), test_rows=int(test_mask.sum()))
+    if keep_in_memory:
+        artifact.train_df, artifact.test_df = dataframe[~test_mask], dataframe[test_mask]
+    return artifact
@@ -1,5 +1,7 @@
 from src.pipline.training_pipeline import TrainPipeline
 
-pipeline = TrainPipeline()
+# the guard lets worker processes of the pipeline import this module without starting a new run
+if __name__ == "__main__":
+    pipeline = TrainPipeline()
 
-pipeline.run_pipeline()
\ No newline at end of file
+    pipeline.run_pipeline()
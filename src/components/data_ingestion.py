@@ -1,53 +1,174 @@
 import os
 import sys
+from dataclasses import asdict
 
+from typing import Optional
 
+import pandas as pd
 from pandas import DataFrame
 from sklearn.model_selection import train_test_split
 
+from src.constants import SCHEMA_FILE_PATH, TARGET_COLUMN
 from src.entity.config_entity import DataIngestionConfig
 from src.entity.artifact_entity import DataIngestionArtifacts
 from src.exception import MyException
 from src.logger import logging
 from src.data_access.proj1_data import Proj1Data
+from src.components.feature_store_sync import load_live_feature_store
+from src.utils.artifact_store import ArtifactStore
+from src.utils.main_utils import read_yaml_file, write_yaml_file, save_dataframe, apply_schema_dtypes, \
+    hash_split_mask, get_split_keys
 
 class DataIngestion:
-    def __init__(self,data_ingestion_config:DataIngestionConfig = DataIngestionConfig()):
+    def __init__(self,data_ingestion_config: Optional[DataIngestionConfig] = None,
+                 artifact_store: Optional[ArtifactStore] = None):
         try:
             logging.info("giving config to DataIngestion Class")
-            self.data_ingestion_config = data_ingestion_config
+            # a default built here, not at import, gets a run directory of its own
+            self.data_ingestion_config = data_ingestion_config or DataIngestionConfig()
+            self.artifact_store = artifact_store or ArtifactStore()
+            self._splits = {}
+            self._schema_config = read_yaml_file(file_path=SCHEMA_FILE_PATH)
+            self.sample_report = None
+            self.row_counts = {}
+            self.watermark = None
         except Exception as e:
             raise MyException(e,sys)
         
+    @property
+    def is_sampling(self) -> bool:
+        return self.data_ingestion_config.sample_size is not None or self.data_ingestion_config.sample_fraction is not None
+
+    def _sample_dataframe(self, dataframe: DataFrame) -> DataFrame:
+        """
+        Samples a DataFrame that is already in memory (live feature store) with the configured seed
+        """
+        config = self.data_ingestion_config
+        if config.sample_fraction is not None:
+            fraction = config.sample_fraction
+        else:
+            fraction = min(1.0, config.sample_size / max(len(dataframe), 1))
+        if config.sample_stratify:
+            sample = dataframe.groupby(TARGET_COLUMN, group_keys=False, observed=True).sample(frac=fraction, random_state=config.sample_seed)
+        else:
+            sample = dataframe.sample(frac=fraction, random_state=config.sample_seed)
+        self.sample_report = {"method": "pandas", "sample_size": config.sample_size, "sample_fraction": config.sample_fraction,
+                              "seed": config.sample_seed, "stratify_column": TARGET_COLUMN if config.sample_stratify else None,
+                              "population_rows": len(dataframe), "sample_rows": len(sample)}
+        return sample.reset_index(drop=True)
+
     def export_data_into_feature_store(self) -> DataFrame:
         try:
-            logging.info(f"Exporting data from mongodb")
-            my_data = Proj1Data()
-            dataframe = my_data.export_collection_as_dataframe(collection_name= self.data_ingestion_config.collection_name)
+            config = self.data_ingestion_config
+            if config.since_object_id is not None and (config.use_live_feature_store or self.is_sampling):
+                raise ValueError("Exporting the documents newer than a watermark needs the full export from mongodb, "
+                                 "without sampling or the live feature store")
+            if config.use_live_feature_store:
+                logging.info(f"Reading data from the live feature store, no export needed")
+                dataframe = load_live_feature_store(config.live_feature_store_dir)
+                if self.is_sampling:
+                    dataframe = self._sample_dataframe(dataframe)
+            else:
+                my_data = Proj1Data()
+                if self.is_sampling:
+                    logging.info(f"Exporting a sample of the data from mongodb")
+                    dataframe = my_data.sample_collection_as_dataframe(collection_name= config.collection_name,
+                                                                       sample_size= config.sample_size,
+                                                                       sample_fraction= config.sample_fraction,
+                                                                       method= config.sample_method,
+                                                                       seed= config.sample_seed,
+                                                                       stratify_column= TARGET_COLUMN if config.sample_stratify else None)
+                    self.sample_report = my_data.last_sample_report
+                else:
+                    # documents inserted during the export are left to the next run
+                    self.watermark = my_data.latest_object_id(config.collection_name)
+                    logging.info(f"Exporting data from mongodb after {config.since_object_id} up to {self.watermark}")
+                    dataframe = my_data.export_collection_as_dataframe(collection_name= config.collection_name,
+                                                                       server_side_projection= config.server_side_projection,
+                                                                       since_object_id= config.since_object_id,
+                                                                       until_object_id= self.watermark)
+                    if config.since_object_id is not None and dataframe.empty:
+                        raise ValueError(f"No documents were inserted after the watermark {config.since_object_id}")
+                self.write_ingestion_report(transfer_report= asdict(my_data.last_transfer_report))
+            if self.sample_report is not None:
+                self.write_ingestion_report(sample= self.sample_report)
             logging.info(f"Shape of Datafame : {dataframe.shape}")
-            feature_store_file_path = self.data_ingestion_config.feature_store_file_path
-            dir_path  = os.path.dirname(feature_store_file_path)
-            os.makedirs(dir_path,exist_ok=True)
+            self.row_counts["source_rows"] = (self.sample_report or {}).get("population_rows", len(dataframe))
+            dataframe = apply_schema_dtypes(dataframe, self._schema_config, name="exported data")
+            self.write_ingestion_report(memory_footprint_mb=dataframe.attrs["memory_footprint_mb"])
+            feature_store_file_path = config.feature_store_file_path
             logging.info(f"Saving exported data into feature store file path: {feature_store_file_path}")
-            dataframe.to_csv(feature_store_file_path,index=False , header=True)
+            self.artifact_store.save(save_dataframe, feature_store_file_path, dataframe)
             return dataframe
         except Exception as e:
             raise MyException(e,sys)
             
         
+    def write_ingestion_report(self, **sections) -> None:
+        """
+        Merges the given sections into the ingestion report of this run
+        """
+        try:
+            report_file_path = self.data_ingestion_config.ingestion_report_file_path
+            report = {}
+            if os.path.exists(report_file_path):
+                report = read_yaml_file(report_file_path) or {}
+            report.update(sections)
+            write_yaml_file(report_file_path, report, replace=True)
+        except Exception as e:
+            raise MyException(e,sys)
+
+    def assign_test_split(self, data_frame: DataFrame):
+        """
+        Returns a boolean mask of the rows that belong to the test set.
+        In "hash" mode the assignment depends only on each record's key, so it can be applied
+        to any chunk of a stream and a record keeps its side across runs.
+        """
+        config = self.data_ingestion_config
+        keys = get_split_keys(data_frame, list(config.split_key_columns))
+        return hash_split_mask(keys, config.train_test_split_ratio, salt=config.split_salt)
+
+    def _split_class_ratios(self, data_frame: DataFrame, test_mask) -> dict:
+        """
+        Returns the share of each target class that went to the test set. Hashing does not look at
+        the target, so every class is split at the configured ratio up to sampling noise.
+        """
+        if TARGET_COLUMN not in data_frame.columns:
+            return {}
+        test_share = pd.Series(test_mask, index=data_frame.index).groupby(data_frame[TARGET_COLUMN], observed=True).mean()
+        return {str(target_class): round(float(share), 4) for target_class, share in test_share.items()}
+
     def split_data_as_train_test(self,data_frame : DataFrame) ->None:
         logging.info("Entered into train test Split  of data Ingestion")
         try:
-            train_set, test_set = train_test_split(data_frame,test_size= self.data_ingestion_config.train_test_split_ratio)
-            logging.info("Performed train test split on the given dataset")
+            config = self.data_ingestion_config
+            if config.split_mode == "hash":
+                test_mask = self.assign_test_split(data_frame)
+                train_set, test_set = data_frame[~test_mask], data_frame[test_mask]
+                class_ratios = self._split_class_ratios(data_frame, test_mask) if config.stratify_split else {}
+                logging.info(f"Performed hash based train test split, test share per class: {class_ratios}")
+            elif config.split_mode == "random":
+                stratify = data_frame[TARGET_COLUMN] if config.stratify_split else None
+                train_set, test_set = train_test_split(data_frame,test_size= config.train_test_split_ratio,
+                                                       random_state= config.random_state, stratify= stratify)
+                class_ratios = {}
+                logging.info("Performed random train test split on the given dataset")
+            else:
+                raise ValueError(f"Unknown split mode {config.split_mode}, expected 'hash' or 'random'")
+
+            self.write_ingestion_report(split={"mode": config.split_mode,
+                                               "test_ratio": config.train_test_split_ratio,
+                                               "train_rows": len(train_set),
+                                               "test_rows": len(test_set),
+                                               "test_share_per_class": class_ratios})
             logging.info(
                             "Exited split_data_as_train_test method of Data_Ingestion class"
                         )
             
-            dir_path = os.path.dirname(self.data_ingestion_config.training_file_path)
-            os.makedirs(dir_path,exist_ok=True)
-            train_set.to_csv(self.data_ingestion_config.training_file_path,index=False,header =True)
-            test_set.to_csv(self.data_ingestion_config.testing_file_path,index = False, header = True)
+            self.row_counts.update(train_rows=len(train_set), test_rows=len(test_set))
+            self._splits = {"train_df": self.artifact_store.keep(train_set), "test_df": self.artifact_store.keep(test_set)}
+            self.artifact_store.save(save_dataframe, config.training_file_path, train_set)
+            self.artifact_store.save(save_dataframe, config.testing_file_path, test_set)
             
             logging.info(f"Exported train and test file path")
         except Exception as e:
@@ -68,7 +189,10 @@ class DataIngestion:
             
             
             data_ingestion_artifact = DataIngestionArtifacts(trained_file_path= self.data_ingestion_config.training_file_path,
-                                                             test_file_path= self.data_ingestion_config.testing_file_path)
+                                                             test_file_path= self.data_ingestion_config.testing_file_path,
+                                                             sample_report= self.sample_report,
+                                                             watermark= self.watermark,
+                                                             **self.row_counts, **self._splits)
             
             return data_ingestion_artifact
         except Exception as e:
@@ -1,25 +1,40 @@
+import os
 import sys
+from typing import Optional
+
 import pandas as pd
 import numpy as np
-from imblearn.combine import SMOTEENN
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler,MinMaxScaler
 from sklearn.compose import ColumnTransformer
 
 from src.logger import logging
-from src.constants import TARGET_COLUMN,SCHEMA_FILE_PATH,CURRENT_YEAR
+from src.constants import TARGET_COLUMN,SCHEMA_FILE_PATH,CURRENT_YEAR,DRIFT_REFERENCE_SAMPLE_ROWS
 from src.entity.config_entity import DataTransformationConfig
+from src.entity.estimator import FeatureEncoder, MyModel
+from src.components.resampling import get_resampler, resample_with_report
 from src.exception import MyException
 from src.entity.artifact_entity import DataValidationArtifacts, DataTransformedArtifacts,DataIngestionArtifacts
-from src.utils.main_utils import save_object,save_numpy_array_data, read_yaml_file
+from src.utils.main_utils import save_object,save_numpy_array_data, read_yaml_file, load_dataframe, get_model_columns, \
+    iter_dataframe_chunks, create_numpy_array_memmap, compact_target_dtype
+from src.utils.dag_executor import DagExecutor, Task
+from src.utils.artifact_store import ArtifactStore
+from src.utils.drift_utils import build_reference_profile, save_reference_profile, RowSample
 
 
 class DataTransformation:
     def __init__(self,data_ingestion_artifacts: DataIngestionArtifacts,
                  data_validation_artifacts: DataValidationArtifacts,
-                 data_transformation_config: DataTransformationConfig):
-        
+                 data_transformation_config: DataTransformationConfig,
+                 artifact_store: Optional[ArtifactStore] = None,
+                 fitted_model: Optional[MyModel] = None):
+        """
+        fitted_model: model whose feature encoder and preprocessor are reused instead of fitted,
+                      so a model updated incrementally keeps the features it was trained on
+        """
         try:
+            self.artifact_store = artifact_store or ArtifactStore()
+            self.fitted_model = fitted_model
             self.data_ingestion_artifacts = data_ingestion_artifacts
             self.data_validation_artifacts = data_validation_artifacts
             self.data_transformation_config = data_transformation_config
@@ -29,9 +44,9 @@ class DataTransformation:
             raise MyException(e, sys)
     
     @staticmethod
-    def read_data(file_path) -> pd.DataFrame:
+    def read_data(file_path, columns=None, schema_config: dict = None) -> pd.DataFrame:
         try:
-            return pd.read_csv(file_path)
+            return load_dataframe(file_path, columns=columns, schema_config=schema_config)
         except Exception as e:
             raise MyException(e, sys)
         
@@ -61,35 +76,179 @@ class DataTransformation:
         except Exception as e:
             raise MyException(e, sys)
     
-    def _map_gender_column(self,df):
-        logging.info("Mapping 'Gender' column to binary values")
-        df['Gender'] = df['Gender'].map({'Female': 0, 'Male': 1}).astype(int)
-        return df
-    
-    def _create_dummy_columns(self,df):
-        logging.info("Creating dummy varialnes for categorical features")
-        df = pd.get_dummies(df,drop_first=True)
-        return df
-    
-    def _rename_columns(self, df):
-        """Rename specific columns and ensure integer types for dummy columns."""
-        logging.info("Renaming specific columns and casting to int")
-        df = df.rename(columns={
-            "Vehicle_Age_< 1 Year": "Vehicle_Age_lt_1_Year",
-            "Vehicle_Age_> 2 Years": "Vehicle_Age_gt_2_Years"
-        })
-        for col in ["Vehicle_Age_lt_1_Year", "Vehicle_Age_gt_2_Years", "Vehicle_Damage_Yes"]:
-            if col in df.columns:
-                df[col] = df[col].astype('int')
-        return df
-
-    def _drop_id_column(self, df):
-        """Drop the 'id' column if it exists."""
-        logging.info("Dropping 'id' column")
-        drop_col = self._schema_config['drop_columns']
-        if drop_col in df.columns:
-            df = df.drop(drop_col, axis=1)
-        return df
+    def _save_reference_profile(self, input_feature_df: pd.DataFrame) -> None:
+        """Saves the profile of the raw training features, new data is later checked for drift against it"""
+        columns = [column for column in input_feature_df.columns if column not in self._schema_config['drop_columns']]
+        profile_file_path = self.data_transformation_config.reference_profile_file_path
+        os.makedirs(os.path.dirname(profile_file_path), exist_ok=True)
+        save_reference_profile(profile_file_path, build_reference_profile(input_feature_df, columns))
+
+    def _load_split(self, file_path: str, df: Optional[pd.DataFrame] = None, save_profile: bool = False):
+        """
+        Reads the model columns of one split (unless it was handed over in memory).
+        Returns the raw input features and the target.
+        """
+        if df is None:
+            df = self.read_data(file_path=file_path, columns=get_model_columns(self._schema_config),
+                                schema_config=self._schema_config)
+        else:
+            df = df[get_model_columns(self._schema_config)]
+        input_feature_df = df.drop(columns=[TARGET_COLUMN])
+        target_feature_df = df[TARGET_COLUMN]
+        if save_profile:
+            self._save_reference_profile(input_feature_df)
+        return input_feature_df, target_feature_df
+
+    def _count_classes(self, file_path: str) -> dict:
+        """Rows per class of a split, reading the target column only"""
+        class_counts = {}
+        for chunk in iter_dataframe_chunks(file_path, self.data_transformation_config.chunk_rows, columns=[TARGET_COLUMN]):
+            labels, counts = np.unique(chunk[TARGET_COLUMN].to_numpy(), return_counts=True)
+            for label, count in zip(labels.tolist(), counts.tolist()):
+                class_counts[label] = class_counts.get(label, 0) + count
+        return class_counts
+
+    def _fit_streaming(self, file_path: str):
+        """
+        First pass over the training split, chunk by chunk: fits the feature encoder and the scalers
+        with partial_fit, counts the classes and samples the rows of the reference profile.
+        Returns the fitted encoder and preprocessor with the class counts.
+        """
+        num_features = self._schema_config['num_features']
+        mm_columns = self._schema_config['mm_columns']
+        feature_encoder = FeatureEncoder(self._schema_config)
+        scalers = {"StandardScaler": StandardScaler(), "MinMaxScaler": MinMaxScaler()}
+        profile_sample = RowSample(DRIFT_REFERENCE_SAMPLE_ROWS)
+        class_counts, first_chunk = {}, None
+        for chunk in iter_dataframe_chunks(file_path, self.data_transformation_config.chunk_rows,
+                                           columns=get_model_columns(self._schema_config)):
+            input_feature_df = chunk.drop(columns=[TARGET_COLUMN])
+            feature_encoder.partial_fit(input_feature_df)
+            # the scaled columns are numeric in the raw data, the encoder passes them through
+            scalers["StandardScaler"].partial_fit(input_feature_df[num_features])
+            scalers["MinMaxScaler"].partial_fit(input_feature_df[mm_columns])
+            profile_sample.update(input_feature_df)
+            labels, counts = np.unique(chunk[TARGET_COLUMN].to_numpy(), return_counts=True)
+            for label, count in zip(labels.tolist(), counts.tolist()):
+                class_counts[label] = class_counts.get(label, 0) + count
+            if first_chunk is None:
+                first_chunk = input_feature_df
+        logging.info(f"Encoder and scalers fitted on {sum(class_counts.values())} rows in chunks")
+
+        # the column transformer is laid out on one chunk, then gets the scalers fitted on all of them
+        preprocessor = self.get_data_transformer_object()
+        column_transformer = preprocessor.named_steps["Preprocessor"]
+        column_transformer.fit(feature_encoder.transform(first_chunk))
+        column_transformer.transformers_ = [(name, scalers.get(name, transformer), columns)
+                                            for name, transformer, columns in column_transformer.transformers_]
+        self._save_reference_profile(profile_sample.dataframe())
+        return feature_encoder, preprocessor, class_counts
+
+    def _write_streaming(self, file_path: str, array_file_path: str, target_file_path: str, rows: int,
+                         target_dtype, feature_encoder: FeatureEncoder, preprocessor: Pipeline, select=None) -> None:
+        """
+        Second pass over a split: encodes and transforms it chunk by chunk into .npy files mapped in
+        memory, one for the features and one for the target. select gives the rows of a chunk to keep, if any.
+        """
+        array = create_numpy_array_memmap(array_file_path, (rows, len(feature_encoder.feature_names)),
+                                          dtype=self.data_transformation_config.features_dtype)
+        target_array = create_numpy_array_memmap(target_file_path, (rows,), dtype=target_dtype)
+        row = 0
+        for chunk in iter_dataframe_chunks(file_path, self.data_transformation_config.chunk_rows,
+                                           columns=get_model_columns(self._schema_config)):
+            target = chunk[TARGET_COLUMN].to_numpy()
+            if select is not None:
+                mask = select(target)
+                chunk, target = chunk[mask], target[mask]
+            features = preprocessor.transform(feature_encoder.transform(chunk.drop(columns=[TARGET_COLUMN])))
+            array[row:row + len(chunk)] = features
+            target_array[row:row + len(chunk)] = target
+            row += len(chunk)
+        array.flush()
+        target_array.flush()
+        del array, target_array
+        logging.info(f"Wrote {row} transformed rows to {array_file_path}")
+
+    def _streaming_resampling_report(self, resampler, class_counts: dict, rows: int, split: str) -> dict:
+        report = {"split": split, "seconds": None, "peak_rss_delta_mb": None,
+                  "rows_before": sum(class_counts.values()), "rows_after": rows,
+                  "class_counts_before": {str(label): count for label, count in sorted(class_counts.items())}}
+        logging.info(f"Resampled {split} data with {resampler.name} while streaming: {report}")
+        return report
+
+    def _unresampled_train_files(self, resampler) -> tuple:
+        """Where the training rows before resampling are, None when they are not kept"""
+        config = self.data_transformation_config
+        if not config.keep_unresampled_train:
+            return None, None
+        if not resampler.changes_rows:
+            return config.transformed_train_file_path, config.transformed_train_target_file_path
+        return config.unresampled_train_file_path, config.unresampled_train_target_file_path
+
+    def _initiate_streaming_transformation(self) -> DataTransformedArtifacts:
+        """
+        Method Name :   _initiate_streaming_transformation
+        Description :   Transforms the splits out of core, chunk_rows rows at a time: a first pass fits
+                        the encoder and the scalers, a second pass writes the transformed rows straight
+                        into the .npy files, so memory is bounded by the chunk size and not the data.
+                        Only the resampling strategies that select rows can be applied this way.
+
+        Output      :   DataTransformedArtifacts with the arrays on disk only
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        config = self.data_transformation_config
+        if self.fitted_model is not None:
+            raise ValueError("Reusing the encoder and preprocessor of a previous model needs the in-memory transformation")
+        # the splits are read back from their files, which may still be written in the background
+        self.artifact_store.flush()
+        train_file_path = self.data_ingestion_artifacts.trained_file_path
+        test_file_path = self.data_ingestion_artifacts.test_file_path
+        resampler = get_resampler(config)
+        if not resampler.streamable:
+            raise ValueError(f"{resampler.name} needs the whole training matrix in memory, use random_under, "
+                             f"class_weight or none with the streaming transformation")
+
+        feature_encoder, preprocessor, train_class_counts = self._fit_streaming(train_file_path)
+        test_class_counts = self._count_classes(test_file_path)
+
+        select_train, train_rows = resampler.stream_selector(train_class_counts)
+        resampling_report = {"strategy": resampler.name, "class_weight": resampler.class_weight,
+                             "resample_test": config.resample_test,
+                             "train": self._streaming_resampling_report(resampler, train_class_counts, train_rows, "train")}
+        if config.resample_test:
+            select_test, test_rows = resampler.stream_selector(test_class_counts)
+            resampling_report["test"] = self._streaming_resampling_report(resampler, test_class_counts, test_rows, "test")
+        else:
+            select_test, test_rows = None, sum(test_class_counts.values())
+
+        target_dtype = compact_target_dtype(list(train_class_counts) + list(test_class_counts))
+        self._write_streaming(train_file_path, config.transformed_train_file_path, config.transformed_train_target_file_path,
+                              train_rows, target_dtype, feature_encoder, preprocessor, select_train)
+        unresampled_train_file, unresampled_train_target_file = self._unresampled_train_files(resampler)
+        if unresampled_train_file == config.unresampled_train_file_path:
+            self._write_streaming(train_file_path, unresampled_train_file, unresampled_train_target_file,
+                                  sum(train_class_counts.values()), target_dtype, feature_encoder, preprocessor, None)
+        self._write_streaming(test_file_path, config.transformed_test_file_path, config.transformed_test_target_file_path,
+                              test_rows, target_dtype, feature_encoder, preprocessor, select_test)
+        save_object(config.transformed_object_file_path, preprocessor)
+        save_object(config.feature_encoder_file_path, feature_encoder)
+
+        logging.info("Streaming data transformation completed successfully")
+        return DataTransformedArtifacts(
+            transformed_object_file=config.transformed_object_file_path,
+            transformed_train_file=config.transformed_train_file_path,
+            transformed_test_file=config.transformed_test_file_path,
+            transformed_train_target_file=config.transformed_train_target_file_path,
+            transformed_test_target_file=config.transformed_test_target_file_path,
+            reference_profile_file=config.reference_profile_file_path,
+            feature_encoder_file=config.feature_encoder_file_path,
+            class_weight=resampler.class_weight,
+            resampling_report=resampling_report,
+            unresampled_train_file=unresampled_train_file,
+            unresampled_train_target_file=unresampled_train_target_file,
+            preprocessor=self.artifact_store.keep(preprocessor),
+            feature_encoder=self.artifact_store.keep(feature_encoder),
+        )
 
     def initiate_data_transformation(self) -> DataTransformedArtifacts:
         """
@@ -99,65 +258,104 @@ class DataTransformation:
             logging.info("Data Transformation Started !!!")
             if not self.data_validation_artifacts.validation_status:
                 raise Exception(self.data_validation_artifacts.message)
+            if self.data_transformation_config.streaming:
+                return self._initiate_streaming_transformation()
 
-            # Load train and test data
-            train_df = self.read_data(file_path=self.data_ingestion_artifacts.trained_file_path)
-            test_df = self.read_data(file_path=self.data_ingestion_artifacts.test_file_path)
-            logging.info("Train-Test data loaded")
-
-            input_feature_train_df = train_df.drop(columns=[TARGET_COLUMN], axis=1)
-            target_feature_train_df = train_df[TARGET_COLUMN]
+            # Load train and test data, each split on its own
+            results = DagExecutor(max_concurrency=2).run([
+                Task("train", lambda: self._load_split(self.data_ingestion_artifacts.trained_file_path,
+                                                               self.data_ingestion_artifacts.train_df,
+                                                               save_profile=True)),
+                Task("test", lambda: self._load_split(self.data_ingestion_artifacts.test_file_path,
+                                                              self.data_ingestion_artifacts.test_df)),
+            ])
+            input_feature_train_df, target_feature_train_df = results["train"]
+            input_feature_test_df, target_feature_test_df = results["test"]
 
-            input_feature_test_df = test_df.drop(columns=[TARGET_COLUMN], axis=1)
-            target_feature_test_df = test_df[TARGET_COLUMN]
-            logging.info("Input and Target cols defined for both train and test df.")
-
-            # Apply custom transformations in specified sequence
-            input_feature_train_df = self._map_gender_column(input_feature_train_df)
-            input_feature_train_df = self._drop_id_column(input_feature_train_df)
-            input_feature_train_df = self._create_dummy_columns(input_feature_train_df)
-            input_feature_train_df = self._rename_columns(input_feature_train_df)
-
-            input_feature_test_df = self._map_gender_column(input_feature_test_df)
-            input_feature_test_df = self._drop_id_column(input_feature_test_df)
-            input_feature_test_df = self._create_dummy_columns(input_feature_test_df)
-            input_feature_test_df = self._rename_columns(input_feature_test_df)
-            logging.info("Custom transformations applied to train and test data")
+            # the encoder is fitted on the training data once, evaluation and serving reuse it from the model
+            if self.fitted_model is not None:
+                feature_encoder = self.fitted_model.feature_encoder
+            else:
+                feature_encoder = FeatureEncoder(self._schema_config).fit(input_feature_train_df)
+            encoded_train_df = feature_encoder.transform(input_feature_train_df)
+            encoded_test_df = feature_encoder.transform(input_feature_test_df)
+            logging.info("Feature encoder applied to train and test data")
 
             logging.info("Starting data transformation")
-            preprocessor = self.get_data_transformer_object()
-            logging.info("Got the preprocessor object")
+            if self.fitted_model is not None:
+                preprocessor = self.fitted_model.preprocessing_object
+                logging.info("Reusing the preprocessor of the previous model")
+                input_feature_train_arr = preprocessor.transform(encoded_train_df)
+            else:
+                preprocessor = self.get_data_transformer_object()
+                logging.info("Got the preprocessor object")
 
-            logging.info("Initializing transformation for Training-data")
-            input_feature_train_arr = preprocessor.fit_transform(input_feature_train_df)
+                logging.info("Initializing transformation for Training-data")
+                input_feature_train_arr = preprocessor.fit_transform(encoded_train_df)
             logging.info("Initializing transformation for Testing-data")
-            input_feature_test_arr = preprocessor.transform(input_feature_test_df)
+            input_feature_test_arr = preprocessor.transform(encoded_test_df)
             logging.info("Transformation done end to end to train-test df.")
 
-            logging.info("Applying SMOTEENN for handling imbalanced dataset.")
-            smt = SMOTEENN(sampling_strategy="minority")
-            input_feature_train_final, target_feature_train_final = smt.fit_resample(
-                input_feature_train_arr, target_feature_train_df
-            )
-            input_feature_test_final, target_feature_test_final = smt.fit_resample(
-                input_feature_test_arr, target_feature_test_df
+            resampler = get_resampler(self.data_transformation_config)
+            logging.info(f"Applying {resampler.name} for handling imbalanced dataset.")
+            input_feature_train_final, target_feature_train_final, train_report = resample_with_report(
+                resampler, input_feature_train_arr, target_feature_train_df, "train"
             )
-            logging.info("SMOTEENN applied to train-test df.")
+            resampling_report = {"strategy": resampler.name, "class_weight": resampler.class_weight,
+                                 "resample_test": self.data_transformation_config.resample_test, "train": train_report}
+            if self.data_transformation_config.resample_test:
+                input_feature_test_final, target_feature_test_final, resampling_report["test"] = resample_with_report(
+                    resampler, input_feature_test_arr, target_feature_test_df, "test"
+                )
+            else:
+                input_feature_test_final, target_feature_test_final = input_feature_test_arr, target_feature_test_df
+            logging.info(f"{resampler.name} applied to train-test df.")
 
-            train_arr = np.c_[input_feature_train_final, np.array(target_feature_train_final)]
-            test_arr = np.c_[input_feature_test_final, np.array(target_feature_test_final)]
-            logging.info("feature-target concatenation done for train-test df.")
+            # features and target stay apart, the features in features_dtype and the target in the
+            # smallest integer dtype of its labels, so the trainer uses them without slicing or converting
+            features_dtype = self.data_transformation_config.features_dtype
+            train_arr = np.ascontiguousarray(input_feature_train_final, dtype=features_dtype)
+            test_arr = np.ascontiguousarray(input_feature_test_final, dtype=features_dtype)
+            train_target_arr, test_target_arr = np.asarray(target_feature_train_final), np.asarray(target_feature_test_final)
+            target_dtype = compact_target_dtype(np.concatenate([np.unique(train_target_arr), np.unique(test_target_arr)]))
+            train_target_arr, test_target_arr = train_target_arr.astype(target_dtype), test_target_arr.astype(target_dtype)
+            logging.info(f"Features converted to {features_dtype} and targets to {target_dtype} for train-test df.")
 
-            save_object(self.data_transformation_config.transformed_object_file_path, preprocessor)
-            save_numpy_array_data(self.data_transformation_config.transformed_train_file_path, array=train_arr)
-            save_numpy_array_data(self.data_transformation_config.transformed_test_file_path, array=test_arr)
+            config = self.data_transformation_config
+            self.artifact_store.save(save_object, config.transformed_object_file_path, preprocessor)
+            self.artifact_store.save(save_object, config.feature_encoder_file_path, feature_encoder)
+            self.artifact_store.save(save_numpy_array_data, config.transformed_train_file_path, array=train_arr)
+            self.artifact_store.save(save_numpy_array_data, config.transformed_test_file_path, array=test_arr)
+            self.artifact_store.save(save_numpy_array_data, config.transformed_train_target_file_path, array=train_target_arr)
+            self.artifact_store.save(save_numpy_array_data, config.transformed_test_target_file_path, array=test_target_arr)
+            unresampled_train_file, unresampled_train_target_file = self._unresampled_train_files(resampler)
+            if unresampled_train_file == config.unresampled_train_file_path:
+                self.artifact_store.save(save_numpy_array_data, unresampled_train_file, array=input_feature_train_arr, dtype=features_dtype)
+                self.artifact_store.save(save_numpy_array_data, unresampled_train_target_file,
+                                         array=np.asarray(target_feature_train_df), dtype=target_dtype)
             logging.info("Saving transformation object and transformed files.")
 
             logging.info("Data transformation completed successfully")
             return DataTransformedArtifacts(
                 transformed_object_file=self.data_transformation_config.transformed_object_file_path,
                 transformed_train_file=self.data_transformation_config.transformed_train_file_path,
-                transformed_test_file=self.data_transformation_config.transformed_test_file_path
+                transformed_test_file=self.data_transformation_config.transformed_test_file_path,
+                transformed_train_target_file=self.data_transformation_config.transformed_train_target_file_path,
+                transformed_test_target_file=self.data_transformation_config.transformed_test_target_file_path,
+                reference_profile_file=self.data_transformation_config.reference_profile_file_path,
+                feature_encoder_file=self.data_transformation_config.feature_encoder_file_path,
+                class_weight=resampler.class_weight,
+                resampling_report=resampling_report,
+                unresampled_train_file=unresampled_train_file,
+                unresampled_train_target_file=unresampled_train_target_file,
+                preprocessor=self.artifact_store.keep(preprocessor),
+                feature_encoder=self.artifact_store.keep(feature_encoder),
+                train_arr=self.artifact_store.keep(train_arr),
+                test_arr=self.artifact_store.keep(test_arr),
+                train_target_arr=self.artifact_store.keep(train_target_arr),
+                test_target_arr=self.artifact_store.keep(test_target_arr),
+                test_features_df=self.artifact_store.keep(input_feature_test_df),
+                test_target=self.artifact_store.keep(target_feature_test_df)
             )
         except Exception as e:
             raise MyException(e, sys) from e
\ No newline at end of file
@@ -1,117 +1,342 @@
 import json
 import sys
 import os
+import time
 
+import numpy as np
 import pandas as pd
 
 from pandas import DataFrame
+from typing import List, Optional, Tuple
 
 from src.exception import MyException
 from src.logger import logging
-from src.utils.main_utils import read_yaml_file
+from src.utils.main_utils import read_yaml_file, load_dataframe, get_model_columns, get_schema_columns, read_columns, \
+    iter_dataframe_chunks
 from src.entity.artifact_entity import DataIngestionArtifacts , DataValidationArtifacts
 from src.entity.config_entity import DataValidationConfig
+from src.entity.s3_estimator import Proj1Estimator
 from src.constants import SCHEMA_FILE_PATH
+from src.utils.dag_executor import DagExecutor, Task
+from src.utils.drift_utils import DriftSketch, load_reference_profile
+
+def id_hashes_of(ids: pd.Series) -> np.ndarray:
+    """8 byte hashes of record ids; duplicates are found on these instead of the ids themselves"""
+    values = ids.to_numpy()
+    if values.dtype.kind in "iu":
+        values = values.astype(np.int64)
+    else:
+        values = values.astype(str).astype(object)
+    return pd.util.hash_array(values, categorize=False)
+
+
+class ColumnStats:
+    """
+    Statistics of one schema column accumulated over the chunks of a split: nulls, values that do
+    not conform to the schema type, min/max and values outside the allowed domain
+    """
+    # unexpected values quoted in the report
+    MAX_EXAMPLES = 5
+
+    def __init__(self, column: str, schema_type: str, domain: Optional[list] = None, value_range: Optional[list] = None):
+        self.column = column
+        self.schema_type = schema_type
+        self.domain = domain
+        self.value_range = value_range
+        self.rows = 0
+        self.null_count = 0
+        self.nonconforming = 0
+        self.out_of_domain = 0
+        self.examples = []
+        self.min = None
+        self.max = None
+
+    def update(self, series: pd.Series) -> None:
+        nulls = series.isna().to_numpy()
+        self.rows += len(series)
+        self.null_count += int(nulls.sum())
+        if self.schema_type != "category":
+            values = pd.to_numeric(series, errors="coerce").to_numpy(dtype="float64")
+            invalid = np.isnan(values) & ~nulls
+            if self.schema_type == "int":
+                invalid |= ~np.isnan(values) & (values != np.floor(values))
+            self.nonconforming += int(invalid.sum())
+            self._add_examples(series[invalid])
+            valid = values[~np.isnan(values) & ~invalid]
+            if len(valid):
+                self.min = float(valid.min()) if self.min is None else min(self.min, float(valid.min()))
+                self.max = float(valid.max()) if self.max is None else max(self.max, float(valid.max()))
+        if self.domain is not None:
+            outside = ~series.isin(self.domain).to_numpy() & ~nulls
+            self.out_of_domain += int(outside.sum())
+            self._add_examples(series[outside])
+
+    def _add_examples(self, values: pd.Series) -> None:
+        if len(values) and len(self.examples) < self.MAX_EXAMPLES:
+            for value in pd.unique(values.to_numpy()):
+                if value not in self.examples and len(self.examples) < self.MAX_EXAMPLES:
+                    self.examples.append(value)
+
+    @property
+    def null_rate(self) -> float:
+        return self.null_count / self.rows if self.rows else 0.0
+
+    def errors(self, max_null_rate: float, pinned_dtype: Optional[str], name: str) -> str:
+        """Returns the validation error message of the column (empty when valid)"""
+        message = ""
+        if self.null_rate > max_null_rate:
+            message += f"Column {self.column} of {name} dataframe has a null rate of {self.null_rate:.4f}, above {max_null_rate}. "
+        if self.nonconforming:
+            message += f"Column {self.column} of {name} dataframe has {self.nonconforming} values that are not {self.schema_type}. "
+        if self.out_of_domain:
+            message += f"Column {self.column} of {name} dataframe has {self.out_of_domain} values outside {self.domain}. "
+        if self.min is not None:
+            low, high = self.value_range or (None, None)
+            if pinned_dtype and pinned_dtype != "category":
+                dtype_info = np.iinfo(pinned_dtype) if pinned_dtype.startswith("int") else np.finfo(pinned_dtype)
+                low = dtype_info.min if low is None else max(low, dtype_info.min)
+                high = dtype_info.max if high is None else min(high, dtype_info.max)
+            if (low is not None and self.min < low) or (high is not None and self.max > high):
+                message += f"Column {self.column} of {name} dataframe range [{self.min}, {self.max}] is outside [{low}, {high}]. "
+        return message
+
+    def to_dict(self) -> dict:
+        return {"type": self.schema_type, "null_count": self.null_count, "null_rate": round(self.null_rate, 6),
+                "nonconforming": self.nonconforming, "out_of_domain": self.out_of_domain,
+                "min": self.min, "max": self.max, "examples": [str(value) for value in self.examples]}
+
 
 class DataValidation:
-    def __init__(self , data_ingestion_artifacts: DataIngestionArtifacts , data_validation_config: DataValidationConfig):
+    def __init__(self , data_ingestion_artifacts: Optional[DataIngestionArtifacts] , data_validation_config: DataValidationConfig):
         try:
             self.data_ingestion_artifacts = data_ingestion_artifacts
             self.data_validation_config = data_validation_config
             self._schema_config = read_yaml_file(file_path= SCHEMA_FILE_PATH)
+            self._drift_reference = None
         except Exception as e:
             raise MyException(e,sys) from e
     
-    def validate_no_of_columns(self, dataframe: DataFrame) -> bool:
+    def validate_columns(self, columns: List[str], name: str) -> str:
+        """
+        Checks the column names of a split against the schema: every schema column is present
+        and there is no column the schema does not know. Returns the error message (empty when valid).
+        """
         try:
-            status = len(dataframe.columns) == len(self._schema_config['columns'])
-            logging.info(f"Is required column present: { [status] }")
-            return status
+            schema_columns = [column for column, _ in get_schema_columns(self._schema_config)]
+            missing_columns = [column for column in schema_columns if column not in columns]
+            unexpected_columns = [column for column in columns if column not in schema_columns]
+            validation_error_msg = ""
+            if missing_columns:
+                validation_error_msg += f"Columns {missing_columns} are missing in {name} dataframe. "
+            if unexpected_columns:
+                validation_error_msg += f"Columns {unexpected_columns} of {name} dataframe are not in the schema. "
+            logging.info(f"Columns of {name} data match the schema: {not validation_error_msg}")
+            return validation_error_msg
         except Exception as e:
-            raise MyException(e,sys) from e
-    
-    def is_column_exist(self, dataframe: DataFrame) -> bool:
+            raise MyException(e, sys) from e
+
+    def validate_source_profile(self, profile: dict) -> DataValidationArtifacts:
+        """
+        Method Name :   validate_source_profile
+        Description :   Validates the server side profile of the source collection before anything is exported:
+                        the collection is not empty, every model column is present, null rates are within
+                        max_null_rate, categories are in their schema domain and numeric ranges fit the
+                        schema ranges and pinned dtypes.
+
+        Output      :   Returns the validation artifact and writes the source profile report
+        On Failure  :   Write an exception log and then raise an exception
+        """
         try:
-            dataframe_columns = dataframe.columns
-            missing_numerical_columns = []
-            missing_categorical_columns = []
-            for column in self._schema_config['numerical_columns']:
-                if column not in dataframe_columns:
-                    missing_numerical_columns.append(column)
-                    
-            for column in self._schema_config['categorical_columns']:
-                if column not in dataframe_columns:
-                    missing_categorical_columns.append(column)
-                    
-            if len(missing_numerical_columns) > 0:
-                logging(f"Missing numerical columns : {missing_numerical_columns}")
-            if len(missing_categorical_columns)> 0:
-                logging(f"Missing categorical columns : {missing_categorical_columns}")
-            return False if len(missing_categorical_columns) >0 or len(missing_numerical_columns) > 0 else True
+            validation_error_msg = ""
+            if profile["row_count"] == 0:
+                validation_error_msg += f"Collection {profile['collection']} is empty. "
+
+            pinned_dtypes = self._schema_config.get("dtypes", {})
+            for column in get_model_columns(self._schema_config):
+                column_profile = profile["columns"].get(column)
+                if column_profile is None or (profile["row_count"] and column_profile["null_rate"] >= 1):
+                    validation_error_msg += f"Column {column} is missing in the source collection. "
+                    continue
+                if column_profile["null_rate"] > self.data_validation_config.max_null_rate:
+                    validation_error_msg += (f"Column {column} has a null rate of {column_profile['null_rate']:.4f}, "
+                                             f"above {self.data_validation_config.max_null_rate}. ")
+                domain = self._schema_config.get("domains", {}).get(column)
+                if domain is not None and "frequencies" in column_profile:
+                    unexpected_values = [value for value in column_profile["frequencies"] if value not in map(str, domain)]
+                    if unexpected_values:
+                        validation_error_msg += f"Column {column} has values {unexpected_values} outside {domain}. "
+                low, high = self._schema_config.get("ranges", {}).get(column) or (None, None)
+                if column_profile.get("min") is not None and ((low is not None and column_profile["min"] < low)
+                                                              or (high is not None and column_profile["max"] > high)):
+                    validation_error_msg += (f"Column {column} range [{column_profile['min']}, {column_profile['max']}] "
+                                             f"is outside [{low}, {high}]. ")
+                dtype = pinned_dtypes.get(column)
+                if dtype and dtype != "category" and column_profile.get("min") is not None:
+                    dtype_info = np.iinfo(dtype) if dtype.startswith("int") else np.finfo(dtype)
+                    if column_profile["min"] < dtype_info.min or column_profile["max"] > dtype_info.max:
+                        validation_error_msg += (f"Column {column} range [{column_profile['min']}, {column_profile['max']}] "
+                                                 f"does not fit {dtype}. ")
+
+            validation_status = len(validation_error_msg) == 0
+            report_file_path = self.data_validation_config.source_profile_report_file_path
+            os.makedirs(os.path.dirname(report_file_path), exist_ok=True)
+            with open(report_file_path, "w") as report_file:
+                json.dump({'validation_status': validation_status,
+                           'message': validation_error_msg.strip(),
+                           'profile': profile}, report_file, indent=4, default=str)
+
+            logging.info(f"Source profile validation status: {validation_status} {validation_error_msg}")
+            return DataValidationArtifacts(validation_status=validation_status,
+                                           message=validation_error_msg.strip(),
+                                           validation_report_file_path=report_file_path)
         except Exception as e:
-            raise MyException(e, sys) from e
-        
+            raise MyException(e,sys) from e
+
     @staticmethod
-    def read_data(file_path) -> DataFrame:
+    def read_data(file_path, schema_config: dict = None) -> DataFrame:
         try:
-            return pd.read_csv(file_path)
+            return load_dataframe(file_path, schema_config=schema_config)
         except Exception as e:
             raise MyException(e,sys)  from e
+
+    def _chunks(self, file_path: str, columns: List[str], dataframe: Optional[DataFrame]):
+        chunk_rows = self.data_validation_config.chunk_rows
+        if dataframe is None:
+            yield from iter_dataframe_chunks(file_path, chunk_rows, columns=columns)
+        else:
+            for offset in range(0, len(dataframe), chunk_rows):
+                yield dataframe.iloc[offset:offset + chunk_rows][columns]
+
+    def load_drift_reference(self) -> Tuple[Optional[dict], str]:
+        """
+        Returns the reference profile new data is compared with, with where it came from: the local
+        drift_reference_file_path when set, else the profile pushed next to the production model.
+        Drift is not checked (None) when there is no reference, e.g. before the first push.
+        The reference is loaded once per DataValidation.
+        """
+        if self._drift_reference is None:
+            self._drift_reference = self._load_drift_reference()
+        return self._drift_reference
+
+    def _load_drift_reference(self) -> Tuple[Optional[dict], str]:
+        config = self.data_validation_config
+        if not config.check_drift:
+            return None, "drift check disabled"
+        if config.drift_reference_file_path:
+            return load_reference_profile(config.drift_reference_file_path), config.drift_reference_file_path
+        try:
+            reference = Proj1Estimator(bucket_name=config.drift_reference_bucket_name,
+                                       model_path=config.drift_reference_model_key_path).load_reference_profile()
+        except Exception as e:
+            logging.info(f"Reference profile of the production model not available, drift is not checked: {e}")
+            return None, "reference profile not available"
+        if reference is None:
+            return None, "production model has no reference profile"
+        return reference, f"s3://{config.drift_reference_bucket_name}/{config.drift_reference_model_key_path}"
+
+    def validate_dataframe(self, file_path: str, name: str, dataframe: Optional[DataFrame] = None,
+                           drift_sketch: Optional[DriftSketch] = None) -> dict:
+        """
+        Method Name :   validate_dataframe
+        Description :   Checks the header of one split against the schema without reading its data,
+                        then reads the split once in chunks of chunk_rows rows (or slices it when it
+                        was handed over in memory) and checks per column, with vectorized operations:
+                        dtype conformance, null rate, numeric range, domain of allowed values, and
+                        duplicate record ids. The chunks are also counted into drift_sketch when given.
         
+        Output      :   Returns the validation error message of the split (empty when valid), the
+                        column statistics and the 8 byte hashes of its ids
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            start = time.perf_counter()
+            columns = list(dataframe.columns) if dataframe is not None else read_columns(file_path)
+            validation_error_msg = self.validate_columns(columns, name)
+            domains = self._schema_config.get("domains", {})
+            ranges = self._schema_config.get("ranges", {})
+            column_stats = {column: ColumnStats(column, schema_type, domains.get(column), ranges.get(column))
+                            for column, schema_type in get_schema_columns(self._schema_config) if column in columns}
+            id_column = self._schema_config.get("id_column")
+            id_hashes, rows, chunks = [], 0, 0
+
+            for chunk in self._chunks(file_path, list(column_stats), dataframe):
+                for column, stats in column_stats.items():
+                    stats.update(chunk[column])
+                if id_column in chunk.columns:
+                    id_hashes.append(id_hashes_of(chunk[id_column]))
+                if drift_sketch is not None:
+                    drift_sketch.update(chunk)
+                rows += len(chunk)
+                chunks += 1
+
+            id_hashes = np.concatenate(id_hashes) if id_hashes else np.empty(0, dtype=np.uint64)
+            pinned_dtypes = self._schema_config.get("dtypes", {})
+            for stats in column_stats.values():
+                validation_error_msg += stats.errors(self.data_validation_config.max_null_rate,
+                                                     pinned_dtypes.get(stats.column), name)
+            duplicate_ids = int(pd.Series(id_hashes).duplicated().sum())
+            if duplicate_ids:
+                validation_error_msg += f"{duplicate_ids} duplicate {id_column} values in {name} dataframe. "
+
+            seconds = time.perf_counter() - start
+            logging.info(f"Validated {rows} rows of {name} data in {chunks} chunks in {seconds:.2f}s")
+            return {"message": validation_error_msg,
+                    "report": {"rows": rows, "chunks": chunks, "seconds": round(seconds, 3),
+                               "duplicate_ids": duplicate_ids,
+                               "columns": {column: stats.to_dict() for column, stats in column_stats.items()}},
+                    "id_hashes": id_hashes}
+        except Exception as e:
+            raise MyException(e,sys)  from e
+
     def initiate_data_validation(self) -> DataValidationArtifacts:
         try:
-            validation_error_msg = ""
             logging.info("Starting Data Validation")
-            
-            train_df , test_df = (DataValidation.read_data(self.data_ingestion_artifacts.trained_file_path),
-                                   DataValidation.read_data(self.data_ingestion_artifacts.test_file_path))
-            
-            status = self.validate_no_of_columns(dataframe= train_df)
-            if not status:
-                validation_error_msg +=f"Columns are missing in training dataframe"
-            else:
-                logging.info(f"All required columns are presnet in traing data {status}")
-                
-            status = self.validate_no_of_columns(dataframe=test_df)    
-            if not status :
-                validation_error_msg += f"Columns are missing in testing dataset"
-                
-            else :
-                logging.info(f"All categorical columns present in testing dataset : {status}")
-            status = self.is_column_exist(dataframe=train_df)
-            if not status:
-                validation_error_msg += f"Columns are missing in training dataframe. "
-            else:
-                logging.info(f"All categorical/int columns present in training dataframe: {status}")
-
-            status = self.is_column_exist(dataframe=test_df)
-            if not status:
-                validation_error_msg += f"Columns are missing in test dataframe."
-            else:
-                logging.info(f"All categorical/int columns present in testing dataframe: {status}")
-            
+            reference, reference_source = self.load_drift_reference()
+            train_sketch = DriftSketch(reference) if reference is not None else None
+            test_sketch = DriftSketch(reference) if reference is not None else None
+            # the train and test files are read and checked independently of each other
+            results = DagExecutor(max_concurrency=2).run([
+                Task("train", lambda: self.validate_dataframe(self.data_ingestion_artifacts.trained_file_path, "training",
+                                                              self.data_ingestion_artifacts.train_df, train_sketch)),
+                Task("test", lambda: self.validate_dataframe(self.data_ingestion_artifacts.test_file_path, "testing",
+                                                             self.data_ingestion_artifacts.test_df, test_sketch)),
+            ])
+            validation_error_msg = results["train"]["message"] + results["test"]["message"]
+            # a record in both splits would be evaluated on data the model was trained on
+            shared_ids = int(pd.Series(results["test"]["id_hashes"]).isin(results["train"]["id_hashes"]).sum())
+            if shared_ids:
+                validation_error_msg += f"{shared_ids} {self._schema_config.get('id_column')} values are in both the training and testing data. "
+
+            # the new data as a whole against the data the production model was trained on
+            drift = {"reference": reference_source}
+            if reference is not None:
+                drift.update(train_sketch.merge(test_sketch).compare(self.data_validation_config.drift_psi_threshold,
+                                                                     self.data_validation_config.drift_ks_threshold))
+                logging.info(f"Drift against {reference_source}: max PSI {drift['max_psi']}, max KS {drift['max_ks']}, "
+                             f"drifted columns {drift['drifted_columns']}")
+                if drift["drifted_columns"] and self.data_validation_config.block_on_drift:
+                    validation_error_msg += f"Columns {drift['drifted_columns']} drifted from the reference profile. "
+
             validation_status = len(validation_error_msg) == 0
-            
-            
             data_validation_artifacts = DataValidationArtifacts(
                 validation_status= validation_status,
                 message = validation_error_msg,
                 validation_report_file_path= self.data_validation_config.validation_report_file_path
             )
-            
             report_dir = os.path.dirname(self.data_validation_config.validation_report_file_path)
             os.makedirs(report_dir , exist_ok=True)
-            
             validation_report = {
                 'validation_status': validation_status,
-                'message' : validation_error_msg.strip()
+                'message' : validation_error_msg.strip(),
+                'shared_ids': shared_ids,
+                'drift': drift,
+                'train': results["train"]["report"],
+                'test': results["test"]["report"]
             }
-            
             with open(self.data_validation_config.validation_report_file_path, "w") as report_file:
-                json.dump(validation_report, report_file, indent=4)    
-                
+                json.dump(validation_report, report_file, indent=4, default=str)
             logging.info("Data validation artifact created and saved to JSON file.")
             logging.info(f"Data validation artifact:{data_validation_artifacts}")
             return data_validation_artifacts
         except Exception as e:
-            raise MyException(e,sys)  from e
\ No newline at end of file
+            raise MyException(e,sys)  from e
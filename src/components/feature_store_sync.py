@@ -0,0 +1,233 @@
+import argparse
+import glob
+import os
+import signal
+import sys
+import time
+from typing import List, Optional
+
+import pandas as pd
+from bson import json_util
+
+from src.constants import SCHEMA_FILE_PATH, FEATURE_STORE_SYNC_PARTS_DIR
+from src.data_access.proj1_data import Proj1Data, build_field_projection
+from src.entity.config_entity import FeatureStoreSyncConfig
+from src.exception import MyException
+from src.logger import logging
+from src.utils.main_utils import read_yaml_file, get_schema_columns
+
+OBJECT_ID_COLUMN = "_id"
+DELETED_COLUMN = "_deleted"
+UPSERT_OPERATIONS = ["insert", "update", "replace"]
+PART_FILE_PATTERN = "part-*.csv"
+
+
+def list_feature_store_parts(parts_dir: str) -> List[str]:
+    """
+    Returns the part files of a live feature store, oldest first
+    """
+    return sorted(glob.glob(os.path.join(parts_dir, PART_FILE_PATTERN)))
+
+
+def _read_parts(parts: List[str]) -> pd.DataFrame:
+    """
+    Reads the part files and keeps only the latest version of every document (tombstones included)
+    """
+    dataframe = pd.concat([pd.read_csv(part) for part in parts], ignore_index=True)
+    return dataframe.drop_duplicates(subset=OBJECT_ID_COLUMN, keep="last")
+
+
+def load_live_feature_store(feature_store_dir: str, retries: int = 3) -> pd.DataFrame:
+    """
+    Returns the current state of the live feature store: one row per document, deleted documents removed.
+    A part can disappear while reading if the consumer compacts at the same time, so the read is retried.
+    """
+    try:
+        parts_dir = os.path.join(feature_store_dir, FEATURE_STORE_SYNC_PARTS_DIR)
+        for attempt in range(retries):
+            parts = list_feature_store_parts(parts_dir)
+            if not parts:
+                raise Exception(f"Live feature store at {feature_store_dir} is empty, start the feature store sync first")
+            try:
+                dataframe = _read_parts(parts)
+                break
+            except FileNotFoundError:
+                if attempt == retries - 1:
+                    raise
+                logging.info("Live feature store was compacted while reading, retrying")
+
+        dataframe = dataframe[~dataframe[DELETED_COLUMN].astype(bool)]
+        logging.info(f"Loaded {len(dataframe)} documents from the live feature store")
+        return dataframe.drop(columns=[OBJECT_ID_COLUMN, DELETED_COLUMN]).reset_index(drop=True)
+    except Exception as e:
+        raise MyException(e, sys) from e
+
+
+class FeatureStoreSync:
+    """
+    Keeps a local copy of the collection up to date by consuming its MongoDB change stream.
+    Changes are written in micro-batches as part files and the resume token of the last written
+    change is saved after each batch, so a restarted consumer continues exactly where it stopped.
+    Change streams need a replica set; a single-node replica set is enough for local runs.
+    """
+
+    def __init__(self, feature_store_sync_config: FeatureStoreSyncConfig = FeatureStoreSyncConfig()):
+        try:
+            self.feature_store_sync_config = feature_store_sync_config
+            self._schema_config = read_yaml_file(file_path=SCHEMA_FILE_PATH)
+            self._columns = [column for column, _ in get_schema_columns(self._schema_config)]
+            self._stopped = False
+            os.makedirs(self.feature_store_sync_config.parts_dir, exist_ok=True)
+            parts = list_feature_store_parts(self.feature_store_sync_config.parts_dir)
+            self._next_part = self._part_number(parts[-1]) + 1 if parts else 0
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    @staticmethod
+    def _part_number(part_path: str) -> int:
+        return int(os.path.basename(part_path).split("-")[1].split(".")[0])
+
+    def stop(self) -> None:
+        """Asks the consumer loop to flush what it has buffered and return"""
+        self._stopped = True
+
+    def load_resume_token(self) -> Optional[dict]:
+        token_file_path = self.feature_store_sync_config.resume_token_file_path
+        if not os.path.exists(token_file_path):
+            return None
+        with open(token_file_path) as token_file:
+            return json_util.loads(token_file.read())
+
+    def save_resume_token(self, resume_token: dict) -> None:
+        token_file_path = self.feature_store_sync_config.resume_token_file_path
+        tmp_file_path = token_file_path + ".tmp"
+        with open(tmp_file_path, "w") as token_file:
+            token_file.write(json_util.dumps(resume_token))
+        os.replace(tmp_file_path, token_file_path)
+
+    def _write_part(self, dataframe: pd.DataFrame) -> str:
+        """Writes a part file atomically so readers never see a half written batch"""
+        part_path = os.path.join(self.feature_store_sync_config.parts_dir, f"part-{self._next_part:08d}.csv")
+        tmp_path = part_path + ".tmp"
+        dataframe.to_csv(tmp_path, index=False, header=True)
+        os.replace(tmp_path, part_path)
+        self._next_part += 1
+        return part_path
+
+    def _change_stream_pipeline(self) -> List[dict]:
+        """
+        Filters the change events and applies the same server side projection as the bulk export
+        to the changed documents. The event `_id` is the resume token and must be left untouched.
+        """
+        return [
+            {"$match": {"operationType": {"$in": UPSERT_OPERATIONS + ["delete"]}}},
+            {"$project": {"operationType": 1,
+                          "documentKey": 1,
+                          "fullDocument": build_field_projection(self._schema_config, prefix="fullDocument.")}},
+        ]
+
+    def _changes_to_dataframe(self, changes: List[dict]) -> pd.DataFrame:
+        rows = []
+        for change in changes:
+            object_id = str(change["documentKey"]["_id"])
+            if change["operationType"] == "delete":
+                rows.append({OBJECT_ID_COLUMN: object_id, DELETED_COLUMN: True})
+            else:
+                rows.append({OBJECT_ID_COLUMN: object_id, DELETED_COLUMN: False, **change["fullDocument"]})
+        return pd.DataFrame.from_records(rows, columns=[OBJECT_ID_COLUMN, DELETED_COLUMN] + self._columns)
+
+    def _flush(self, changes: List[dict]) -> None:
+        """
+        Writes the buffered changes as one part, then records the token of the last change.
+        A crash between the two replays the batch on restart, which is harmless because
+        readers keep only the latest version of each document.
+        """
+        part_path = self._write_part(self._changes_to_dataframe(changes))
+        self.save_resume_token(changes[-1]["_id"])
+        logging.info(f"Wrote {len(changes)} changes to {part_path}")
+
+        parts = list_feature_store_parts(self.feature_store_sync_config.parts_dir)
+        if len(parts) >= self.feature_store_sync_config.compact_after_parts:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Merges all parts into a single new part. Tombstones are kept, so a crash before the
+        old parts are removed cannot bring a deleted document back.
+        """
+        try:
+            parts = list_feature_store_parts(self.feature_store_sync_config.parts_dir)
+            if len(parts) < 2:
+                return
+            compacted_path = self._write_part(_read_parts(parts))
+            for part in parts:
+                os.remove(part)
+            logging.info(f"Compacted {len(parts)} parts into {compacted_path}")
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def _bootstrap(self) -> None:
+        logging.info("No resume token found, taking an initial snapshot of the collection")
+        snapshot = Proj1Data().export_collection_as_dataframe(collection_name=self.feature_store_sync_config.collection_name,
+                                                              include_object_id=True)
+        snapshot.insert(1, DELETED_COLUMN, False)
+        self._write_part(snapshot)
+        logging.info(f"Initial snapshot of {len(snapshot)} documents written")
+
+    def run(self, max_batches: Optional[int] = None) -> None:
+        """
+        Consumes the change stream until stop() is called or max_batches batches were written.
+        A batch is written once batch_size changes are buffered or the oldest buffered change
+        has waited max_batch_wait_seconds.
+        """
+        try:
+            collection = Proj1Data().get_collection(self.feature_store_sync_config.collection_name)
+            resume_token = self.load_resume_token()
+            logging.info(f"Starting feature store sync, resume token: {resume_token}")
+
+            with collection.watch(self._change_stream_pipeline(), full_document="updateLookup",
+                                  resume_after=resume_token, max_await_time_ms=1000) as stream:
+                if resume_token is None:
+                    # The stream is opened before the snapshot so nothing written meanwhile is missed
+                    start_token = stream.resume_token
+                    self._bootstrap()
+                    if start_token is not None:
+                        self.save_resume_token(start_token)
+
+                buffer = []
+                batch_started = time.monotonic()
+                batches = 0
+                try:
+                    while not self._stopped and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            if not buffer:
+                                batch_started = time.monotonic()
+                            buffer.append(change)
+
+                        batch_full = len(buffer) >= self.feature_store_sync_config.batch_size
+                        batch_waited = len(buffer) > 0 and (time.monotonic() - batch_started
+                                                            >= self.feature_store_sync_config.max_batch_wait_seconds)
+                        if batch_full or batch_waited:
+                            self._flush(buffer)
+                            buffer = []
+                            batches += 1
+                            if max_batches is not None and batches >= max_batches:
+                                break
+                finally:
+                    if buffer:
+                        self._flush(buffer)
+            logging.info("Feature store sync stopped")
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the local feature store in sync with MongoDB")
+    parser.add_argument("--max-batches", type=int, default=None, help="stop after writing this many batches")
+    args = parser.parse_args()
+
+    feature_store_sync = FeatureStoreSync()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(stop_signal, lambda *_: feature_store_sync.stop())
+    feature_store_sync.run(max_batches=args.max_batches)
@@ -1,16 +1,18 @@
 from src.entity.config_entity import ModelEvaluationConfig
-from src.entity.artifact_entity import ModelTrainerArtifacts, DataIngestionArtifacts, ModelEvaluationArtifact
+from src.entity.artifact_entity import ModelTrainerArtifacts, DataIngestionArtifacts, ModelEvaluationArtifact, DataTransformedArtifacts
 from sklearn.metrics import f1_score
 from src.exception import MyException
-from src.constants import TARGET_COLUMN
+from src.constants import TARGET_COLUMN, SCHEMA_FILE_PATH
 from src.logger import logging
-from src.utils.main_utils import load_object
+from src.utils.main_utils import load_object, read_yaml_file, load_dataframe, get_model_columns
 import sys
-import pandas as pd
 from typing import Optional
 from src.entity.s3_estimator import Proj1Estimator
 from dataclasses import dataclass
 
+# Marks that the production model was not fetched ahead of the evaluation
+NOT_PREFETCHED = object()
+
 @dataclass
 class EvaluateModelResponse:
     trained_model_f1_score: float
@@ -22,11 +24,21 @@ class EvaluateModelResponse:
 class ModelEvaluation:
 
     def __init__(self, model_eval_config: ModelEvaluationConfig, data_ingestion_artifact: DataIngestionArtifacts,
-                 model_trainer_artifact: ModelTrainerArtifacts):
+                 model_trainer_artifact: ModelTrainerArtifacts, best_model=NOT_PREFETCHED,
+                 data_transformation_artifact: Optional[DataTransformedArtifacts] = None):
+        """
+        best_model: production model already fetched by prefetch_best_model (None if there is none),
+                    so the S3 download can overlap with training
+        data_transformation_artifact: when it carries the transformed test features in memory they
+                    are used instead of reading and transforming the test file again
+        """
         try:
+            self.data_transformation_artifact = data_transformation_artifact
+            self._best_model = best_model
             self.model_eval_config = model_eval_config
             self.data_ingestion_artifact = data_ingestion_artifact
             self.model_trainer_artifact = model_trainer_artifact
+            self._schema_config = read_yaml_file(file_path=SCHEMA_FILE_PATH)
         except Exception as e:
             raise MyException(e, sys) from e
 
@@ -50,36 +62,22 @@ class ModelEvaluation:
         except Exception as e:
             raise  MyException(e,sys)
         
-    def _map_gender_column(self, df):
-        """Map Gender column to 0 for Female and 1 for Male."""
-        logging.info("Mapping 'Gender' column to binary values")
-        df['Gender'] = df['Gender'].map({'Female': 0, 'Male': 1}).astype(int)
-        return df
-
-    def _create_dummy_columns(self, df):
-        """Create dummy variables for categorical features."""
-        logging.info("Creating dummy variables for categorical features")
-        df = pd.get_dummies(df, drop_first=True)
-        return df
-
-    def _rename_columns(self, df):
-        """Rename specific columns and ensure integer types for dummy columns."""
-        logging.info("Renaming specific columns and casting to int")
-        df = df.rename(columns={
-            "Vehicle_Age_< 1 Year": "Vehicle_Age_lt_1_Year",
-            "Vehicle_Age_> 2 Years": "Vehicle_Age_gt_2_Years"
-        })
-        for col in ["Vehicle_Age_lt_1_Year", "Vehicle_Age_gt_2_Years", "Vehicle_Damage_Yes"]:
-            if col in df.columns:
-                df[col] = df[col].astype('int')
-        return df
-    
-    def _drop_id_column(self, df):
-        """Drop the 'id' column if it exists."""
-        logging.info("Dropping 'id' column")
-        if "_id" in df.columns:
-            df = df.drop("_id", axis=1)
-        return df
+    def prefetch_best_model(self) -> Optional[Proj1Estimator]:
+        """
+        Method Name :   prefetch_best_model
+        Description :   Downloads the production model, if there is one, so that evaluation does not wait for S3
+        
+        Output      :   Returns the estimator with its model loaded, or None
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            best_model = self.get_best_model() if self._best_model is NOT_PREFETCHED else self._best_model
+            if best_model is not None:
+                best_model.loaded_model = best_model.load_model()
+                logging.info("Production model prefetched from s3")
+            return best_model
+        except Exception as e:
+            raise MyException(e, sys)
 
     def evaluate_model(self) -> EvaluateModelResponse:
         """
@@ -91,25 +89,38 @@ class ModelEvaluation:
         On Failure  :   Write an exception log and then raise an exception
         """
         try:
-            test_df = pd.read_csv(self.data_ingestion_artifact.test_file_path)
-            x, y = test_df.drop(TARGET_COLUMN, axis=1), test_df[TARGET_COLUMN]
-
-            logging.info("Test data loaded and now transforming it for prediction...")
-
-            x = self._map_gender_column(x)
-            x = self._drop_id_column(x)
-            x = self._create_dummy_columns(x)
-            x = self._rename_columns(x)
-
-            trained_model = load_object(file_path=self.model_trainer_artifact.trained_model_file_path)
+            if self.data_transformation_artifact is not None and self.data_transformation_artifact.test_features_df is not None:
+                logging.info("Using the test features handed over in memory by the transformation")
+                x, y = self.data_transformation_artifact.test_features_df, self.data_transformation_artifact.test_target
+            elif self.data_ingestion_artifact.test_df is not None:
+                # a transformation reused from the stage cache hands nothing over, and with persist
+                # "end" the test file of this run is not written yet
+                test_df = self.data_ingestion_artifact.test_df[get_model_columns(self._schema_config)]
+                x, y = test_df.drop(TARGET_COLUMN, axis=1), test_df[TARGET_COLUMN]
+                logging.info("Using the test data handed over in memory by the ingestion")
+            else:
+                test_df = load_dataframe(self.data_ingestion_artifact.test_file_path,
+                                         columns=get_model_columns(self._schema_config),
+                                         schema_config=self._schema_config)
+                x, y = test_df.drop(TARGET_COLUMN, axis=1), test_df[TARGET_COLUMN]
+                logging.info("Test data loaded, the models encode it for prediction")
+
+            trained_model = self.model_trainer_artifact.trained_model
+            if trained_model is None:
+                trained_model = load_object(file_path=self.model_trainer_artifact.trained_model_file_path)
             logging.info("Trained model loaded/exists.")
             trained_model_f1_score = self.model_trainer_artifact.metric_artifact.f1_score
             logging.info(f"F1_Score for this model: {trained_model_f1_score}")
 
             best_model_f1_score=None
-            best_model = self.get_best_model()
+            best_model = self.get_best_model() if self._best_model is NOT_PREFETCHED else self._best_model
             if best_model is not None:
                 logging.info(f"Computing F1_Score for production model..")
+                if best_model.loaded_model is None:
+                    best_model.loaded_model = best_model.load_model()
+                # a production model saved without a feature encoder expects encoded features
+                if getattr(best_model.loaded_model, "feature_encoder", None) is None and trained_model.feature_encoder is not None:
+                    x = trained_model.feature_encoder.transform(x)
                 y_hat_best_model = best_model.predict(x)
                 best_model_f1_score = f1_score(y, y_hat_best_model)
                 logging.info(f"F1_Score-Production Model: {best_model_f1_score}, F1_Score-New Trained Model: {trained_model_f1_score}")
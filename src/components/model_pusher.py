@@ -1,6 +1,8 @@
+import os
 import sys
 
 from src.cloud_storage.aws_storage import SimpleStorageService
+from src.constants import REFERENCE_PROFILE_FILE_NAME
 from src.exception import MyException
 from src.logger import logging
 from src.entity.artifact_entity import ModelPusherArtifact, ModelEvaluationArtifact
@@ -37,6 +39,12 @@ class ModelPusher:
             
             logging.info("Uploading new model to S3 bucket....")
             self.proj1_estimator.save_model(from_file=self.model_evaluation_artifact.trained_model_path)
+            # the profile the model was trained on, validation checks new data for drift against it
+            reference_profile_path = os.path.join(os.path.dirname(self.model_evaluation_artifact.trained_model_path),
+                                                  REFERENCE_PROFILE_FILE_NAME)
+            if os.path.exists(reference_profile_path):
+                self.proj1_estimator.save_reference_profile(from_file=reference_profile_path)
+                logging.info("Uploaded the reference profile of the new model")
             model_pusher_artifact = ModelPusherArtifact(bucket_name=self.model_pusher_config.bucket_name,
                                                         s3_model_path=self.model_pusher_config.s3_model_key_path)
 
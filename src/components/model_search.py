@@ -0,0 +1,191 @@
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from typing import Optional
+
+import numpy as np
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+
+from src.components.resampling import Resampler, get_resampler
+from src.entity.model_backends import get_model_backend
+from src.entity.artifact_entity import DataTransformedArtifacts, ModelSearchArtifact
+from src.entity.config_entity import DataTransformationConfig, ModelTraninerConfig
+from src.exception import MyException
+from src.logger import logging
+from src.utils.main_utils import load_numpy_array_data, read_yaml_file, save_numpy_array_data
+
+
+def split_rows(rows: int, validation_rows: int, seed: int):
+    """
+    Shuffles the row numbers of the training array once: the first validation_rows are held out to
+    score the candidates, the rest are taken in that order, so a larger subset contains the smaller ones
+    """
+    permutation = np.random.default_rng(seed).permutation(rows)
+    return np.sort(permutation[:validation_rows]), permutation[validation_rows:]
+
+
+def evaluate_candidate(model_trainer_config: ModelTraninerConfig, params: dict, class_weight: Optional[str],
+                       train_features_file: str, train_target_file: str,
+                       validation_features_file: str, validation_target_file: str, scoring: str) -> dict:
+    """
+    Fits one candidate on the training rows of a round and scores it on the held out rows. Module level
+    so it runs in a worker process; the arrays are mapped from their files, not pickled into the worker.
+    """
+    candidate_config = replace(model_trainer_config, **params)
+    backend = get_model_backend(candidate_config.model_backend)
+    model = backend.build(candidate_config, class_weight)
+    start = time.perf_counter()
+    model = backend.fit(model, load_numpy_array_data(train_features_file, mmap_mode="r"),
+                        load_numpy_array_data(train_target_file, mmap_mode="r"))
+    fit_seconds = time.perf_counter() - start
+    score = get_scorer(scoring)(model, load_numpy_array_data(validation_features_file, mmap_mode="r"),
+                                load_numpy_array_data(validation_target_file, mmap_mode="r"))
+    return {"score": round(float(score), 6), "fit_seconds": round(fit_seconds, 3)}
+
+
+class ModelSearch:
+    def __init__(self, data_transformation_artifacts: DataTransformedArtifacts, model_trainer_config: ModelTraninerConfig,
+                 data_transformation_config: Optional[DataTransformationConfig] = None):
+        """
+        data_transformation_config: its resampling strategy is applied to the training rows of every
+                                    round, as the transformation applied it to the training split
+        """
+        try:
+            self.data_transformation_artifacts = data_transformation_artifacts
+            self.model_trainer_config = model_trainer_config
+            self.resampler = get_resampler(data_transformation_config) if data_transformation_config is not None else Resampler()
+            self.search_config = read_yaml_file(model_trainer_config.model_config_file_path)["search"]
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def sample_candidates(self) -> list:
+        """
+        Samples the candidates from the grid of every backend searched, sharing n_candidates between
+        them; candidates of several backends carry their model_backend with their parameters
+        """
+        backends = self.search_config.get("backends") or [self.model_trainer_config.model_backend]
+        candidates = []
+        for index, backend in enumerate(backends):
+            get_model_backend(backend)
+            if backend not in self.search_config["param_grids"]:
+                raise ValueError(f"config/model.yaml has no search space for the {backend} backend")
+            param_grid = self.search_config["param_grids"][backend]
+            # the first backends get the remainder
+            share = self.search_config["n_candidates"] // len(backends) + (index < self.search_config["n_candidates"] % len(backends))
+            n_candidates = min(share, len(ParameterGrid(param_grid)))
+            sampled = ParameterSampler(param_grid, n_iter=n_candidates, random_state=self.search_config["random_state"])
+            candidates += [{**params, "model_backend": backend} if len(backends) > 1 else params for params in sampled]
+        return candidates
+
+    def round_sizes(self, n_candidates: int, train_rows: int) -> list:
+        """
+        Candidates and training rows of every round: each round keeps 1/factor of the candidates
+        and gives the survivors factor times more rows, from at least min_rows up to every training
+        row in the last round. The rounds stop once they reach every row, more rounds on the same
+        rows would refit the same models.
+        """
+        factor, min_rows = self.search_config["factor"], self.search_config["min_rows"]
+        candidates = [n_candidates]
+        while candidates[-1] > factor:
+            candidates.append(math.ceil(candidates[-1] / factor))
+
+        def sizes(rounds: int) -> list:
+            return [min(train_rows, max(min_rows * factor ** index, train_rows // factor ** (rounds - 1 - index)))
+                    for index in range(rounds)]
+
+        rounds = len(candidates)
+        while rounds > 1 and sizes(rounds)[-2] >= train_rows:
+            rounds -= 1
+        return list(zip(candidates[:rounds], sizes(rounds)))
+
+    def initiate_model_search(self) -> ModelSearchArtifact:
+        """
+        Method Name :   initiate_model_search
+        Description :   Successive halving over the candidates sampled from config/model.yaml: every
+                        round fits the surviving candidates concurrently in a process pool on a growing
+                        subset of the training rows, and drops all but the best 1/factor of them.
+                        The candidates are scored on training rows held out before resampling, so no
+                        synthetic row derived from a training row is scored; each round's subset is
+                        resampled on its own. Writes the leaderboard with the score and fit time of
+                        every candidate and round.
+
+        Output      :   ModelSearchArtifact with the ModelTraninerConfig fields of the best candidate
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            start = time.perf_counter()
+            artifacts = self.data_transformation_artifacts
+            search = self.search_config
+            if artifacts.unresampled_train_file is None:
+                raise ValueError("The search validates on the training rows before resampling, "
+                                 "transform with keep_unresampled_train=True")
+            features = load_numpy_array_data(artifacts.unresampled_train_file, mmap_mode="r")
+            target = load_numpy_array_data(artifacts.unresampled_train_target_file, mmap_mode="r")
+            validation_rows = int(len(target) * search["validation_fraction"])
+            train_rows = len(target) - validation_rows
+            validation_index, train_index = split_rows(len(target), validation_rows, search["random_state"])
+            search_dir = os.path.dirname(self.model_trainer_config.search_leaderboard_file_path)
+            search_files = {name: os.path.join(search_dir, f"{name}.npy")
+                            for name in ("validation", "validation_target", "round_train", "round_train_target")}
+            save_numpy_array_data(search_files["validation"], features[validation_index])
+            save_numpy_array_data(search_files["validation_target"], target[validation_index])
+            candidates = self.sample_candidates()
+            rounds = self.round_sizes(len(candidates), train_rows)
+            logging.info(f"Searching {len(candidates)} candidates in {len(rounds)} rounds of {[rows for _, rows in rounds]} rows")
+
+            leaderboard = [{"candidate": index, "params": params, "rounds": [], "eliminated_in_round": None}
+                           for index, params in enumerate(candidates)]
+            surviving = list(range(len(candidates)))
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=search["max_workers"], mp_context=context) as pool:
+                for round_index, (_, rows) in enumerate(rounds):
+                    round_index_rows = np.sort(train_index[:rows])
+                    round_features, round_target = self.resampler.resample(features[round_index_rows], target[round_index_rows])
+                    # the workers of the previous round are done with the files
+                    save_numpy_array_data(search_files["round_train"], round_features)
+                    save_numpy_array_data(search_files["round_train_target"], np.asarray(round_target))
+                    futures = {candidate: pool.submit(evaluate_candidate, self.model_trainer_config,
+                                                      candidates[candidate], artifacts.class_weight,
+                                                      search_files["round_train"], search_files["round_train_target"],
+                                                      search_files["validation"], search_files["validation_target"],
+                                                      search["scoring"])
+                               for candidate in surviving}
+                    for candidate, future in futures.items():
+                        leaderboard[candidate]["rounds"].append({"round": round_index, "rows": rows,
+                                                                 "resampled_rows": len(round_target), **future.result()})
+
+                    # the best scores go on, the faster fit first among equal scores
+                    surviving.sort(key=lambda candidate: (-leaderboard[candidate]["rounds"][-1]["score"],
+                                                          leaderboard[candidate]["rounds"][-1]["fit_seconds"]))
+                    keep = rounds[round_index + 1][0] if round_index + 1 < len(rounds) else 1
+                    for candidate in surviving[keep:]:
+                        leaderboard[candidate]["eliminated_in_round"] = round_index
+                    surviving = surviving[:keep]
+                    logging.info(f"Search round {round_index} on {rows} rows: "
+                                 f"best {search['scoring']} {leaderboard[surviving[0]]['rounds'][-1]['score']}")
+
+            for file_path in search_files.values():
+                os.remove(file_path)
+
+            best = leaderboard[surviving[0]]
+            # furthest round reached first, then the score of that round
+            leaderboard.sort(key=lambda entry: (-len(entry["rounds"]), -entry["rounds"][-1]["score"]))
+            os.makedirs(os.path.dirname(self.model_trainer_config.search_leaderboard_file_path), exist_ok=True)
+            with open(self.model_trainer_config.search_leaderboard_file_path, "w") as leaderboard_file:
+                json.dump({"scoring": search["scoring"], "factor": search["factor"], "validation_rows": validation_rows,
+                           "resampling": self.resampler.name,
+                           "rounds": [{"round": index, "candidates": count, "rows": rows} for index, (count, rows) in enumerate(rounds)],
+                           "best": best, "seconds": round(time.perf_counter() - start, 3), "leaderboard": leaderboard},
+                          leaderboard_file, indent=2, default=str)
+
+            logging.info(f"Best candidate {best['params']} with {search['scoring']} {best['rounds'][-1]['score']}")
+            return ModelSearchArtifact(best_params=best["params"], best_score=best["rounds"][-1]["score"],
+                                       leaderboard_file_path=self.model_trainer_config.search_leaderboard_file_path)
+        except Exception as e:
+            raise MyException(e, sys) from e
@@ -1,46 +1,80 @@
+import copy
+import os
+import shutil
 import sys
-from typing import Tuple
+from typing import Tuple, Optional
 
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, f1_score , precision_score , recall_score
 
+from src.constants import REFERENCE_PROFILE_FILE_NAME
 from src.exception import MyException
 from src.logger import logging
 from src.utils.main_utils import load_numpy_array_data,load_object,save_object
 from src.entity.artifact_entity import DataTransformedArtifacts , ModelTrainerArtifacts , ClassificationMetricArtifacts
 from src.entity.config_entity import ModelTraninerConfig
 from src.entity.estimator import MyModel
+from src.entity.model_backends import get_model_backend
+from src.components.partitioned_training import PartitionedForestTrainer
+from src.utils.artifact_store import ArtifactStore
 
 class ModelTrainer:
     def __init__(self, data_transformation_artifacts: DataTransformedArtifacts ,
-                 model_trainer_config: ModelTraninerConfig):
+                 model_trainer_config: ModelTraninerConfig, artifact_store: Optional[ArtifactStore] = None,
+                 previous_model: Optional[MyModel] = None, watermark: Optional[str] = None):
+        """
+        previous_model: model to update incrementally with the new data instead of training from scratch
+        watermark: `_id` of the newest source document of the training data, saved in the model
+        """
         try: 
+            self.artifact_store = artifact_store or ArtifactStore()
             self.data_transformation_artifacts = data_transformation_artifacts
             self.model_tranier_config = model_trainer_config
+            self.previous_model = previous_model
+            self.watermark = watermark
+            self.backend = get_model_backend(previous_model.backend if previous_model is not None else model_trainer_config.model_backend)
         except Exception as e:
             raise MyException(e, sys) from e
-    def get_model_object_and_reported(self, train: np.array , test: np.array) -> Tuple[object, object]:
+    def load_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the train features, train target, test features and test target of the transformation:
+        as handed over in memory, else the saved files mapped read only instead of copied into memory
+        """
+        artifacts = self.data_transformation_artifacts
+        if artifacts.train_arr is not None:
+            return artifacts.train_arr, artifacts.train_target_arr, artifacts.test_arr, artifacts.test_target_arr
+        return (load_numpy_array_data(file_path=artifacts.transformed_train_file, mmap_mode="r"),
+                load_numpy_array_data(file_path=artifacts.transformed_train_target_file, mmap_mode="r"),
+                load_numpy_array_data(file_path=artifacts.transformed_test_file, mmap_mode="r"),
+                load_numpy_array_data(file_path=artifacts.transformed_test_target_file, mmap_mode="r"))
+
+    def get_model_object_and_reported(self, X_train: np.ndarray, y_train: np.ndarray, X_test: np.ndarray, y_test: np.ndarray,
+                                      class_weight: Optional[str] = None) -> Tuple[object, object]:
         try:
-            logging.info("Training RandomForestClassifier with specified Parameters")
-            X_train,y_train,X_test,y_test = train[ : ,: -1], train[ : , -1], test[: , :-1], test[ : , -1]
-            
-            logging.info("Train_test_split is done")
-            
-            model = RandomForestClassifier(
-                n_estimators= self.model_tranier_config._n_estimators,
-                min_samples_split = self.model_tranier_config._min_sample_split,
-                min_samples_leaf= self.model_tranier_config._min_sample_leaf,
-                max_depth= self.model_tranier_config._max_dept,
-                criterion= self.model_tranier_config._criterion,
-                random_state=self.model_tranier_config._random_state
-            )
-            
-            logging.info("Model training going on ....")
-            model.fit(X_train , y_train)
-            logging.info("Model Training done")
+            backend = self.backend
+            if self.previous_model is not None:
+                # the production model is left as it is, evaluation compares the new one against it
+                model = copy.deepcopy(self.previous_model.trained_model_object)
+                logging.info(f"Updating the previous {backend.name} model with {len(y_train)} new rows")
+                model = backend.warm_start(model, X_train, y_train, new_models=self.model_tranier_config.incremental_n_estimators,
+                                           max_models=self.model_tranier_config._n_estimators, class_weight=class_weight)
+                logging.info("Incremental model training done")
+            elif self.model_tranier_config.partitions > 1:
+                # the workers map the saved arrays, whether or not they were handed over in memory
+                artifacts = self.data_transformation_artifacts
+                model = PartitionedForestTrainer(self.model_tranier_config).fit(artifacts.transformed_train_file,
+                                                                                artifacts.transformed_train_target_file,
+                                                                                class_weight=class_weight)
+            else:
+                logging.info(f"Training {backend.name} with specified Parameters")
+                
+                model = backend.build(self.model_tranier_config, class_weight)
+                
+                logging.info("Model training going on ....")
+                model = backend.fit(model, X_train , y_train)
+                logging.info("Model Training done")
             
-            y_pred = model.predict(X_test)
+            y_pred = backend.predict(model, X_test)
             accuracy = accuracy_score(y_true= y_test , y_pred= y_pred)
             precision = precision_score(y_true= y_test , y_pred=y_pred)
             recall = recall_score(y_true= y_test , y_pred= y_pred)
@@ -57,29 +91,40 @@ class ModelTrainer:
         logging.info("Entered into initiate_model_trainer method ModelTrainer class")
         
         try:
-            train_arr = load_numpy_array_data(file_path= self.data_transformation_artifacts.transformed_train_file)
-            test_arr = load_numpy_array_data(file_path = self.data_transformation_artifacts.transformed_test_file)
+            artifacts = self.data_transformation_artifacts
+            X_train, y_train, X_test, y_test = self.load_arrays()
             logging.info("Model object and artifacts ")
             
             
-            train_model, metric_artifact = self.get_model_object_and_reported(train= train_arr , test= test_arr )
+            train_model, metric_artifact = self.get_model_object_and_reported(X_train, y_train, X_test, y_test,
+                                                                              class_weight= artifacts.class_weight)
             logging.info("Model object and artifact loaded")
-            preprocessing_obj = load_object(file_path= self.data_transformation_artifacts.transformed_object_file)
+            preprocessing_obj = artifacts.preprocessor if artifacts.preprocessor is not None else load_object(file_path= artifacts.transformed_object_file)
             logging.info("Preprocessing object loaded")
+            feature_encoder = artifacts.feature_encoder
+            if feature_encoder is None and artifacts.feature_encoder_file:
+                feature_encoder = load_object(file_path=artifacts.feature_encoder_file)
             
-            if accuracy_score(train_arr[: ,-1] , train_model.predict(train_arr[: , :-1])) < self.model_tranier_config.expected_accuracy:
+            if accuracy_score(y_train , self.backend.predict(train_model, X_train)) < self.model_tranier_config.expected_accuracy:
                 logging("No model found with score above the base score")
                 
                 raise Exception("no model found with score above the base score")
             
             logging.info("Saving new model as performance is better than previous one")
-            my_model = MyModel( preprocessing_object = preprocessing_obj , trained_model_object= train_model)
-            save_object(self.model_tranier_config.trained_model_file_path , my_model)
-            logging.info("Saved final model object that includes both preprocessing and the trained model")
+            my_model = MyModel( preprocessing_object = preprocessing_obj , trained_model_object= train_model,
+                                feature_encoder= feature_encoder, backend= self.backend.name, watermark= self.watermark)
+            self.artifact_store.save(save_object, self.model_tranier_config.trained_model_file_path , my_model)
+            logging.info("Saved final model object that includes the feature encoder, preprocessing and the trained model")
+            if artifacts.reference_profile_file:
+                # the pusher uploads the profile of the training data together with the model
+                model_dir = os.path.dirname(self.model_tranier_config.trained_model_file_path)
+                os.makedirs(model_dir, exist_ok=True)
+                shutil.copyfile(artifacts.reference_profile_file, os.path.join(model_dir, REFERENCE_PROFILE_FILE_NAME))
             
             model_trainer_artifact = ModelTrainerArtifacts(
                 trained_model_file_path= self.model_tranier_config.trained_model_file_path,
                 metric_artifact = metric_artifact,
+                trained_model = self.artifact_store.keep(my_model),
             )
             logging.info(f"Model trainer artifact: {model_trainer_artifact}")
             return model_trainer_artifact
@@ -0,0 +1,288 @@
+"""
+Fits the forest of the trainer as sub-forests on partitions of the training rows, in local worker
+processes or by workers on other machines serving a task queue directory, and merges them.
+
+Serve the task queue of partition_queue_dir on every machine of the training with
+
+    python -m src.components.partitioned_training <queue_dir> [--idle-seconds 600]
+
+The queue directory must be writable only by the account running the training, see DirectoryTaskQueue.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, replace
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from src.constants import MODEL_TRAINER_PARTITION_QUEUE_TIMEOUT_SECONDS, MODEL_TRAINER_PARTITION_QUEUE_STALE_SECONDS
+from src.entity.config_entity import ModelTraninerConfig
+from src.entity.model_backends import get_model_backend
+from src.exception import MyException
+from src.logger import logging
+from src.utils.main_utils import load_numpy_array_data
+
+
+def partition_rows(target: np.ndarray, partitions: int, seed: int) -> List[np.ndarray]:
+    """
+    Row numbers of every partition: the rows of each class are dealt round robin over the
+    partitions in a random order, so every partition has the class proportions of the whole
+    """
+    rng = np.random.default_rng(seed)
+    partition_of_row = np.empty(len(target), dtype=np.int64)
+    for label in np.unique(target):
+        rows = rng.permutation(np.flatnonzero(target == label))
+        partition_of_row[rows] = np.arange(len(rows)) % partitions
+    return [np.flatnonzero(partition_of_row == partition) for partition in range(partitions)]
+
+
+def trees_per_partition(n_estimators: int, partitions: int) -> List[int]:
+    """Splits the trees of the forest over the partitions, the first ones get the remainder"""
+    return [n_estimators // partitions + (partition < n_estimators % partitions) for partition in range(partitions)]
+
+
+def fit_partition(model_trainer_params: dict, class_weight: Optional[str],
+                  features_file: str, target_file: str, partition: int) -> object:
+    """
+    Fits the sub-forest of one partition. Module level so it runs in a worker process, possibly on
+    another machine, and takes the fields of the ModelTraninerConfig as plain values so a task
+    queue can send them as JSON; the arrays are mapped from their files and only the partition's
+    rows are read.
+    """
+    model_trainer_config = ModelTraninerConfig(**model_trainer_params)
+    features = load_numpy_array_data(features_file, mmap_mode="r")
+    target = load_numpy_array_data(target_file, mmap_mode="r")
+    partitions = model_trainer_config.partitions
+    rows = partition_rows(np.asarray(target), partitions, model_trainer_config._random_state)[partition]
+
+    partition_config = replace(model_trainer_config,
+                               _n_estimators=trees_per_partition(model_trainer_config._n_estimators, partitions)[partition],
+                               _random_state=model_trainer_config._random_state + partition)
+    backend = get_model_backend(partition_config.model_backend)
+    start = time.perf_counter()
+    model = backend.fit(backend.build(partition_config, class_weight), features[rows], target[rows])
+    logging.info(f"Partition {partition} of {partitions}: {len(model.estimators_)} trees on {len(rows)} rows "
+                 f"in {time.perf_counter() - start:.2f}s")
+    return model
+
+
+# the functions the workers of a DirectoryTaskQueue run, by name
+QUEUE_FUNCTIONS = {"fit_partition": fit_partition}
+
+
+class LocalProcessPool:
+    """Runs the tasks in processes of this machine"""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+
+    def map(self, function: Callable, arguments: list) -> list:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context) as pool:
+            return list(pool.map(function, *zip(*arguments)))
+
+
+class DirectoryTaskQueue:
+    """
+    Task queue in a directory every machine of the training can reach, e.g. over NFS. A task is a
+    JSON file in pending/ naming one of the QUEUE_FUNCTIONS and its plain JSON arguments, so a
+    worker never runs code it did not import itself. A worker claims a task by renaming it into
+    running/, which only one worker can do, and keeps its modification time current while it
+    runs; a task whose claim is older than stale_seconds belonged to a worker that died and is put
+    back in pending/. The result is pickled into done/, a failure is written there as JSON.
+
+    The submitting machine unpickles the results, so the directory must be writable only by the
+    account running the training (it is created with mode 0700; use a dedicated group and 0770
+    when the workers run as another account). The workers need the project and the files named
+    in the tasks at the same paths as the machine submitting them.
+    """
+
+    def __init__(self, queue_dir: str, poll_seconds: float = 0.5,
+                 timeout_seconds: float = MODEL_TRAINER_PARTITION_QUEUE_TIMEOUT_SECONDS,
+                 stale_seconds: float = MODEL_TRAINER_PARTITION_QUEUE_STALE_SECONDS):
+        self.queue_dir = queue_dir
+        self.poll_seconds = poll_seconds
+        self.timeout_seconds = timeout_seconds
+        self.stale_seconds = stale_seconds
+        for state in ("pending", "running", "done"):
+            os.makedirs(os.path.join(queue_dir, state), mode=0o700, exist_ok=True)
+
+    def _path(self, state: str, task_id: str, extension: str = ".json") -> str:
+        return os.path.join(self.queue_dir, state, f"{task_id}{extension}")
+
+    def _write(self, file_path: str, write: Callable) -> None:
+        # written aside then renamed, so a reader never sees a partial file
+        temporary_path = os.path.join(self.queue_dir, f".{os.path.basename(file_path)}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(temporary_path, "wb") as task_file:
+            write(task_file)
+        os.replace(temporary_path, file_path)
+
+    def _requeue_stale(self, task_ids) -> None:
+        for task_id in task_ids:
+            running_path = self._path("running", task_id)
+            try:
+                if time.time() - os.path.getmtime(running_path) > self.stale_seconds:
+                    os.rename(running_path, self._path("pending", task_id))
+                    logging.info(f"Task {task_id} claimed more than {self.stale_seconds}s ago without a "
+                                 f"heartbeat, its worker died: queued again")
+            except FileNotFoundError:
+                # not claimed, or finished in the meantime
+                continue
+
+    def map(self, function: Callable, arguments: list) -> list:
+        if QUEUE_FUNCTIONS.get(function.__name__) is not function:
+            raise ValueError(f"{function.__name__} is not one of the queue functions {list(QUEUE_FUNCTIONS)}")
+        batch = uuid.uuid4().hex
+        task_ids = [f"{batch}_{index:05d}" for index in range(len(arguments))]
+        for task_id, task_arguments in zip(task_ids, arguments):
+            task = json.dumps({"function": function.__name__, "arguments": list(task_arguments)}).encode()
+            self._write(self._path("pending", task_id), lambda task_file: task_file.write(task))
+        logging.info(f"Queued {len(task_ids)} tasks in {self.queue_dir}")
+
+        results, deadline = {}, time.monotonic() + self.timeout_seconds
+        while len(results) < len(task_ids):
+            for task_id in task_ids:
+                if task_id in results:
+                    continue
+                error_path, result_path = self._path("done", task_id), self._path("done", task_id, ".pkl")
+                if os.path.exists(error_path):
+                    with open(error_path) as error_file:
+                        results[task_id] = RuntimeError(json.load(error_file)["error"])
+                    os.remove(error_path)
+                elif os.path.exists(result_path):
+                    with open(result_path, "rb") as result_file:
+                        results[task_id] = pickle.load(result_file)
+                    os.remove(result_path)
+            if len(results) < len(task_ids):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{len(task_ids) - len(results)} tasks of {self.queue_dir} not done "
+                                       f"after {self.timeout_seconds}s, is a worker serving the queue?")
+                self._requeue_stale([task_id for task_id in task_ids if task_id not in results])
+                time.sleep(self.poll_seconds)
+
+        for task_id in task_ids:
+            if isinstance(results[task_id], RuntimeError):
+                raise results[task_id]
+        return [results[task_id] for task_id in task_ids]
+
+    def _claim(self) -> Optional[str]:
+        for name in sorted(os.listdir(os.path.join(self.queue_dir, "pending"))):
+            if not name.endswith(".json"):
+                continue
+            task_id = name[:-len(".json")]
+            try:
+                os.rename(self._path("pending", task_id), self._path("running", task_id))
+            except FileNotFoundError:
+                # claimed by another worker
+                continue
+            # the claim time, a rename keeps the time the task was queued
+            os.utime(self._path("running", task_id))
+            return task_id
+        return None
+
+    def _heartbeat(self, task_id: str, stop: threading.Event) -> None:
+        while not stop.wait(self.stale_seconds / 5):
+            try:
+                os.utime(self._path("running", task_id))
+            except FileNotFoundError:
+                return
+
+    def _run_task(self, task_id: str) -> None:
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(task_id, stop), daemon=True)
+        heartbeat.start()
+        try:
+            with open(self._path("running", task_id)) as task_file:
+                task = json.load(task_file)
+            function = QUEUE_FUNCTIONS.get(task["function"])
+            if function is None:
+                raise ValueError(f"{task['function']!r} is not one of the queue functions {list(QUEUE_FUNCTIONS)}")
+            result = function(*task["arguments"])
+            self._write(self._path("done", task_id, ".pkl"),
+                        lambda result_file: pickle.dump(result, result_file, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception as e:
+            logging.error(f"Task {task_id} failed", exc_info=True)
+            error = json.dumps({"error": f"Task {task_id} failed: {type(e).__name__}: {e}"}).encode()
+            self._write(self._path("done", task_id), lambda error_file: error_file.write(error))
+        finally:
+            stop.set()
+            heartbeat.join()
+        try:
+            os.remove(self._path("running", task_id))
+        except FileNotFoundError:
+            # re-queued as stale meanwhile, another worker may run it again
+            pass
+
+    def serve(self, idle_seconds: Optional[float] = None) -> int:
+        """
+        Runs the pending tasks one at a time until idle_seconds passed without any, forever when
+        None. Returns the number of tasks run.
+        """
+        tasks_run, idle_since = 0, time.monotonic()
+        while idle_seconds is None or time.monotonic() - idle_since < idle_seconds:
+            task_id = self._claim()
+            if task_id is None:
+                time.sleep(self.poll_seconds)
+                continue
+            self._run_task(task_id)
+            tasks_run += 1
+            idle_since = time.monotonic()
+        return tasks_run
+
+
+class PartitionedForestTrainer:
+    def __init__(self, model_trainer_config: ModelTraninerConfig):
+        try:
+            self.model_trainer_config = model_trainer_config
+            self.backend = get_model_backend(model_trainer_config.model_backend)
+            if not self.backend.mergeable:
+                raise ValueError(f"The {self.backend.name} backend cannot be trained on partitions")
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def task_runner(self):
+        config = self.model_trainer_config
+        if config.partition_queue_dir:
+            return DirectoryTaskQueue(config.partition_queue_dir)
+        return LocalProcessPool(max_workers=config.partition_workers or min(config.partitions, os.cpu_count() or 1))
+
+    def fit(self, features_file: str, target_file: str, class_weight: Optional[str] = None) -> object:
+        """
+        Method Name :   fit
+        Description :   Fits a sub-forest on every stratified partition of the saved training arrays,
+                        concurrently, and merges their trees into one forest of _n_estimators trees
+
+        Output      :   the merged forest, served by MyModel like any forest of the backend
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            config = self.model_trainer_config
+            runner = self.task_runner()
+            logging.info(f"Training {config.partitions} sub-forests with {type(runner).__name__}")
+            start = time.perf_counter()
+            models = runner.map(fit_partition, [(asdict(config), class_weight, features_file, target_file, partition)
+                                                for partition in range(config.partitions)])
+            forest = self.backend.merge(models)
+            logging.info(f"Merged {len(models)} sub-forests into {len(forest.estimators_)} trees "
+                         f"in {time.perf_counter() - start:.2f}s")
+            return forest
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("queue_dir")
+    parser.add_argument("--idle-seconds", type=float, default=None, help="exit after this long without tasks")
+    parser.add_argument("--poll-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+    tasks_run = DirectoryTaskQueue(args.queue_dir, poll_seconds=args.poll_seconds).serve(idle_seconds=args.idle_seconds)
+    logging.info(f"Task queue worker exiting after {tasks_run} tasks")
@@ -0,0 +1,173 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+from imblearn.combine import SMOTEENN
+from imblearn.over_sampling import SMOTE
+from imblearn.under_sampling import EditedNearestNeighbours, RandomUnderSampler
+from sklearn.neighbors import NearestNeighbors
+
+from src.entity.config_entity import DataTransformationConfig
+from src.exception import MyException
+from src.logger import logging
+from src.utils.dag_executor import peak_rss_mb
+
+
+class Resampler:
+    """
+    A strategy against class imbalance applied to the training matrix. Strategies that do not
+    change the rows tell the trainer to weight the classes instead through class_weight.
+    """
+    name = "none"
+    class_weight: Optional[str] = None
+    # whether the strategy can be applied by the streaming transformation, chunk by chunk
+    streamable = True
+    # whether resample adds or drops rows
+    changes_rows = False
+
+    def resample(self, features: np.ndarray, target: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return features, target
+
+    def stream_selector(self, class_counts: dict) -> Tuple[Optional[Callable[[np.ndarray], np.ndarray]], int]:
+        """
+        For the streaming transformation, which never holds the whole matrix: returns a function
+        giving the rows of each chunk (by its target) to keep, None to keep them all, with the
+        number of rows kept over the split. class_counts are the rows per class of the split.
+        """
+        return None, sum(class_counts.values())
+
+
+class ClassWeightResampler(Resampler):
+    """Keeps the rows, the model weights the classes inversely to their frequency"""
+    name = "class_weight"
+    class_weight = "balanced"
+
+
+class RandomUnderResampler(Resampler):
+    """Drops random majority rows down to the size of the minority class, the cheapest strategy"""
+    name = "random_under"
+    changes_rows = True
+
+    def __init__(self, random_state: int):
+        self.random_state = random_state
+
+    def resample(self, features, target):
+        return RandomUnderSampler(random_state=self.random_state).fit_resample(features, target)
+
+    def stream_selector(self, class_counts):
+        rng = np.random.default_rng(self.random_state)
+        keep_count = min(class_counts.values())
+        # which of the rows of each class, in the order they come, are kept
+        kept = {}
+        for label, count in class_counts.items():
+            kept[label] = np.zeros(count, dtype=bool)
+            kept[label][rng.choice(count, keep_count, replace=False)] = True
+        seen = dict.fromkeys(class_counts, 0)
+
+        def select(target: np.ndarray) -> np.ndarray:
+            mask = np.empty(len(target), dtype=bool)
+            for label, label_kept in kept.items():
+                rows = np.flatnonzero(target == label)
+                mask[rows] = label_kept[seen[label]:seen[label] + len(rows)]
+                seen[label] += len(rows)
+            return mask
+        return select, keep_count * len(class_counts)
+
+
+class SmoteEnnResampler(Resampler):
+    """
+    SMOTE over-sampling of the minority class followed by edited nearest neighbours cleaning,
+    with the neighbour searches of both run on n_jobs threads
+    """
+    name = "smoteenn"
+    streamable = False
+    changes_rows = True
+
+    def __init__(self, random_state: int, n_jobs: Optional[int] = None):
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+
+    def resample(self, features, target):
+        smote = SMOTE(sampling_strategy="minority", random_state=self.random_state,
+                      k_neighbors=NearestNeighbors(n_neighbors=6, n_jobs=self.n_jobs))
+        enn = EditedNearestNeighbours(sampling_strategy="all", n_jobs=self.n_jobs)
+        return SMOTEENN(smote=smote, enn=enn, random_state=self.random_state).fit_resample(features, target)
+
+
+class PartitionedSmoteEnnResampler(SmoteEnnResampler):
+    """
+    SMOTEENN applied to stratified partitions of the rows, concurrently. The neighbour searches grow
+    faster than the rows, so partitions are cheaper than the whole matrix at once; synthetic rows
+    and the cleaning only see neighbours of the same partition.
+    """
+    name = "smoteenn_partitioned"
+
+    def __init__(self, random_state: int, partitions: int, n_jobs: Optional[int] = None):
+        super().__init__(random_state, n_jobs=1)
+        self.partitions = partitions
+        self.max_workers = n_jobs if n_jobs and n_jobs > 0 else None
+
+    def resample(self, features, target):
+        rng = np.random.default_rng(self.random_state)
+        partition_of_row = np.empty(len(target), dtype=np.int64)
+        # every class is dealt round robin over the partitions, in a random order
+        for label in np.unique(target):
+            rows = rng.permutation(np.flatnonzero(target == label))
+            partition_of_row[rows] = np.arange(len(rows)) % self.partitions
+
+        def resample_partition(partition: int):
+            rows = partition_of_row == partition
+            return SmoteEnnResampler(self.random_state + partition, n_jobs=1).resample(features[rows], target[rows])
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            parts = list(executor.map(resample_partition, range(self.partitions)))
+        return np.concatenate([part[0] for part in parts]), np.concatenate([np.asarray(part[1]) for part in parts])
+
+
+RESAMPLING_STRATEGIES = {strategy.name: strategy for strategy in
+                         (Resampler, ClassWeightResampler, RandomUnderResampler, SmoteEnnResampler, PartitionedSmoteEnnResampler)}
+
+
+def get_resampler(config: DataTransformationConfig) -> Resampler:
+    """Builds the resampling strategy named by config.resampling_strategy"""
+    if config.resampling_strategy not in RESAMPLING_STRATEGIES:
+        raise ValueError(f"Unknown resampling strategy {config.resampling_strategy}, "
+                         f"expected one of {list(RESAMPLING_STRATEGIES)}")
+    if config.resampling_strategy in ("none", "class_weight"):
+        return RESAMPLING_STRATEGIES[config.resampling_strategy]()
+    if config.resampling_strategy == "random_under":
+        return RandomUnderResampler(config.resampling_random_state)
+    if config.resampling_strategy == "smoteenn":
+        return SmoteEnnResampler(config.resampling_random_state, n_jobs=config.resampling_n_jobs)
+    return PartitionedSmoteEnnResampler(config.resampling_random_state, config.resampling_partitions,
+                                        n_jobs=config.resampling_n_jobs)
+
+
+def _class_counts(target: np.ndarray) -> dict:
+    labels, counts = np.unique(target, return_counts=True)
+    return {str(label): int(count) for label, count in zip(labels, counts)}
+
+
+def resample_with_report(resampler: Resampler, features: np.ndarray, target, split: str):
+    """
+    Applies the strategy to one split and returns the resampled features and target with the time,
+    peak memory growth and class counts of the resampling
+    """
+    try:
+        target = np.asarray(target)
+        start, rss_start = time.perf_counter(), peak_rss_mb()
+        resampled_features, resampled_target = resampler.resample(features, target)
+        rss_end = peak_rss_mb()
+        report = {"split": split,
+                  "seconds": round(time.perf_counter() - start, 3),
+                  "peak_rss_delta_mb": None if rss_end is None else round(rss_end - rss_start, 1),
+                  "rows_before": int(len(target)),
+                  "rows_after": int(len(resampled_target)),
+                  "class_counts_before": _class_counts(target),
+                  "class_counts_after": _class_counts(resampled_target)}
+        logging.info(f"Resampled {split} data with {resampler.name}: {report}")
+        return resampled_features, np.asarray(resampled_target), report
+    except Exception as e:
+        raise MyException(e, sys) from e
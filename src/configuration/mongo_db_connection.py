@@ -24,8 +24,13 @@ class MongoDBClient:
                 if mongo_db_url is None:
                     raise Exception(f"Environment variable '{MONGODB_URL_KEY}' is not set.")
                 
-                # Establish a new MongoDB client connection
-                MongoDBClient.client = pymongo.MongoClient(mongo_db_url, tlsCAFile=ca)
+                # Establish a new MongoDB client connection; the CA file is only needed for TLS
+                # connections (Atlas), a local replica set is usually reached without TLS
+                if mongo_db_url.startswith("mongodb+srv://") or any(
+                        flag in mongo_db_url.lower() for flag in ("tls=true", "ssl=true")):
+                    MongoDBClient.client = pymongo.MongoClient(mongo_db_url, tlsCAFile=ca)
+                else:
+                    MongoDBClient.client = pymongo.MongoClient(mongo_db_url)
                 
             # Use the shared MongoClient for this instance
             self.client = MongoDBClient.client
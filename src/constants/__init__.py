@@ -8,17 +8,53 @@ MONGODB_URL_KEY = "MONGODB_URL"
 
 PIPELINE_NAME: str = ""
 ARTIFACT_DIR: str = "artifact"
+# start time at the beginning of a run id; month first, so run ids do not sort by time across
+# years: order runs by the parsed time. Existing run directories are named with it.
+RUN_ID_TIME_FORMAT: str = "%m_%d_%Y_%H_%M_%S"
 
 MODEL_FILE_NAME = "model.pkl"
+# profile of the training data saved next to the model, new data is checked for drift against it
+REFERENCE_PROFILE_FILE_NAME = "reference_profile.json"
 
 TARGET_COLUMN = "Response"
 CURRENT_YEAR = date.today().year
 PREPROCESSING_OBJECT_FILE_NAME = "preprocessing.pkl"
+FEATURE_ENCODER_OBJECT_FILE_NAME = "feature_encoder.pkl"
 
 FILE_NAME: str = "data.csv"
 TRAIN_FILE_NAME: str = 'train.csv'
 TEST_FILE_NAME: str = 'test.csv'
+TRAIN_TARGET_FILE_NAME: str = 'train_target.npy'
+TEST_TARGET_FILE_NAME: str = 'test_target.npy'
+# training rows before resampling, kept for the hyperparameter search
+UNRESAMPLED_TRAIN_FILE_NAME: str = 'train_unresampled.npy'
+UNRESAMPLED_TRAIN_TARGET_FILE_NAME: str = 'train_unresampled_target.npy'
 SCHEMA_FILE_PATH = os.path.join("config" , "schema.yaml")
+RUN_REPORT_FILE_NAME: str = "run_report.json"
+# index of stage outputs reused by later runs with the same inputs, config and code
+STAGE_CACHE_DIR: str = os.path.join(ARTIFACT_DIR, ".stage_cache")
+STAGE_CACHE_ENABLED: bool = True
+# reuse an export while the collection keeps its document count and max _id; updates of existing
+# documents keep both, so by default ingestion always runs and later stages are keyed by the exported rows
+STAGE_CACHE_INGESTION: bool = False
+# tasks of a training run that may run at the same time, and worker processes for CPU bound tasks
+PIPELINE_MAX_CONCURRENCY: int = 4
+PIPELINE_MAX_PROCESSES: int = 1
+# hand DataFrames and arrays between stages in memory; files are then written "async" or at the "end"
+PIPELINE_IN_MEMORY_HANDOFF: bool = False
+PIPELINE_PERSIST_MODE: str = "async"
+# completion markers of the stages of a run, read when the run is resumed
+RUN_STATE_DIR_NAME: str = ".state"
+# artifact/ clean up: runs kept whatever their age, and when their files get compressed
+ARTIFACT_RETENTION_KEEP_LAST_RUNS: int = 10
+ARTIFACT_RETENTION_KEEP_PUSHED: bool = True
+ARTIFACT_RETENTION_KEEP_YOUNGER_THAN_DAYS: float = 7.0
+ARTIFACT_RETENTION_COMPRESS_AFTER_DAYS = 30.0
+ARTIFACT_RETENTION_COMPRESS_EXTENSIONS: tuple = (".csv", ".npy")
+
+# Formats the data artifacts (feature store, train and test files) can be written in
+ARTIFACT_FILE_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+ARTIFACT_FILE_COMPRESSION = {"parquet": "zstd", "feather": "lz4"}
 
 AWS_ACCESS_KEY_ID_ENV_KEY = "AWS_ACCESS_KEY_ID"
 AWS_SECRET_ACCESS_KEY_ENV_KEY = "AWS_SECRET_ACCESS_KEY"
@@ -32,6 +68,53 @@ DATA_INGESTION_DIR_NAME :str = "data_ingestion"
 DATA_INGESTION_FEATURE_STORE_DIR :str = 'feature_store'
 DATA_INGESTION_INGESTED_DIR: str = 'ingested'
 DATA_INGESTION_TRAIN_TEST_SPLIT_RATIO: float = 0.25
+DATA_INGESTION_REPORT_FILE_NAME: str = 'ingestion_report.yaml'
+DATA_INGESTION_SERVER_SIDE_PROJECTION: bool = True
+DATA_INGESTION_FETCH_BATCH_SIZE: int = 10000
+DATA_INGESTION_USE_LIVE_FEATURE_STORE: bool = False
+DATA_INGESTION_FILE_FORMAT: str = "feather"
+# "hash" assigns each record by its key so the split is stable across runs, "random" reshuffles
+DATA_INGESTION_SPLIT_MODE: str = "hash"
+DATA_INGESTION_SPLIT_KEY_COLUMNS: list = ["id", "_id"]
+DATA_INGESTION_SPLIT_SALT: str = ""
+DATA_INGESTION_STRATIFY_SPLIT: bool = True
+DATA_INGESTION_RANDOM_STATE: int = 42
+# set a size or a fraction to train on a random sample of the collection instead of all of it
+DATA_INGESTION_SAMPLE_SIZE = None
+DATA_INGESTION_SAMPLE_FRACTION = None
+# "reservoir" is seeded and reproducible, "mongo" samples server side with $sample
+DATA_INGESTION_SAMPLE_METHOD: str = "reservoir"
+DATA_INGESTION_SAMPLE_SEED: int = 42
+DATA_INGESTION_SAMPLE_STRATIFY: bool = True
+
+'''
+Feature store sync (change stream consumer) related constants
+'''
+FEATURE_STORE_SYNC_DIR_NAME: str = "live_feature_store"
+FEATURE_STORE_SYNC_PARTS_DIR: str = "parts"
+FEATURE_STORE_SYNC_RESUME_TOKEN_FILE_NAME: str = "resume_token.json"
+FEATURE_STORE_SYNC_BATCH_SIZE: int = 5000
+FEATURE_STORE_SYNC_MAX_BATCH_WAIT_SECONDS: float = 30.0
+FEATURE_STORE_SYNC_COMPACT_AFTER_PARTS: int = 50
+
+'''
+Retraining scheduler related constants
+'''
+RETRAIN_SCHEDULER_DIR_NAME: str = "retrain_scheduler"
+RETRAIN_MODEL_NAME: str = "vehicle_insurance"
+# minute hour day-of-month month day-of-week, empty to disable
+RETRAIN_CRON_EXPRESSION: str = "0 2 * * 0"
+# new documents in the collection since the last run that trigger a retraining, None to disable
+RETRAIN_MIN_NEW_ROWS = 50000
+RETRAIN_DRIFT_THRESHOLD: float = 0.2
+# after a drift triggered run the same drift score only triggers again once this has passed,
+# e.g. when the run's model was rejected and the production reference did not change
+RETRAIN_DRIFT_COOLDOWN_SECONDS: float = 24 * 3600.0
+RETRAIN_POLL_SECONDS: float = 60.0
+# wait after a failed run, doubled after each further failure up to the maximum
+RETRAIN_BACKOFF_SECONDS: float = 300.0
+RETRAIN_MAX_BACKOFF_SECONDS: float = 6 * 3600.0
+RETRAIN_HISTORY_SIZE: int = 20
 
 
 '''
@@ -39,6 +122,24 @@ Data Validation
 '''
 DATA_VALIDATION_DIR_NAME : str = 'data_validation'
 DATA_VALIDATION_REPORT_FILE_NAME: str = 'report.yaml'
+DATA_VALIDATION_SOURCE_REPORT_FILE_NAME: str = 'source_profile_report.json'
+DATA_VALIDATION_PROFILE_SOURCE: bool = True
+# the transformation cannot handle missing values, so any null fails validation
+DATA_VALIDATION_MAX_NULL_RATE: float = 0.0
+# rows read at a time, the memory of the validation is bounded by it
+DATA_VALIDATION_CHUNK_ROWS: int = 100000
+# drift of the new data against the reference profile of the production model
+DATA_VALIDATION_CHECK_DRIFT: bool = True
+DATA_VALIDATION_DRIFT_PSI_THRESHOLD: float = 0.2
+DATA_VALIDATION_DRIFT_KS_THRESHOLD: float = 0.1
+DATA_VALIDATION_BLOCK_ON_DRIFT: bool = False
+# quantiles kept per numeric column; numeric columns with few distinct values get a frequency table
+DRIFT_REFERENCE_QUANTILES: int = 101
+DRIFT_MAX_DISCRETE_VALUES: int = 20
+DRIFT_PSI_BINS: int = 10
+# rows sampled to build the reference profile when the training data is streamed
+DRIFT_REFERENCE_SAMPLE_ROWS: int = 200000
+DATA_PROFILE_CACHE_DIR: str = os.path.join(ARTIFACT_DIR, "profile_cache")
 
 '''
 Data Transformation
@@ -46,6 +147,18 @@ Data Transformation
 DATA_TRANSFORMATION_DIR_NAME: str = "data_transformation"
 DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR: str ="transformed"
 DATA_TRANSFORMATION_TRANSFORMED_OBJECT_DIR: str = "transformed_object"
+# class imbalance: "smoteenn", "smoteenn_partitioned", "random_under", "class_weight" or "none"
+DATA_TRANSFORMATION_RESAMPLING_STRATEGY: str = "smoteenn"
+DATA_TRANSFORMATION_RESAMPLE_TEST: bool = True
+# threads of the neighbour searches (-1 for all cores) and row partitions of smoteenn_partitioned
+DATA_TRANSFORMATION_RESAMPLING_N_JOBS: int = -1
+DATA_TRANSFORMATION_RESAMPLING_PARTITIONS: int = 4
+DATA_TRANSFORMATION_RESAMPLING_RANDOM_STATE: int = 42
+# dtype of the transformed feature arrays, the trees train on float32 anyway
+DATA_TRANSFORMATION_FEATURES_DTYPE: str = "float32"
+# fit the scalers with partial_fit and write the arrays chunk by chunk into memory mapped files
+DATA_TRANSFORMATION_STREAMING: bool = False
+DATA_TRANSFORMATION_CHUNK_ROWS: int = 100000
 
 """
 MODEL TRAINER related constant start with MODEL_TRAINER var name
@@ -61,6 +174,23 @@ MODEL_TRAINER_MIN_SAMPLES_LEAF: int = 6
 MIN_SAMPLES_SPLIT_MAX_DEPTH: int = 10
 MIN_SAMPLES_SPLIT_CRITERION: str = 'entropy'
 MIN_SAMPLES_SPLIT_RANDOM_STATE: int = 101
+# model backend of src/entity/model_backends.py: random_forest or hist_gradient_boosting
+MODEL_TRAINER_BACKEND: str = "random_forest"
+MODEL_TRAINER_LEARNING_RATE: float = 0.1
+MODEL_TRAINER_MAX_ITER: int = 200
+MODEL_TRAINER_MAX_LEAF_NODES: int = 31
+# update the production forest with trees fitted on the data inserted since it was trained
+MODEL_TRAINER_INCREMENTAL: bool = False
+MODEL_TRAINER_INCREMENTAL_N_ESTIMATORS: int = 40
+# successive halving search over the space of config/model.yaml before training
+MODEL_TRAINER_SEARCH: bool = False
+MODEL_SEARCH_DIR_NAME: str = "model_search"
+MODEL_SEARCH_LEADERBOARD_FILE_NAME: str = "leaderboard.json"
+# forest fitted as sub-forests on stratified partitions of the training rows, merged afterwards
+MODEL_TRAINER_PARTITIONS: int = 1
+MODEL_TRAINER_PARTITION_QUEUE_TIMEOUT_SECONDS: int = 6 * 3600
+# a claimed task whose worker stopped its heartbeat for this long is queued again
+MODEL_TRAINER_PARTITION_QUEUE_STALE_SECONDS: int = 300
 
 """
 MODEL Evaluation related constants
@@ -1,36 +1,326 @@
 import sys
+import time
+import random
 import pandas as pd
 import numpy as np
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict
+
+import bson
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 
 from src.configuration.mongo_db_connection import MongoDBClient
-from src.constants import DATABASE_NAME
+from src.constants import DATABASE_NAME, SCHEMA_FILE_PATH, DATA_INGESTION_FETCH_BATCH_SIZE
 from src.exception import MyException
+from src.logger import logging
+from src.utils.main_utils import read_yaml_file, get_schema_columns
+
+# Values that the source data uses to mark a missing entry
+NA_VALUES = ["na"]
+
+# BSON numeric types requested from the server for each schema type
+BSON_NUMERIC_TYPES = {"int": "int", "float": "double"}
+
+
+@dataclass
+class DataTransferReport:
+    """
+    Bytes moved from MongoDB and the time spent fetching and decoding them for one export.
+    """
+    collection_name: str
+    server_side_projection: bool
+    documents: int = 0
+    bytes_transferred: int = 0
+    fetch_seconds: float = 0.0
+    decode_seconds: float = 0.0
+    dataframe_seconds: float = 0.0
+    columns: List[str] = field(default_factory=list)
+
+
+def build_field_projection(schema_config: dict, prefix: str = "") -> dict:
+    """
+    Returns the projection expressions for the schema columns.
+    Numeric columns are converted to native BSON numbers on the server and any value in
+    NA_VALUES (or a missing field) comes back as null, so nothing is fixed up client side.
+    prefix: path of the embedded document holding the columns, e.g. "fullDocument."
+    """
+    projection = {}
+    for column, column_type in get_schema_columns(schema_config):
+        field_path = f"${prefix}{column}"
+        if column_type in BSON_NUMERIC_TYPES:
+            projection[column] = {"$convert": {"input": field_path,
+                                               "to": BSON_NUMERIC_TYPES[column_type],
+                                               "onError": None,
+                                               "onNull": None}}
+        else:
+            projection[column] = {"$cond": [{"$in": [{"$ifNull": [field_path, NA_VALUES[0]]}, NA_VALUES]},
+                                            None,
+                                            field_path]}
+    return projection
+
+
+def build_projection_pipeline(schema_config: dict, include_object_id: bool = False) -> List[dict]:
+    """
+    Builds an aggregation pipeline that returns only the modeled columns of schema.yaml.
+    include_object_id: keep `_id` as a hex string, for consumers that key records on it
+    """
+    projection = {"_id": {"$toString": "$_id"} if include_object_id else 0}
+    projection.update(build_field_projection(schema_config))
+    return [{"$project": projection}]
+
+
+def object_id_range_filter(since_object_id: Optional[str] = None, until_object_id: Optional[str] = None) -> dict:
+    """
+    Query on `_id` for the documents inserted after since_object_id, up to until_object_id included.
+    ObjectIds grow with the insertion time, so the newest `_id` a model was trained on is a watermark
+    of the data it has seen.
+    """
+    object_id_range = {}
+    if since_object_id is not None:
+        object_id_range["$gt"] = ObjectId(since_object_id)
+    if until_object_id is not None:
+        object_id_range["$lte"] = ObjectId(until_object_id)
+    return {"_id": object_id_range} if object_id_range else {}
+
 
 class Proj1Data:
     def __init__(self):
         try:
             self.mongo_client = MongoDBClient(database_name=DATABASE_NAME)
+            self.last_transfer_report: Optional[DataTransferReport] = None
+            self.last_sample_report: Optional[dict] = None
         except Exception as e:
             raise MyException(e,sys)
-            
-    def export_collection_as_dataframe(self,collection_name: str , database_name: Optional[str] = None) -> pd.DataFrame:
+
+    def get_collection(self, collection_name: str, database_name: Optional[str] = None):
+        if database_name is None:
+            return self.mongo_client.database[collection_name]
+        return self.mongo_client.client[database_name][collection_name]
+
+    @staticmethod
+    def _read_cursor(cursor, report: DataTransferReport, batch_size: int = DATA_INGESTION_FETCH_BATCH_SIZE) -> list:
+        """
+        Drains a cursor of raw BSON documents, counting the bytes received and timing the
+        network fetch separately from decoding the documents into python dicts.
+        """
+        records = []
+        raw_batch = []
+        fetch_start = time.perf_counter()
+        for raw_document in cursor:
+            raw_batch.append(raw_document.raw)
+            if len(raw_batch) >= batch_size:
+                report.fetch_seconds += time.perf_counter() - fetch_start
+                records.extend(Proj1Data._decode_batch(raw_batch, report))
+                raw_batch = []
+                fetch_start = time.perf_counter()
+        report.fetch_seconds += time.perf_counter() - fetch_start
+        if raw_batch:
+            records.extend(Proj1Data._decode_batch(raw_batch, report))
+        return records
+
+    @staticmethod
+    def _decode_batch(raw_batch: List[bytes], report: DataTransferReport) -> list:
+        payload = b"".join(raw_batch)
+        decode_start = time.perf_counter()
+        decoded = bson.decode_all(payload)
+        report.decode_seconds += time.perf_counter() - decode_start
+        report.documents += len(raw_batch)
+        report.bytes_transferred += len(payload)
+        return decoded
+
+    def latest_object_id(self, collection_name: str, database_name: Optional[str] = None) -> Optional[str]:
+        """The `_id` of the newest document of the collection, None when it is empty"""
         try:
-            if database_name is None:
-                collection = self.mongo_client.database[collection_name]
-            else:
-                collection = self.mongo_client[database_name][collection_name]
-            
+            latest = self.get_collection(collection_name, database_name).find_one({}, projection={"_id": 1}, sort=[("_id", -1)])
+            return None if latest is None else str(latest["_id"])
+        except Exception as e:
+            raise MyException(e,sys)
+
+    def export_collection_as_dataframe(self,collection_name: str , database_name: Optional[str] = None,
+                                       server_side_projection: bool = True,
+                                       include_object_id: bool = False,
+                                       since_object_id: Optional[str] = None,
+                                       until_object_id: Optional[str] = None) -> pd.DataFrame:
+        """
+        Exports the collection as a DataFrame.
+        With server_side_projection, only the schema columns are requested and "na" handling and
+        numeric conversion happen inside MongoDB; otherwise every field is fetched and cleaned here.
+        since_object_id/until_object_id: export only the documents whose `_id` is in that range
+        The transfer statistics of the export are kept in `last_transfer_report`.
+        """
+        try:
+            collection = self.get_collection(collection_name, database_name)
+            range_filter = object_id_range_filter(since_object_id, until_object_id)
+            raw_collection = collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+            report = DataTransferReport(collection_name=collection_name,
+                                        server_side_projection=server_side_projection)
+
             print("Fetching data from Data base MongoDB")
-            df = pd.DataFrame(list(collection.find()))
+            if server_side_projection:
+                schema_config = read_yaml_file(file_path=SCHEMA_FILE_PATH)
+                pipeline = build_projection_pipeline(schema_config, include_object_id=include_object_id)
+                if range_filter:
+                    pipeline.insert(0, {"$match": range_filter})
+                column_names = [column for column, _ in get_schema_columns(schema_config)]
+                if include_object_id:
+                    column_names.insert(0, "_id")
+                cursor = raw_collection.aggregate(pipeline, allowDiskUse=True,
+                                                  batchSize=DATA_INGESTION_FETCH_BATCH_SIZE)
+            else:
+                column_names = None
+                cursor = raw_collection.find(range_filter, batch_size=DATA_INGESTION_FETCH_BATCH_SIZE)
+
+            records = self._read_cursor(cursor, report)
+
+            frame_start = time.perf_counter()
+            df = pd.DataFrame.from_records(records, columns=column_names)
+            report.dataframe_seconds = time.perf_counter() - frame_start
             print(f"Data fetched with len{len(df)}")
-            
-            if "id" in df.columns.to_list():
-                df = df.drop(columns = ["id"] , axis = 1)
-            
-            df.replace({"na":np.nan},inplace=True)
-            
+
+            if not server_side_projection:
+                if "id" in df.columns.to_list():
+                    df = df.drop(columns = ["id"])
+
+                df.replace({"na":np.nan},inplace=True)
+
+            report.columns = df.columns.to_list()
+            self.last_transfer_report = report
+            logging.info(f"Transfer report: {report.documents} documents, {report.bytes_transferred} bytes, "
+                         f"fetch {report.fetch_seconds:.3f}s, decode {report.decode_seconds:.3f}s")
+
             return df
-        
+
         except Exception as e:
-            raise MyException(e,sys)
\ No newline at end of file
+            raise MyException(e,sys)
+
+    @staticmethod
+    def _allocate_quotas(class_counts: Dict[object, int], sample_size: int) -> Dict[object, int]:
+        """
+        Splits sample_size between the classes in proportion to their counts (largest remainder)
+        """
+        population = sum(class_counts.values())
+        if population <= sample_size:
+            return dict(class_counts)
+        exact = {label: count * sample_size / population for label, count in class_counts.items()}
+        quotas = {label: int(share) for label, share in exact.items()}
+        for label in sorted(exact, key=lambda label: exact[label] - quotas[label], reverse=True)[:sample_size - sum(quotas.values())]:
+            quotas[label] += 1
+        return quotas
+
+    @staticmethod
+    def _reservoir_sample(cursor, report: DataTransferReport, sample_size: Optional[int], sample_fraction: Optional[float],
+                          seed: int, stratify_column: Optional[str]) -> tuple:
+        """
+        Samples raw BSON documents in a single pass over the cursor.
+        With sample_size, one reservoir (algorithm R) per class of stratify_column is kept, then each
+        class is cut down to its share of the observed class counts; any subset drawn at random from a
+        uniform reservoir is itself uniform. With sample_fraction, every document is kept with that
+        probability. Only the sampled documents are decoded.
+        """
+        rng = random.Random(seed)
+        reservoirs: Dict[object, List[bytes]] = {}
+        class_counts: Dict[object, int] = {}
+        fetch_start = time.perf_counter()
+        for raw_document in cursor:
+            label = raw_document[stratify_column] if stratify_column else None
+            seen = class_counts.get(label, 0)
+            class_counts[label] = seen + 1
+            reservoir = reservoirs.setdefault(label, [])
+            if sample_fraction is not None:
+                if rng.random() < sample_fraction:
+                    reservoir.append(raw_document.raw)
+            elif seen < sample_size:
+                reservoir.append(raw_document.raw)
+            else:
+                slot = rng.randrange(seen + 1)
+                if slot < sample_size:
+                    reservoir[slot] = raw_document.raw
+        report.fetch_seconds += time.perf_counter() - fetch_start
+
+        if sample_fraction is None:
+            quotas = Proj1Data._allocate_quotas(class_counts, sample_size)
+            reservoirs = {label: rng.sample(reservoir, quotas[label]) for label, reservoir in reservoirs.items()}
+        raw_sample = [raw for reservoir in reservoirs.values() for raw in reservoir]
+        records = Proj1Data._decode_batch(raw_sample, report) if raw_sample else []
+        report.documents = sum(class_counts.values())
+        return records, class_counts
+
+    def _mongo_sample_pipelines(self, collection, sample_size: Optional[int], sample_fraction: Optional[float],
+                                stratify_column: Optional[str]) -> List[List[dict]]:
+        """
+        Builds the sampling stages run by MongoDB itself. $sample and $rand cannot be seeded, so
+        these samples are not reproducible. Stratified fixed-size samples run one $sample per class.
+        """
+        if sample_fraction is not None:
+            return [[{"$match": {"$expr": {"$lt": [{"$rand": {}}, sample_fraction]}}}]]
+        if not stratify_column:
+            return [[{"$sample": {"size": sample_size}}]]
+        class_counts = {group["_id"]: group["count"]
+                        for group in collection.aggregate([{"$group": {"_id": f"${stratify_column}", "count": {"$sum": 1}}}])}
+        quotas = self._allocate_quotas(class_counts, sample_size)
+        return [[{"$match": {stratify_column: label}}, {"$sample": {"size": quota}}]
+                for label, quota in quotas.items() if quota > 0]
+
+    def sample_collection_as_dataframe(self, collection_name: str, sample_size: Optional[int] = None,
+                                       sample_fraction: Optional[float] = None, method: str = "reservoir",
+                                       seed: int = 42, stratify_column: Optional[str] = None,
+                                       database_name: Optional[str] = None) -> pd.DataFrame:
+        """
+        Exports a random sample of the collection as a DataFrame, either a fixed number of rows
+        (sample_size) or a share of the collection (sample_fraction).
+        method: "reservoir" streams the whole projected collection once and samples client side,
+                reproducibly for a given seed; "mongo" lets the server sample with $sample/$rand,
+                which only transfers the sampled documents but ignores the seed.
+        The transfer statistics are kept in `last_transfer_report` and the sampling details in
+        `last_sample_report`.
+        """
+        try:
+            if (sample_size is None) == (sample_fraction is None):
+                raise ValueError("Exactly one of sample_size and sample_fraction must be given")
+            collection = self.get_collection(collection_name, database_name)
+            raw_collection = collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+            report = DataTransferReport(collection_name=collection_name, server_side_projection=True)
+            schema_config = read_yaml_file(file_path=SCHEMA_FILE_PATH)
+            projection = build_projection_pipeline(schema_config)
+            column_names = [column for column, _ in get_schema_columns(schema_config)]
+
+            logging.info(f"Sampling collection {collection_name} with method {method}, size {sample_size}, "
+                         f"fraction {sample_fraction}, seed {seed}, stratified on {stratify_column}")
+            if method == "reservoir":
+                cursor = raw_collection.aggregate(projection, allowDiskUse=True, batchSize=DATA_INGESTION_FETCH_BATCH_SIZE)
+                records, class_counts = self._reservoir_sample(cursor, report, sample_size, sample_fraction,
+                                                               seed, stratify_column)
+                population_rows = sum(class_counts.values())
+            elif method == "mongo":
+                records = []
+                for sample_stages in self._mongo_sample_pipelines(collection, sample_size, sample_fraction, stratify_column):
+                    cursor = raw_collection.aggregate(sample_stages + projection, allowDiskUse=True,
+                                                      batchSize=DATA_INGESTION_FETCH_BATCH_SIZE)
+                    records.extend(self._read_cursor(cursor, report))
+                population_rows = collection.estimated_document_count()
+            else:
+                raise ValueError(f"Unknown sample method {method}, expected 'reservoir' or 'mongo'")
+
+            frame_start = time.perf_counter()
+            df = pd.DataFrame.from_records(records, columns=column_names)
+            report.dataframe_seconds = time.perf_counter() - frame_start
+            report.columns = df.columns.to_list()
+            self.last_transfer_report = report
+
+            self.last_sample_report = {"method": method,
+                                       "sample_size": sample_size,
+                                       "sample_fraction": sample_fraction,
+                                       "seed": seed,
+                                       "stratify_column": stratify_column,
+                                       "population_rows": population_rows,
+                                       "sample_rows": len(df)}
+            if stratify_column:
+                self.last_sample_report["sample_class_counts"] = {str(label): int(count) for label, count
+                                                                  in df[stratify_column].value_counts().items()}
+            logging.info(f"Sampled {len(df)} of {population_rows} documents")
+            return df
+
+        except Exception as e:
+            raise MyException(e,sys)
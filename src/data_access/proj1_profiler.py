@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from typing import List
+
+import numpy as np
+
+from src.configuration.mongo_db_connection import MongoDBClient
+from src.constants import DATABASE_NAME, SCHEMA_FILE_PATH, DATA_INGESTION_COLLECTION_NAME, DATA_PROFILE_CACHE_DIR
+from src.data_access.proj1_data import build_field_projection
+from src.exception import MyException
+from src.logger import logging
+from src.utils.main_utils import read_yaml_file, get_schema_columns
+from src.utils.drift_utils import DriftSketch
+
+# Most frequent values kept per categorical column
+MAX_CATEGORY_VALUES = 100
+
+
+def build_profile_pipeline(schema_config: dict) -> List[dict]:
+    """
+    Builds an aggregation pipeline that profiles the collection inside MongoDB.
+    The documents are first normalized with the same projection as the ingestion export, then a
+    single $facet computes the row count, null counts, min/max/mean of the numeric columns and
+    the value frequencies of the categorical columns. The result is one small document.
+    """
+    numeric_stats = {"_id": None}
+    facets = {"rows": [{"$count": "count"}]}
+    for column, column_type in get_schema_columns(schema_config):
+        field_path = f"${column}"
+        if column_type == "category":
+            facets[f"category__{column}"] = [{"$group": {"_id": field_path, "count": {"$sum": 1}}},
+                                             {"$sort": {"count": -1}},
+                                             {"$limit": MAX_CATEGORY_VALUES}]
+        else:
+            numeric_stats[f"{column}__nulls"] = {"$sum": {"$cond": [{"$eq": [field_path, None]}, 1, 0]}}
+            numeric_stats[f"{column}__min"] = {"$min": field_path}
+            numeric_stats[f"{column}__max"] = {"$max": field_path}
+            numeric_stats[f"{column}__mean"] = {"$avg": field_path}
+    facets["numeric"] = [{"$group": numeric_stats}]
+
+    return [{"$project": {"_id": 0, **build_field_projection(schema_config)}},
+            {"$facet": facets}]
+
+
+def build_drift_pipeline(reference: dict, schema_config: dict) -> List[dict]:
+    """
+    Builds an aggregation pipeline that counts the collection into the bins and categories of a
+    reference profile inside MongoDB: a $bucket over the reference quantiles per numeric column
+    and a $group per categorical column, in a single $facet.
+    """
+    facets = {}
+    for column, column_reference in reference["columns"].items():
+        field_path = f"${column}"
+        not_null = {"$match": {column: {"$ne": None}}}
+        if column_reference["kind"] == "numeric":
+            edges = column_reference["edges"]
+            # $bucket bounds are exclusive on the right, the reference maximum belongs in the last bin;
+            # values below the reference minimum get a bucket of their own, the default holds those above it
+            boundaries = [float("-inf")] + edges[:-1] + [float(np.nextafter(edges[-1], np.inf))]
+            facets[column] = [not_null, {"$bucket": {"groupBy": field_path, "boundaries": boundaries,
+                                                     "default": "outside", "output": {"count": {"$sum": 1}}}}]
+        else:
+            facets[column] = [not_null, {"$group": {"_id": field_path, "count": {"$sum": 1}}}]
+    facets["rows"] = [{"$count": "count"}]
+
+    return [{"$project": {"_id": 0, **build_field_projection(schema_config)}},
+            {"$facet": facets}]
+
+
+def _category_key(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+class Proj1DataProfiler:
+    """
+    Profiles a collection with an aggregation pipeline run by MongoDB, so only the statistics
+    document crosses the network. Profiles are cached on disk under a key made of the collection's
+    document count and max `_id`, which change whenever documents are inserted or removed.
+    """
+
+    def __init__(self, profile_cache_dir: str = DATA_PROFILE_CACHE_DIR):
+        try:
+            self.mongo_client = MongoDBClient(database_name=DATABASE_NAME)
+            self.profile_cache_dir = profile_cache_dir
+            self._schema_config = read_yaml_file(file_path=SCHEMA_FILE_PATH)
+        except Exception as e:
+            raise MyException(e, sys)
+
+    def get_cache_key(self, collection_name: str) -> str:
+        """
+        Returns the key identifying the current state of the collection
+        """
+        try:
+            collection = self.mongo_client.database[collection_name]
+            document_count = collection.estimated_document_count()
+            last_document = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            max_id = str(last_document["_id"]) if last_document else "none"
+            return f"{collection_name}_{document_count}_{max_id}"
+        except Exception as e:
+            raise MyException(e, sys)
+
+    def _to_profile(self, collection_name: str, cache_key: str, result: dict) -> dict:
+        row_count = result["rows"][0]["count"] if result["rows"] else 0
+        numeric = result["numeric"][0] if result["numeric"] else {}
+        columns = {}
+        for column, column_type in get_schema_columns(self._schema_config):
+            if column_type == "category":
+                frequencies = {str(group["_id"]): group["count"]
+                               for group in result[f"category__{column}"] if group["_id"] is not None}
+                null_count = next((group["count"] for group in result[f"category__{column}"]
+                                   if group["_id"] is None), 0)
+                columns[column] = {"type": column_type, "null_count": null_count, "frequencies": frequencies}
+            else:
+                null_count = numeric.get(f"{column}__nulls", 0)
+                columns[column] = {"type": column_type,
+                                   "null_count": null_count,
+                                   "min": numeric.get(f"{column}__min"),
+                                   "max": numeric.get(f"{column}__max"),
+                                   "mean": numeric.get(f"{column}__mean")}
+            columns[column]["null_rate"] = null_count / row_count if row_count else 0.0
+
+        return {"collection": collection_name,
+                "cache_key": cache_key,
+                "profiled_at": datetime.now().isoformat(timespec="seconds"),
+                "row_count": row_count,
+                "columns": columns}
+
+    def profile_collection(self, collection_name: str = DATA_INGESTION_COLLECTION_NAME,
+                           use_cache: bool = True) -> dict:
+        """
+        Returns the statistics document of the collection, from the cache when the collection
+        has not changed since it was last profiled.
+        """
+        try:
+            cache_key = self.get_cache_key(collection_name)
+            cache_file_path = os.path.join(self.profile_cache_dir, f"{cache_key}.json")
+            if use_cache and os.path.exists(cache_file_path):
+                logging.info(f"Using cached profile {cache_file_path}")
+                with open(cache_file_path) as cache_file:
+                    return json.load(cache_file)
+
+            logging.info(f"Profiling collection {collection_name} inside MongoDB")
+            collection = self.mongo_client.database[collection_name]
+            result = next(collection.aggregate(build_profile_pipeline(self._schema_config), allowDiskUse=True))
+            profile = self._to_profile(collection_name, cache_key, result)
+
+            os.makedirs(self.profile_cache_dir, exist_ok=True)
+            with open(cache_file_path, "w") as cache_file:
+                json.dump(profile, cache_file, indent=4, default=str)
+            logging.info(f"Profile of {profile['row_count']} documents saved to {cache_file_path}")
+            return profile
+        except Exception as e:
+            raise MyException(e, sys)
+
+
+    def drift_sketch(self, reference: dict, collection_name: str = DATA_INGESTION_COLLECTION_NAME) -> DriftSketch:
+        """
+        Returns the counts of the collection in the bins of the reference profile, computed by
+        MongoDB. Values outside the reference range are counted below or above it, as DriftSketch.update does.
+        """
+        try:
+            collection = self.mongo_client.database[collection_name]
+            result = next(collection.aggregate(build_drift_pipeline(reference, self._schema_config), allowDiskUse=True))
+            sketch = DriftSketch(reference)
+            sketch.rows = result["rows"][0]["count"] if result["rows"] else 0
+            for column, column_reference in reference["columns"].items():
+                if column_reference["kind"] == "numeric":
+                    edges = column_reference["edges"]
+                    for group in result[column]:
+                        if group["_id"] == "outside":
+                            sketch.counts[column][len(edges)] += group["count"]
+                        elif group["_id"] == float("-inf"):
+                            sketch.counts[column][0] += group["count"]
+                        else:
+                            sketch.counts[column][int(np.searchsorted(edges, group["_id"])) + 1] += group["count"]
+                else:
+                    sketch.add_category_counts(column, {_category_key(group["_id"]): group["count"]
+                                                        for group in result[column]})
+            logging.info(f"Counted {sketch.rows} documents of {collection_name} into the reference profile")
+            return sketch
+        except Exception as e:
+            raise MyException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile a MongoDB collection with server side aggregation")
+    parser.add_argument("--collection", default=DATA_INGESTION_COLLECTION_NAME)
+    parser.add_argument("--no-cache", action="store_true", help="always recompute the profile")
+    args = parser.parse_args()
+
+    collection_profile = Proj1DataProfiler().profile_collection(args.collection, use_cache=not args.no_cache)
+    print(json.dumps(collection_profile, indent=4, default=str))
@@ -1,9 +1,26 @@
-from dataclasses import dataclass
+import sys
+from dataclasses import dataclass, field, fields, is_dataclass
+from typing import Optional
+
+def in_memory_field():
+    """
+    An artifact field holding data handed to the next stage in memory (DataFrame, array, object).
+    It is never serialized; a stage that finds it empty reads the artifact files instead.
+    """
+    return field(default=None, repr=False, compare=False, metadata={"in_memory": True})
 
 @dataclass
 class DataIngestionArtifacts:
     trained_file_path:str
     test_file_path:str
+    sample_report: Optional[dict] = None
+    source_rows: Optional[int] = None
+    train_rows: Optional[int] = None
+    test_rows: Optional[int] = None
+    # `_id` of the newest exported document, None for samples and the live feature store
+    watermark: Optional[str] = None
+    train_df: object = in_memory_field()
+    test_df: object = in_memory_field()
     
 @dataclass
 class DataValidationArtifacts:
@@ -14,8 +31,30 @@ class DataValidationArtifacts:
 @dataclass
 class DataTransformedArtifacts:
     transformed_object_file:str
+    # features only, the targets are saved on their own in a compact integer dtype
     transformed_train_file: str
     transformed_test_file: str
+    transformed_train_target_file: Optional[str] = None
+    transformed_test_target_file: Optional[str] = None
+    # profile of the training data the trained model is shipped with
+    reference_profile_file: Optional[str] = None
+    feature_encoder_file: Optional[str] = None
+    # set when the resampling strategy leaves the imbalance to the model, e.g. "balanced"
+    class_weight: Optional[str] = None
+    resampling_report: Optional[dict] = None
+    # the training rows before resampling, with keep_unresampled_train; the train files themselves
+    # when the resampling strategy keeps the rows
+    unresampled_train_file: Optional[str] = None
+    unresampled_train_target_file: Optional[str] = None
+    preprocessor: object = in_memory_field()
+    feature_encoder: object = in_memory_field()
+    train_arr: object = in_memory_field()
+    test_arr: object = in_memory_field()
+    train_target_arr: object = in_memory_field()
+    test_target_arr: object = in_memory_field()
+    # raw test features, before encoding and scaling, as the saved model expects them
+    test_features_df: object = in_memory_field()
+    test_target: object = in_memory_field()
     
 @dataclass
 class ClassificationMetricArtifacts:
@@ -27,6 +66,14 @@ class ClassificationMetricArtifacts:
 class ModelTrainerArtifacts:
     trained_model_file_path: str
     metric_artifact:ClassificationMetricArtifacts
+    trained_model: object = in_memory_field()
+    
+@dataclass
+class ModelSearchArtifact:
+    # ModelTraninerConfig fields of the best candidate, the trainer is configured with them
+    best_params: dict
+    best_score: float
+    leaderboard_file_path: str
     
 @dataclass
 class ModelEvaluationArtifact:
@@ -38,4 +85,37 @@ class ModelEvaluationArtifact:
 @dataclass
 class ModelPusherArtifact:
     bucket_name:str
-    s3_model_path:str
\ No newline at end of file
+    s3_model_path:str
+
+
+def _persistent_fields(artifact) -> dict:
+    values = {}
+    for artifact_field in fields(artifact):
+        if artifact_field.metadata.get("in_memory"):
+            continue
+        value = getattr(artifact, artifact_field.name)
+        values[artifact_field.name] = _persistent_fields(value) if is_dataclass(value) else value
+    return values
+
+
+def artifact_to_dict(artifact) -> dict:
+    """
+    Returns a JSON serializable dict of an artifact dataclass, tagged with its class name.
+    In-memory fields are left out.
+    """
+    return {"artifact_type": type(artifact).__name__, "fields": _persistent_fields(artifact)}
+
+
+def artifact_from_dict(content: dict):
+    """
+    Rebuilds the artifact dataclass written by artifact_to_dict, nested artifacts included
+    """
+    artifact_class = getattr(sys.modules[__name__], content["artifact_type"])
+    values = dict(content["fields"])
+    for artifact_field in fields(artifact_class):
+        nested_class = globals().get(artifact_field.type) if isinstance(artifact_field.type, str) else artifact_field.type
+        if is_dataclass(nested_class) and isinstance(values.get(artifact_field.name), dict):
+            values[artifact_field.name] = artifact_from_dict({"artifact_type": nested_class.__name__,
+                                                              "fields": values[artifact_field.name]})
+    return artifact_class(**values)
+
@@ -1,54 +1,207 @@
 import os
+import uuid
 from src.constants import *
-from dataclasses import dataclass
+from src.utils.main_utils import with_file_format
+from dataclasses import dataclass, field
+from typing import Optional
 from datetime import datetime
 
-TIMESTAMP: str = datetime.now().strftime("%m_%d_%Y_%H_%M_%S")
+def new_run_id() -> str:
+    """
+    Returns a run id that starts with the start time in RUN_ID_TIME_FORMAT and stays unique across
+    runs started in the same second. The ids do not sort by time across years, parse the time to order runs.
+    """
+    return f"{datetime.now().strftime(RUN_ID_TIME_FORMAT)}_{uuid.uuid4().hex[:6]}"
+
+def new_run_dir() -> str:
+    return os.path.join(ARTIFACT_DIR, new_run_id())
 
 @dataclass
 class TraningPipelineConfig:
     pipeline_name: str = PIPELINE_NAME
-    artifact_dir: str = os.path.join(ARTIFACT_DIR, TIMESTAMP)
-    timestamp: str = TIMESTAMP
-    
-training_pipline_config: TraningPipelineConfig = TraningPipelineConfig()
+    run_id: str = field(default_factory=new_run_id)
+    artifact_dir: Optional[str] = None
+    timestamp: str = field(default_factory=lambda: datetime.now().strftime(RUN_ID_TIME_FORMAT))
+    run_report_file_path: Optional[str] = None
+
+    def __post_init__(self):
+        self.artifact_dir = self.artifact_dir or os.path.join(ARTIFACT_DIR, self.run_id)
+        self.run_report_file_path = self.run_report_file_path or os.path.join(self.artifact_dir, RUN_REPORT_FILE_NAME)
+
+# The stage configs below write under artifact_dir, the directory of one run. Paths left as None
+# are derived from it; build_pipeline_configs creates the configs of a run together.
 
 @dataclass
 class DataIngestionConfig:
-    data_ingestion_dir : str = os.path.join(training_pipline_config.artifact_dir,DATA_INGESTION_DIR_NAME)
-    feature_store_file_path : str = os.path.join(data_ingestion_dir,DATA_INGESTION_FEATURE_STORE_DIR,FILE_NAME)
-    training_file_path :str = os.path.join(data_ingestion_dir,DATA_INGESTION_INGESTED_DIR ,TRAIN_FILE_NAME)
-    testing_file_path:str = os.path.join(data_ingestion_dir, DATA_INGESTION_INGESTED_DIR,TEST_FILE_NAME)
+    artifact_dir: str = field(default_factory=new_run_dir)
+    data_ingestion_dir : Optional[str] = None
+    feature_store_file_path : Optional[str] = None
+    training_file_path : Optional[str] = None
+    testing_file_path: Optional[str] = None
     train_test_split_ratio: float = DATA_INGESTION_TRAIN_TEST_SPLIT_RATIO
     collection_name:str = DATA_INGESTION_COLLECTION_NAME
+    ingestion_report_file_path: Optional[str] = None
+    server_side_projection: bool = DATA_INGESTION_SERVER_SIDE_PROJECTION
+    use_live_feature_store: bool = DATA_INGESTION_USE_LIVE_FEATURE_STORE
+    live_feature_store_dir: str = os.path.join(ARTIFACT_DIR, FEATURE_STORE_SYNC_DIR_NAME)
+    file_format: str = DATA_INGESTION_FILE_FORMAT
+    split_mode: str = DATA_INGESTION_SPLIT_MODE
+    split_key_columns: tuple = tuple(DATA_INGESTION_SPLIT_KEY_COLUMNS)
+    split_salt: str = DATA_INGESTION_SPLIT_SALT
+    stratify_split: bool = DATA_INGESTION_STRATIFY_SPLIT
+    random_state: int = DATA_INGESTION_RANDOM_STATE
+    sample_size: Optional[int] = DATA_INGESTION_SAMPLE_SIZE
+    sample_fraction: Optional[float] = DATA_INGESTION_SAMPLE_FRACTION
+    sample_method: str = DATA_INGESTION_SAMPLE_METHOD
+    sample_seed: int = DATA_INGESTION_SAMPLE_SEED
+    sample_stratify: bool = DATA_INGESTION_SAMPLE_STRATIFY
+    # export only the documents inserted after this `_id`, the watermark of the model being updated
+    since_object_id: Optional[str] = None
+
+    def __post_init__(self):
+        self.data_ingestion_dir = self.data_ingestion_dir or os.path.join(self.artifact_dir, DATA_INGESTION_DIR_NAME)
+        self.feature_store_file_path = self.feature_store_file_path or os.path.join(self.data_ingestion_dir, DATA_INGESTION_FEATURE_STORE_DIR, FILE_NAME)
+        self.training_file_path = self.training_file_path or os.path.join(self.data_ingestion_dir, DATA_INGESTION_INGESTED_DIR, TRAIN_FILE_NAME)
+        self.testing_file_path = self.testing_file_path or os.path.join(self.data_ingestion_dir, DATA_INGESTION_INGESTED_DIR, TEST_FILE_NAME)
+        self.ingestion_report_file_path = self.ingestion_report_file_path or os.path.join(self.data_ingestion_dir, DATA_INGESTION_REPORT_FILE_NAME)
+        # the data files follow the selected format, "csv" keeps the original text hand-off
+        self.feature_store_file_path = with_file_format(self.feature_store_file_path, self.file_format)
+        self.training_file_path = with_file_format(self.training_file_path, self.file_format)
+        self.testing_file_path = with_file_format(self.testing_file_path, self.file_format)
+
+@dataclass
+class FeatureStoreSyncConfig:
+    feature_store_dir: str = os.path.join(ARTIFACT_DIR, FEATURE_STORE_SYNC_DIR_NAME)
+    parts_dir: str = os.path.join(feature_store_dir, FEATURE_STORE_SYNC_PARTS_DIR)
+    resume_token_file_path: str = os.path.join(feature_store_dir, FEATURE_STORE_SYNC_RESUME_TOKEN_FILE_NAME)
+    collection_name: str = DATA_INGESTION_COLLECTION_NAME
+    batch_size: int = FEATURE_STORE_SYNC_BATCH_SIZE
+    max_batch_wait_seconds: float = FEATURE_STORE_SYNC_MAX_BATCH_WAIT_SECONDS
+    compact_after_parts: int = FEATURE_STORE_SYNC_COMPACT_AFTER_PARTS
+
+@dataclass
+class RetrainSchedulerConfig:
+    model_name: str = RETRAIN_MODEL_NAME
+    scheduler_dir: str = os.path.join(ARTIFACT_DIR, RETRAIN_SCHEDULER_DIR_NAME)
+    collection_name: str = DATA_INGESTION_COLLECTION_NAME
+    cron_expression: str = RETRAIN_CRON_EXPRESSION
+    min_new_rows: Optional[int] = RETRAIN_MIN_NEW_ROWS
+    drift_threshold: float = RETRAIN_DRIFT_THRESHOLD
+    drift_cooldown_seconds: float = RETRAIN_DRIFT_COOLDOWN_SECONDS
+    # production model whose reference profile the collection is compared with
+    model_bucket_name: str = MODEL_BUCKET_NAME
+    s3_model_key_path: str = MODEL_FILE_NAME
+    poll_seconds: float = RETRAIN_POLL_SECONDS
+    backoff_seconds: float = RETRAIN_BACKOFF_SECONDS
+    max_backoff_seconds: float = RETRAIN_MAX_BACKOFF_SECONDS
+    history_size: int = RETRAIN_HISTORY_SIZE
+
+@dataclass
+class ArtifactRetentionConfig:
+    artifact_dir: str = ARTIFACT_DIR
+    stage_cache_dir: str = STAGE_CACHE_DIR
+    keep_last_runs: int = ARTIFACT_RETENTION_KEEP_LAST_RUNS
+    keep_pushed: bool = ARTIFACT_RETENTION_KEEP_PUSHED
+    keep_younger_than_days: float = ARTIFACT_RETENTION_KEEP_YOUNGER_THAN_DAYS
+    deduplicate: bool = True
+    compress_after_days: Optional[float] = ARTIFACT_RETENTION_COMPRESS_AFTER_DAYS
+    compress_extensions: tuple = ARTIFACT_RETENTION_COMPRESS_EXTENSIONS
+
 @dataclass
 class DataValidationConfig:
-    data_validation_dir: str = os.path.join(training_pipline_config.artifact_dir, DATA_VALIDATION_DIR_NAME)
-    validation_report_file_path = os.path.join(data_validation_dir , DATA_VALIDATION_REPORT_FILE_NAME)
+    artifact_dir: str = field(default_factory=new_run_dir)
+    data_validation_dir: Optional[str] = None
+    validation_report_file_path: Optional[str] = None
+    source_profile_report_file_path: Optional[str] = None
+    profile_source: bool = DATA_VALIDATION_PROFILE_SOURCE
+    max_null_rate: float = DATA_VALIDATION_MAX_NULL_RATE
+    chunk_rows: int = DATA_VALIDATION_CHUNK_ROWS
+    # reference profile of the production model in the model bucket, or a local file when set
+    check_drift: bool = DATA_VALIDATION_CHECK_DRIFT
+    drift_reference_file_path: Optional[str] = None
+    drift_reference_bucket_name: str = MODEL_BUCKET_NAME
+    drift_reference_model_key_path: str = MODEL_FILE_NAME
+    drift_psi_threshold: float = DATA_VALIDATION_DRIFT_PSI_THRESHOLD
+    drift_ks_threshold: float = DATA_VALIDATION_DRIFT_KS_THRESHOLD
+    block_on_drift: bool = DATA_VALIDATION_BLOCK_ON_DRIFT
+
+    def __post_init__(self):
+        self.data_validation_dir = self.data_validation_dir or os.path.join(self.artifact_dir, DATA_VALIDATION_DIR_NAME)
+        self.validation_report_file_path = self.validation_report_file_path or os.path.join(self.data_validation_dir, DATA_VALIDATION_REPORT_FILE_NAME)
+        self.source_profile_report_file_path = self.source_profile_report_file_path or os.path.join(self.data_validation_dir, DATA_VALIDATION_SOURCE_REPORT_FILE_NAME)
     
 @dataclass
 class DataTransformationConfig:
-    data_transformation_dir: str = os.path.join(training_pipline_config.artifact_dir , DATA_TRANSFORMATION_DIR_NAME )
-    transformed_train_file_path: str = os.path.join(data_transformation_dir , DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR,
-                                               TRAIN_FILE_NAME.replace("csv" , "npy"))
-    transformed_test_file_path: str = os.path.join(data_transformation_dir, DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR ,
-                                              TEST_FILE_NAME.replace("csv" , "npy"))
-    transformed_object_file_path: str = os.path.join(data_transformation_dir,
-                                                DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR,
-                                                PREPROCESSING_OBJECT_FILE_NAME)
+    artifact_dir: str = field(default_factory=new_run_dir)
+    data_transformation_dir: Optional[str] = None
+    transformed_train_file_path: Optional[str] = None
+    transformed_test_file_path: Optional[str] = None
+    transformed_train_target_file_path: Optional[str] = None
+    transformed_test_target_file_path: Optional[str] = None
+    transformed_object_file_path: Optional[str] = None
+    feature_encoder_file_path: Optional[str] = None
+    reference_profile_file_path: Optional[str] = None
+    resampling_strategy: str = DATA_TRANSFORMATION_RESAMPLING_STRATEGY
+    resample_test: bool = DATA_TRANSFORMATION_RESAMPLE_TEST
+    resampling_n_jobs: int = DATA_TRANSFORMATION_RESAMPLING_N_JOBS
+    resampling_partitions: int = DATA_TRANSFORMATION_RESAMPLING_PARTITIONS
+    resampling_random_state: int = DATA_TRANSFORMATION_RESAMPLING_RANDOM_STATE
+    features_dtype: str = DATA_TRANSFORMATION_FEATURES_DTYPE
+    streaming: bool = DATA_TRANSFORMATION_STREAMING
+    chunk_rows: int = DATA_TRANSFORMATION_CHUNK_ROWS
+    # also save the training rows before resampling, the search validates on rows of them
+    keep_unresampled_train: bool = False
+    unresampled_train_file_path: Optional[str] = None
+    unresampled_train_target_file_path: Optional[str] = None
+
+    def __post_init__(self):
+        self.data_transformation_dir = self.data_transformation_dir or os.path.join(self.artifact_dir, DATA_TRANSFORMATION_DIR_NAME)
+        transformed_data_dir = os.path.join(self.data_transformation_dir, DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR)
+        self.transformed_train_file_path = self.transformed_train_file_path or os.path.join(transformed_data_dir, TRAIN_FILE_NAME.replace("csv" , "npy"))
+        self.transformed_test_file_path = self.transformed_test_file_path or os.path.join(transformed_data_dir, TEST_FILE_NAME.replace("csv" , "npy"))
+        self.transformed_train_target_file_path = self.transformed_train_target_file_path or os.path.join(transformed_data_dir, TRAIN_TARGET_FILE_NAME)
+        self.transformed_test_target_file_path = self.transformed_test_target_file_path or os.path.join(transformed_data_dir, TEST_TARGET_FILE_NAME)
+        self.transformed_object_file_path = self.transformed_object_file_path or os.path.join(transformed_data_dir, PREPROCESSING_OBJECT_FILE_NAME)
+        self.feature_encoder_file_path = self.feature_encoder_file_path or os.path.join(transformed_data_dir, FEATURE_ENCODER_OBJECT_FILE_NAME)
+        self.reference_profile_file_path = self.reference_profile_file_path or os.path.join(self.data_transformation_dir, REFERENCE_PROFILE_FILE_NAME)
+        self.unresampled_train_file_path = self.unresampled_train_file_path or os.path.join(transformed_data_dir, UNRESAMPLED_TRAIN_FILE_NAME)
+        self.unresampled_train_target_file_path = self.unresampled_train_target_file_path or os.path.join(transformed_data_dir, UNRESAMPLED_TRAIN_TARGET_FILE_NAME)
 
 @dataclass
 class ModelTraninerConfig:
-    model_trainer_dir: str = os.path.join(training_pipline_config.artifact_dir, MODEL_TRAINER_DIR_NAME)
-    trained_model_file_path: str = os.path.join(model_trainer_dir,MODEL_TRAINER_TRAINED_MODEL_DIR,MODEL_FILE_NAME)
+    artifact_dir: str = field(default_factory=new_run_dir)
+    model_trainer_dir: Optional[str] = None
+    trained_model_file_path: Optional[str] = None
     expected_accuracy: float = MODEL_TRAINER_EXPECTED_SCORE
-    model_config_file_path: str = MODEL_TRAINER_EXPECTED_SCORE
-    _n_estimators = MODEL_TRAINER_N_ESTIMATORS
-    _min_sample_split = MODEL_TRAINER_MIN_SAMPLES_SPLIT
-    _min_sample_leaf = MODEL_TRAINER_MIN_SAMPLES_LEAF
-    _criterion = MIN_SAMPLES_SPLIT_CRITERION
-    _max_dept = MIN_SAMPLES_SPLIT_MAX_DEPTH
-    _random_state = MIN_SAMPLES_SPLIT_RANDOM_STATE
+    model_config_file_path: str = MODEL_TRAINER_MODEL_CONFIG_FILE_PATH
+    search: bool = MODEL_TRAINER_SEARCH
+    search_leaderboard_file_path: Optional[str] = None
+    _n_estimators: int = MODEL_TRAINER_N_ESTIMATORS
+    _min_sample_split: int = MODEL_TRAINER_MIN_SAMPLES_SPLIT
+    _min_sample_leaf: int = MODEL_TRAINER_MIN_SAMPLES_LEAF
+    _criterion: str = MIN_SAMPLES_SPLIT_CRITERION
+    _max_dept: int = MIN_SAMPLES_SPLIT_MAX_DEPTH
+    _random_state: int = MIN_SAMPLES_SPLIT_RANDOM_STATE
+    model_backend: str = MODEL_TRAINER_BACKEND
+    # hist_gradient_boosting only
+    _learning_rate: float = MODEL_TRAINER_LEARNING_RATE
+    _max_iter: int = MODEL_TRAINER_MAX_ITER
+    _max_leaf_nodes: int = MODEL_TRAINER_MAX_LEAF_NODES
+    # trees added to the production forest per incremental update, its oldest ones are retired
+    # to stay at _n_estimators
+    incremental: bool = MODEL_TRAINER_INCREMENTAL
+    incremental_n_estimators: int = MODEL_TRAINER_INCREMENTAL_N_ESTIMATORS
+    # random_forest only: fitted as `partitions` sub-forests of _n_estimators / partitions trees, one
+    # per stratified partition of the training rows, by at most partition_workers local processes, or
+    # by the workers serving the task queue directory partition_queue_dir, then merged into one forest
+    partitions: int = MODEL_TRAINER_PARTITIONS
+    partition_workers: Optional[int] = None
+    partition_queue_dir: Optional[str] = None
+
+    def __post_init__(self):
+        self.model_trainer_dir = self.model_trainer_dir or os.path.join(self.artifact_dir, MODEL_TRAINER_DIR_NAME)
+        self.trained_model_file_path = self.trained_model_file_path or os.path.join(self.model_trainer_dir, MODEL_TRAINER_TRAINED_MODEL_DIR, MODEL_FILE_NAME)
+        self.search_leaderboard_file_path = self.search_leaderboard_file_path or os.path.join(self.model_trainer_dir, MODEL_SEARCH_DIR_NAME, MODEL_SEARCH_LEADERBOARD_FILE_NAME)
     
 @dataclass
 class ModelEvaluationConfig:
@@ -64,4 +217,37 @@ class ModelPusherConfig:
 @dataclass
 class VehiclePredictorConfig:
     model_file_path: str = MODEL_FILE_NAME
-    model_bucket_name: str = MODEL_BUCKET_NAME
\ No newline at end of file
+    model_bucket_name: str = MODEL_BUCKET_NAME
+
+
+@dataclass
+class PipelineConfigs:
+    training_pipeline_config: TraningPipelineConfig
+    data_ingestion_config: DataIngestionConfig
+    data_validation_config: DataValidationConfig
+    data_transformation_config: DataTransformationConfig
+    model_trainer_config: ModelTraninerConfig
+    model_evaluation_config: ModelEvaluationConfig
+    model_pusher_config: ModelPusherConfig
+
+def build_pipeline_configs(run_dir: Optional[str] = None, run_id: Optional[str] = None, **overrides) -> PipelineConfigs:
+    """
+    Builds the configs of one training run, all writing under the run's own directory.
+    run_dir: an existing run directory to write into (e.g. to resume it), a new unique one by default
+    overrides: settings per stage, e.g. model_trainer={"_n_estimators": 50}, data_ingestion={"sample_size": 10000}
+    """
+    unknown = set(overrides) - {"data_ingestion", "data_validation", "data_transformation", "model_trainer",
+                                "model_evaluation", "model_pusher"}
+    if unknown:
+        raise ValueError(f"Unknown stages in config overrides: {sorted(unknown)}")
+    run_id = run_id or (os.path.basename(os.path.normpath(run_dir)) if run_dir else new_run_id())
+    training_pipeline_config = TraningPipelineConfig(run_id=run_id, artifact_dir=run_dir)
+    artifact_dir = training_pipeline_config.artifact_dir
+    return PipelineConfigs(
+        training_pipeline_config=training_pipeline_config,
+        data_ingestion_config=DataIngestionConfig(artifact_dir=artifact_dir, **overrides.get("data_ingestion", {})),
+        data_validation_config=DataValidationConfig(artifact_dir=artifact_dir, **overrides.get("data_validation", {})),
+        data_transformation_config=DataTransformationConfig(artifact_dir=artifact_dir, **overrides.get("data_transformation", {})),
+        model_trainer_config=ModelTraninerConfig(artifact_dir=artifact_dir, **overrides.get("model_trainer", {})),
+        model_evaluation_config=ModelEvaluationConfig(**overrides.get("model_evaluation", {})),
+        model_pusher_config=ModelPusherConfig(**overrides.get("model_pusher", {})))
@@ -1,11 +1,17 @@
 import sys
+from functools import lru_cache
+from typing import Optional, Union
 
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
 from sklearn.pipeline import Pipeline
 
+from src.constants import MODEL_TRAINER_BACKEND, SCHEMA_FILE_PATH, TARGET_COLUMN
+from src.entity.model_backends import get_model_backend
 from src.exception import MyException
 from src.logger import logging
+from src.utils.main_utils import get_schema_columns, get_model_columns, read_yaml_file
 
 class TargetValueMapping:
     def __init__(self):
@@ -17,29 +23,180 @@ class TargetValueMapping:
         mapping_response = self._asdict()
         return dict(zip(mapping_response.values(),mapping_response.keys()))
 
+def _dummy_column_name(column: str, value: str) -> str:
+    """Vehicle_Age, "< 1 Year" -> Vehicle_Age_lt_1_Year"""
+    return f"{column}_{value}".replace("<", "lt").replace(">", "gt").replace(" ", "_")
+
+
+class FeatureEncoder:
+    """
+    Encodes raw records (the model columns of the schema) into the features the preprocessing
+    object is fitted on: numeric columns as they are, the value_mappings columns as their codes
+    and the other categorical columns one-hot encoded without their first category.
+    The vocabulary of every categorical column and the output columns are frozen by fit, so any
+    batch, whatever categories it happens to contain, comes out with the same columns. Categories
+    are looked up as integer codes and written into a preallocated matrix.
+    """
+
+    def __init__(self, schema_config: dict):
+        self.drop_columns = list(schema_config.get("drop_columns", []))
+        self.value_mappings = dict(schema_config.get("value_mappings", {}))
+        self.categorical_columns = [column for column, column_type in get_schema_columns(schema_config)
+                                    if column_type == "category"]
+        self.input_columns = None
+        self.vocabulary = {}
+        self.feature_names = None
+
+    def fit(self, dataframe: DataFrame) -> "FeatureEncoder":
+        self.input_columns = None
+        self.vocabulary = {}
+        self.partial_fit(dataframe)
+        logging.info(f"Feature encoder fitted: {len(self.feature_names)} features, vocabulary {self.vocabulary}")
+        return self
+
+    def partial_fit(self, dataframe: DataFrame) -> "FeatureEncoder":
+        """Adds the categories of one chunk of the training data to the vocabulary"""
+        try:
+            if self.input_columns is None:
+                self.input_columns = [column for column in dataframe.columns if column not in self.drop_columns]
+            for column in self.input_columns:
+                if column in self.value_mappings:
+                    self.vocabulary[column] = [str(value) for value in self.value_mappings[column]]
+                elif column in self.categorical_columns:
+                    categories = set(self.vocabulary.get(column, [])) | {str(value) for value in pd.unique(dataframe[column].dropna())}
+                    self.vocabulary[column] = sorted(categories)
+
+            single_columns = [column for column in self.input_columns
+                              if column not in self.vocabulary or column in self.value_mappings]
+            one_hot_columns = [column for column in self.input_columns if column not in single_columns]
+            self.feature_names = single_columns + [_dummy_column_name(column, value) for column in one_hot_columns
+                                                   for value in self.vocabulary[column][1:]]
+            # where each input column is written in the output matrix
+            self._single_positions = [(column, position) for position, column in enumerate(single_columns)]
+            self._one_hot_offsets, offset = [], len(single_columns)
+            for column in one_hot_columns:
+                self._one_hot_offsets.append((column, offset))
+                offset += len(self.vocabulary[column]) - 1
+            return self
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def _codes(self, series: pd.Series, column: str) -> np.ndarray:
+        vocabulary = self.vocabulary[column]
+        values = series if series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype) else series.astype(str)
+        codes = pd.Categorical(values, categories=vocabulary).codes
+        if (codes < 0).any():
+            unknown = pd.unique(series[codes < 0].astype(str))[:5].tolist()
+            raise ValueError(f"Column {column} has values {unknown} outside the vocabulary {vocabulary}")
+        return codes
+
+    def encode(self, records: Union[DataFrame, dict, list]) -> np.ndarray:
+        """
+        Encodes raw records (a DataFrame, a list of dicts or a dict of columns) into a float matrix
+        with one column per feature name
+        """
+        try:
+            dataframe = records if isinstance(records, DataFrame) else DataFrame(records)
+            missing_columns = [column for column in self.input_columns if column not in dataframe.columns]
+            if missing_columns:
+                raise ValueError(f"Columns {missing_columns} are missing in the records to encode")
+
+            # column major, so every feature is written contiguously and the DataFrame over it needs no copy
+            matrix = np.empty((len(dataframe), len(self.feature_names)), dtype=np.float64, order="F")
+            for column, position in self._single_positions:
+                if column in self.value_mappings:
+                    mapped_values = np.array(list(self.value_mappings[column].values()), dtype=np.float64)
+                    matrix[:, position] = mapped_values[self._codes(dataframe[column], column)]
+                else:
+                    matrix[:, position] = pd.to_numeric(dataframe[column]).to_numpy(dtype=np.float64)
+            for column, offset in self._one_hot_offsets:
+                codes = self._codes(dataframe[column], column)
+                # the first category is the baseline and has no column
+                for code in range(1, len(self.vocabulary[column])):
+                    matrix[:, offset + code - 1] = codes == code
+            return matrix
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def transform(self, records: Union[DataFrame, dict, list]) -> DataFrame:
+        """Encoded records as a DataFrame over the encoded matrix, as the preprocessing object expects them"""
+        index = records.index if isinstance(records, DataFrame) else None
+        return DataFrame(self.encode(records), columns=self.feature_names, index=index, copy=False)
+
+    def fit_transform(self, dataframe: DataFrame) -> DataFrame:
+        return self.fit(dataframe).transform(dataframe)
+
+    def has_raw_categories(self, dataframe: DataFrame) -> bool:
+        """Whether the records hold categories as values (raw records) rather than as codes and dummy columns"""
+        return any(column in dataframe.columns and not pd.api.types.is_numeric_dtype(dataframe[column])
+                   for column in self.vocabulary)
+
+
+@lru_cache(maxsize=1)
+def legacy_feature_encoder() -> FeatureEncoder:
+    """
+    Encoder of the raw records for models saved before the encoder was stored in them. Those were
+    fitted on the Gender codes and on get_dummies(drop_first=True) of the other categorical
+    columns, i.e. the categories of the schema domains in sorted order without the first one,
+    which is what this encoder produces.
+    """
+    schema_config = read_yaml_file(file_path=SCHEMA_FILE_PATH)
+    domains = schema_config.get("domains", {})
+    columns = [column for column in get_model_columns(schema_config) if column != TARGET_COLUMN]
+    return FeatureEncoder(schema_config).fit(DataFrame({column: pd.Series(domains.get(column, [0])) for column in columns}))
+
+
 class MyModel:
-    def __init__(self, preprocessing_object: Pipeline, trained_model_object: object):
+    def __init__(self, preprocessing_object: Pipeline, trained_model_object: object,
+                 feature_encoder: Optional[FeatureEncoder] = None, backend: str = MODEL_TRAINER_BACKEND,
+                 watermark: Optional[str] = None):
         """
         :param preprocessing_object: Input Object of preprocesser
         :param trained_model_object: Input Object of trained model 
+        :param feature_encoder: Encoder of the raw records, None for models trained on pre-encoded features
+        :param backend: name of the model backend the trained model was built by, it predicts and serializes it
+        :param watermark: `_id` of the newest source document the model was trained on, incremental
+                          training updates it with the documents inserted after
         """
         self.preprocessing_object = preprocessing_object
         self.trained_model_object = trained_model_object
+        self.feature_encoder = feature_encoder
+        self.backend = backend
+        self.watermark = watermark
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["trained_model_object"] = get_model_backend(self.backend).serialize(self.trained_model_object)
+        return state
+
+    def __setstate__(self, state):
+        # models saved before the backends pickled the trained model as it is
+        state.setdefault("backend", MODEL_TRAINER_BACKEND)
+        state.setdefault("watermark", None)
+        if isinstance(state["trained_model_object"], bytes):
+            state["trained_model_object"] = get_model_backend(state["backend"]).deserialize(state["trained_model_object"])
+        self.__dict__.update(state)
 
     def predict(self, dataframe: pd.DataFrame) -> DataFrame:
         """
-        Function accepts preprocessed inputs (with all custom transformations already applied),
-        applies scaling using preprocessing_object, and performs prediction on transformed features.
+        Function accepts raw records, encodes them with the feature encoder, applies scaling using
+        preprocessing_object, and performs prediction on transformed features.
+        Models saved without a feature encoder accept encoded features too.
         """
         try:
             logging.info("Starting prediction process.")
 
-            # Step 1: Apply scaling transformations using the pre-trained preprocessing object
+            # Step 1: Encode the raw records and apply scaling transformations using the pre-trained preprocessing object
+            if getattr(self, "feature_encoder", None) is not None:
+                dataframe = self.feature_encoder.transform(dataframe)
+            elif legacy_feature_encoder().has_raw_categories(dataframe):
+                # a model saved before the encoder, e.g. the production model, served raw records
+                dataframe = legacy_feature_encoder().transform(dataframe)
             transformed_feature = self.preprocessing_object.transform(dataframe)
 
             # Step 2: Perform prediction using the trained model
             logging.info("Using the trained model to get predictions")
-            predictions = self.trained_model_object.predict(transformed_feature)
+            predictions = get_model_backend(self.backend).predict(self.trained_model_object, transformed_feature)
 
             return predictions
 
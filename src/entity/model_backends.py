@@ -0,0 +1,116 @@
+import pickle
+from typing import Optional
+
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+
+from src.entity.config_entity import ModelTraninerConfig
+
+
+class ModelBackend:
+    """
+    A kind of model the trainer can fit and MyModel can serve: how it is built from the trainer
+    config, fitted, serialized and predicted. Backends are stateless, models are passed to them.
+    """
+    name: str
+    # whether warm_start can add models fitted on new rows to a fitted model
+    incremental = False
+    # whether merge can combine models fitted on separate partitions of the rows
+    mergeable = False
+
+    def build(self, model_trainer_config: ModelTraninerConfig, class_weight: Optional[str] = None) -> object:
+        raise NotImplementedError
+
+    def fit(self, model: object, features: np.ndarray, target: np.ndarray) -> object:
+        return model.fit(features, target)
+
+    def predict(self, model: object, features: np.ndarray) -> np.ndarray:
+        return model.predict(features)
+
+    def warm_start(self, model: object, features: np.ndarray, target: np.ndarray, new_models: int, max_models: int,
+                   class_weight: Optional[str] = None) -> object:
+        raise ValueError(f"The {self.name} backend cannot be trained incrementally")
+
+    def merge(self, models: list) -> object:
+        raise ValueError(f"The {self.name} backend cannot merge models fitted on partitions")
+
+    def serialize(self, model: object) -> bytes:
+        return pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def deserialize(self, model_bytes: bytes) -> object:
+        return pickle.loads(model_bytes)
+
+
+class RandomForestBackend(ModelBackend):
+    name = "random_forest"
+    incremental = True
+    mergeable = True
+
+    def build(self, model_trainer_config, class_weight=None):
+        return RandomForestClassifier(
+            n_estimators= model_trainer_config._n_estimators,
+            min_samples_split = model_trainer_config._min_sample_split,
+            min_samples_leaf= model_trainer_config._min_sample_leaf,
+            max_depth= model_trainer_config._max_dept,
+            criterion= model_trainer_config._criterion,
+            random_state=model_trainer_config._random_state,
+            class_weight=class_weight
+        )
+
+    def warm_start(self, model, features, target, new_models, max_models, class_weight=None):
+        """
+        Adds new_models trees fitted on the given rows only to a fitted forest, then retires its
+        oldest trees beyond max_models, so the forest follows the recent data at a bounded size.
+        The new rows must hold every class of the forest, trees fitted on fewer classes cannot vote with it.
+        """
+        classes = np.unique(target)
+        if not np.array_equal(classes, model.classes_):
+            raise ValueError(f"The new rows hold the classes {classes.tolist()}, the forest was fitted on "
+                             f"{model.classes_.tolist()}; train from scratch instead of incrementally")
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + new_models, class_weight=class_weight)
+        model.fit(features, target)
+        model.estimators_ = model.estimators_[-max_models:]
+        model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+        return model
+
+    def merge(self, models):
+        """
+        One forest voting with the trees of every sub-forest. The sub-forests must have been fitted
+        on the same classes and features, which stratified partitions of the rows ensure.
+        """
+        forest = models[0]
+        for model in models[1:]:
+            if not np.array_equal(model.classes_, forest.classes_) or model.n_features_in_ != forest.n_features_in_:
+                raise ValueError("Sub-forests fitted on different classes or features cannot be merged")
+        forest.estimators_ = [tree for model in models for tree in model.estimators_]
+        forest.set_params(n_estimators=len(forest.estimators_))
+        return forest
+
+
+class HistGradientBoostingBackend(ModelBackend):
+    """
+    Gradient boosting over features binned into at most 255 values: fits much faster than the
+    forest on many rows and gives a smaller model, whose trees are shallow
+    """
+    name = "hist_gradient_boosting"
+
+    def build(self, model_trainer_config, class_weight=None):
+        return HistGradientBoostingClassifier(
+            learning_rate= model_trainer_config._learning_rate,
+            max_iter= model_trainer_config._max_iter,
+            max_leaf_nodes= model_trainer_config._max_leaf_nodes,
+            max_depth= model_trainer_config._max_dept,
+            min_samples_leaf= model_trainer_config._min_sample_leaf,
+            random_state=model_trainer_config._random_state,
+            class_weight=class_weight
+        )
+
+
+MODEL_BACKENDS = {backend.name: backend for backend in (RandomForestBackend(), HistGradientBoostingBackend())}
+
+
+def get_model_backend(name: str) -> ModelBackend:
+    """The backend registered under name, as set by ModelTraninerConfig.model_backend"""
+    if name not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown model backend {name}, expected one of {list(MODEL_BACKENDS)}")
+    return MODEL_BACKENDS[name]
@@ -1,10 +1,18 @@
 from src.cloud_storage.aws_storage import SimpleStorageService
+from src.constants import REFERENCE_PROFILE_FILE_NAME
 from src.exception import MyException
 from src.entity.estimator import MyModel
+import json
+import os
 import sys
 from pandas import DataFrame
 
 
+def reference_profile_key(model_path: str) -> str:
+    """Key of the reference profile of the model stored at model_path, next to it in the bucket"""
+    return f"{os.path.splitext(model_path)[0]}_{REFERENCE_PROFILE_FILE_NAME}"
+
+
 class Proj1Estimator:
     """
     This class is used to save and retrieve our model from s3 bucket and to do prediction
@@ -53,6 +61,34 @@ class Proj1Estimator:
             raise MyException(e, sys)
 
 
+    def save_reference_profile(self,from_file,remove:bool=False)->None:
+        """
+        Save the reference profile of the training data next to the model
+        :param from_file: Your local system reference profile path
+        """
+        try:
+            self.s3.upload_file(from_file,
+                                to_filename=reference_profile_key(self.model_path),
+                                bucket_name=self.bucket_name,
+                                remove=remove
+                                )
+        except Exception as e:
+            raise MyException(e, sys)
+
+    def load_reference_profile(self)->dict:
+        """
+        Load the reference profile of the model, None when the model was pushed without one
+        :return:
+        """
+        try:
+            profile_key = reference_profile_key(self.model_path)
+            if not self.is_model_present(profile_key):
+                return None
+            file_object = self.s3.get_file_object(profile_key, self.bucket_name)
+            return json.loads(self.s3.read_object(file_object))
+        except Exception as e:
+            raise MyException(e, sys)
+
     def predict(self,dataframe:DataFrame):
         """
         :param dataframe:
@@ -0,0 +1,306 @@
+"""
+Cleans up artifact/: removes the runs the retention policy does not keep, compresses the data
+files of old runs and hardlinks identical files across runs. Without --apply it only reports
+what would be reclaimed.
+
+    python -m src.pipline.artifact_manager
+    python -m src.pipline.artifact_manager --apply --keep-last 5
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, List, Tuple
+
+from src.constants import FEATURE_STORE_SYNC_DIR_NAME, DATA_PROFILE_CACHE_DIR, RETRAIN_SCHEDULER_DIR_NAME, \
+    RUN_STATE_DIR_NAME, STAGE_CACHE_DIR, RUN_ID_TIME_FORMAT
+from src.entity.config_entity import ArtifactRetentionConfig
+from src.exception import MyException
+from src.logger import logging
+
+# Directories of artifact/ that are not runs
+SHARED_ARTIFACT_DIRS = {FEATURE_STORE_SYNC_DIR_NAME, os.path.basename(DATA_PROFILE_CACHE_DIR), RETRAIN_SCHEDULER_DIR_NAME}
+# smaller files are not worth a hash and a link
+MIN_DEDUPLICATE_BYTES = 64 * 1024
+COMPRESSION_SAMPLE_BYTES = 4 * 2 ** 20
+
+
+@dataclass
+class ArtifactRun:
+    run_dir: str
+    started_at: datetime
+    size_bytes: int
+    pushed: bool
+    finished: bool
+    in_stage_cache: bool
+    keep_reasons: List[str] = field(default_factory=list)
+
+
+def _files(directory: str) -> List[str]:
+    return [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+
+
+def _file_hash(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(2 ** 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _read_marker(run_dir: str, stage: str):
+    marker_path = os.path.join(run_dir, RUN_STATE_DIR_NAME, f"{stage}.done.json")
+    if not os.path.exists(marker_path):
+        return None
+    with open(marker_path) as marker_file:
+        return json.load(marker_file)
+
+
+def run_started_at(run_dir: str) -> datetime:
+    """Reads the start time from the run id, falling back to the directory's modification time"""
+    try:
+        return datetime.strptime(os.path.basename(run_dir)[:19], RUN_ID_TIME_FORMAT)
+    except ValueError:
+        return datetime.fromtimestamp(os.path.getmtime(run_dir))
+
+
+def stage_cache_runs(stage_cache_dir: str) -> set:
+    """Runs holding the latest output of a stage, which the next run will most likely reuse"""
+    runs = set()
+    for last_path in _files(stage_cache_dir):
+        if os.path.basename(last_path) == "last.json":
+            with open(last_path) as last_file:
+                runs.add(os.path.normpath(json.load(last_file)["run_dir"]))
+    return runs
+
+
+class ArtifactManager:
+    """
+    Applies the retention policy to the run directories of artifact/. A run is kept if it is one
+    of the last keep_last_runs runs, if its model was pushed, if it is younger than
+    keep_younger_than_days or if the stage cache points to it. The other runs are deleted.
+    Kept runs that finished (they are never written to again) older than compress_after_days get
+    their csv/npy files gzipped, and identical files across finished runs are hardlinked.
+    """
+
+    def __init__(self, config: ArtifactRetentionConfig = ArtifactRetentionConfig(),
+                 now: Callable[[], datetime] = datetime.now):
+        self.config = config
+        self.now = now
+
+    def list_runs(self) -> List[ArtifactRun]:
+        """Returns the runs of the artifact directory, oldest first"""
+        try:
+            if not os.path.isdir(self.config.artifact_dir):
+                return []
+            cached_runs = stage_cache_runs(self.config.stage_cache_dir)
+            runs = []
+            for name in os.listdir(self.config.artifact_dir):
+                run_dir = os.path.join(self.config.artifact_dir, name)
+                if name.startswith(".") or name in SHARED_ARTIFACT_DIRS or not os.path.isdir(run_dir):
+                    continue
+                pusher_marker = _read_marker(run_dir, "model_pusher")
+                runs.append(ArtifactRun(run_dir=run_dir,
+                                        started_at=run_started_at(run_dir),
+                                        size_bytes=sum(os.path.getsize(file_path) for file_path in _files(run_dir)),
+                                        pushed=pusher_marker is not None and pusher_marker["artifact"] is not None,
+                                        finished=_read_marker(run_dir, "model_evaluation") is not None,
+                                        in_stage_cache=os.path.normpath(run_dir) in cached_runs))
+            return sorted(runs, key=lambda run: run.started_at)
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def apply_retention(self, runs: List[ArtifactRun]) -> List[ArtifactRun]:
+        """Fills in why each run is kept and returns the runs to delete"""
+        youngest_kept = self.now() - timedelta(days=self.config.keep_younger_than_days)
+        for position, run in enumerate(reversed(runs)):
+            if position < self.config.keep_last_runs:
+                run.keep_reasons.append(f"one of the last {self.config.keep_last_runs} runs")
+            if self.config.keep_pushed and run.pushed:
+                run.keep_reasons.append("model was pushed")
+            if run.started_at >= youngest_kept:
+                run.keep_reasons.append(f"younger than {self.config.keep_younger_than_days} days")
+            if run.in_stage_cache:
+                run.keep_reasons.append("latest output of a cached stage")
+        return [run for run in runs if not run.keep_reasons]
+
+    @staticmethod
+    def _reclaimed_bytes(file_paths: List[str]) -> int:
+        """Bytes freed by removing the files; a file hardlinked from elsewhere frees nothing"""
+        links = defaultdict(list)
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            links[(stat.st_dev, stat.st_ino)].append(stat)
+        return sum(stats[0].st_size for stats in links.values() if stats[0].st_nlink <= len(stats))
+
+    def _compress_candidates(self, runs: List[ArtifactRun]) -> List[str]:
+        if self.config.compress_after_days is None:
+            return []
+        cold = self.now() - timedelta(days=self.config.compress_after_days)
+        # the stage cache reuses files by path, compressing them would turn its hits into misses
+        return [file_path for run in runs if run.finished and run.started_at < cold and not run.in_stage_cache
+                for file_path in _files(run.run_dir) if file_path.endswith(tuple(self.config.compress_extensions))]
+
+    @staticmethod
+    def _estimate_compressed_bytes(file_path: str) -> int:
+        size = os.path.getsize(file_path)
+        with open(file_path, "rb") as file:
+            sample = file.read(COMPRESSION_SAMPLE_BYTES)
+        return int(size * len(zlib.compress(sample)) / len(sample)) if sample else 0
+
+    @staticmethod
+    def _compress(file_path: str) -> None:
+        tmp_path = file_path + ".gz.tmp"
+        # no name or time in the header, so identical files compress to identical files
+        with open(file_path, "rb") as source, open(tmp_path, "wb") as target, \
+                gzip.GzipFile(filename="", mode="wb", fileobj=target, mtime=0) as compressed:
+            shutil.copyfileobj(source, compressed, 2 ** 20)
+        os.replace(tmp_path, file_path + ".gz")
+        os.remove(file_path)
+
+    def _duplicate_groups(self, runs: List[ArtifactRun]) -> List[List[str]]:
+        """Groups of identical files of finished runs, each group as paths to different inodes"""
+        by_size = defaultdict(dict)
+        for run in runs:
+            if not run.finished:
+                continue
+            for file_path in _files(run.run_dir):
+                stat = os.stat(file_path)
+                if stat.st_size >= MIN_DEDUPLICATE_BYTES:
+                    by_size[stat.st_size].setdefault((stat.st_dev, stat.st_ino), file_path)
+        by_hash = defaultdict(list)
+        for inodes in by_size.values():
+            if len(inodes) > 1:
+                for (device, _), file_path in inodes.items():
+                    by_hash[(device, _file_hash(file_path))].append(file_path)
+        return [file_paths for file_paths in by_hash.values() if len(file_paths) > 1]
+
+    def _estimate_deduplication(self, runs: List[ArtifactRun], compress_files: set) -> Tuple[int, int]:
+        """
+        Bytes and files deduplication would free after the planned compression: identical files that
+        get compressed are still identical among themselves but only free their compressed size
+        """
+        deduplicated_bytes, linked_files = 0, 0
+        for file_paths in self._duplicate_groups(runs):
+            compressed = [file_path for file_path in file_paths if file_path in compress_files]
+            uncompressed = [file_path for file_path in file_paths if file_path not in compress_files]
+            for file_path in uncompressed[1:]:
+                stat = os.stat(file_path)
+                deduplicated_bytes += stat.st_size if stat.st_nlink == 1 else 0
+                linked_files += 1
+            compressed_size = self._estimate_compressed_bytes(compressed[0]) if compressed else 0
+            if compressed_size >= MIN_DEDUPLICATE_BYTES:
+                deduplicated_bytes += compressed_size * (len(compressed) - 1)
+                linked_files += len(compressed) - 1
+        return deduplicated_bytes, linked_files
+
+    @staticmethod
+    def _link(source_path: str, target_path: str) -> None:
+        tmp_path = target_path + ".link.tmp"
+        os.link(source_path, tmp_path)
+        os.replace(tmp_path, target_path)
+
+    def _prune_stage_cache(self, deleted_runs: set, dry_run: bool) -> int:
+        removed = 0
+        for entry_path in _files(self.config.stage_cache_dir):
+            if not entry_path.endswith(".json") or os.path.basename(entry_path) == "last.json":
+                continue
+            with open(entry_path) as entry_file:
+                run_dir = os.path.normpath(json.load(entry_file)["run_dir"])
+            if run_dir in deleted_runs:
+                removed += 1
+                if not dry_run:
+                    os.remove(entry_path)
+        return removed
+
+    def collect(self, dry_run: bool = True) -> dict:
+        """
+        Deletes, compresses and deduplicates according to the policy, or with dry_run only reports
+        it. Returns the report with the bytes reclaimed (estimated for compression in a dry run).
+        """
+        try:
+            runs = self.list_runs()
+            deleted = self.apply_retention(runs)
+            kept = [run for run in runs if run.keep_reasons]
+            report = {"dry_run": dry_run,
+                      "runs": len(runs),
+                      "deleted_runs": [{"run": run.run_dir, "started_at": run.started_at.isoformat(),
+                                        "bytes": run.size_bytes} for run in deleted],
+                      "kept_runs": [{"run": run.run_dir, "reasons": run.keep_reasons} for run in kept],
+                      "bytes": {}}
+
+            deleted_files = [file_path for run in deleted for file_path in _files(run.run_dir)]
+            report["bytes"]["deleted"] = self._reclaimed_bytes(deleted_files)
+            report["stage_cache_entries_removed"] = self._prune_stage_cache(
+                {os.path.normpath(run.run_dir) for run in deleted}, dry_run)
+            if not dry_run:
+                for run in deleted:
+                    logging.info(f"Deleting run {run.run_dir}: {run.size_bytes} bytes")
+                    shutil.rmtree(run.run_dir)
+
+            compress_files = self._compress_candidates(kept)
+            if dry_run:
+                report["bytes"]["compressed"] = sum(os.path.getsize(file_path) - self._estimate_compressed_bytes(file_path)
+                                                    for file_path in compress_files)
+            else:
+                size_before = self._reclaimed_bytes(compress_files)
+                for file_path in compress_files:
+                    self._compress(file_path)
+                report["bytes"]["compressed"] = size_before - sum(os.path.getsize(file_path + ".gz") for file_path in compress_files)
+            report["files_compressed"] = len(compress_files)
+
+            deduplicated_bytes, linked_files = 0, 0
+            if self.config.deduplicate:
+                if dry_run:
+                    deduplicated_bytes, linked_files = self._estimate_deduplication(kept, set(compress_files))
+                else:
+                    for file_paths in self._duplicate_groups(kept):
+                        for file_path in file_paths[1:]:
+                            stat = os.stat(file_path)
+                            deduplicated_bytes += stat.st_size if stat.st_nlink == 1 else 0
+                            linked_files += 1
+                            self._link(file_paths[0], file_path)
+            report["bytes"]["deduplicated"] = deduplicated_bytes
+            report["files_deduplicated"] = linked_files
+            report["bytes"]["total"] = sum(report["bytes"].values())
+            logging.info(f"Artifact clean up {'(dry run) ' if dry_run else ''}reclaims {report['bytes']['total']} bytes "
+                         f"from {len(deleted)} deleted runs, {len(compress_files)} compressed and {linked_files} deduplicated files")
+            return report
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / 2 ** 20:.1f}MB"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="delete, compress and link instead of only reporting")
+    parser.add_argument("--keep-last", type=int, default=ArtifactRetentionConfig.keep_last_runs)
+    parser.add_argument("--keep-days", type=float, default=ArtifactRetentionConfig.keep_younger_than_days)
+    parser.add_argument("--compress-after-days", type=float, default=ArtifactRetentionConfig.compress_after_days,
+                        help="gzip csv/npy files of finished runs older than this, negative to never compress")
+    parser.add_argument("--no-dedupe", action="store_true")
+    parser.add_argument("--artifact-dir", default=ArtifactRetentionConfig.artifact_dir)
+    args = parser.parse_args()
+
+    retention_config = ArtifactRetentionConfig(artifact_dir=args.artifact_dir,
+                                               stage_cache_dir=os.path.join(args.artifact_dir, os.path.basename(STAGE_CACHE_DIR)),
+                                               keep_last_runs=args.keep_last,
+                                               keep_younger_than_days=args.keep_days,
+                                               compress_after_days=None if args.compress_after_days < 0 else args.compress_after_days,
+                                               deduplicate=not args.no_dedupe)
+    clean_up_report = ArtifactManager(retention_config).collect(dry_run=not args.apply)
+    for deleted_run in clean_up_report["deleted_runs"]:
+        print(f"{'would delete' if not args.apply else 'deleted'} {deleted_run['run']} ({_megabytes(deleted_run['bytes'])})")
+    for kept_run in clean_up_report["kept_runs"]:
+        print(f"keep {kept_run['run']}: {', '.join(kept_run['reasons'])}")
+    print(", ".join(f"{action} {_megabytes(size)}" for action, size in clean_up_report["bytes"].items()))
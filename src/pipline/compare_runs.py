@@ -0,0 +1,73 @@
+"""
+Compares the run reports of the last training runs, stage by stage.
+
+    python -m src.pipline.compare_runs --last 5
+"""
+import argparse
+import glob
+import json
+import os
+from typing import List
+
+from src.constants import ARTIFACT_DIR, RUN_REPORT_FILE_NAME
+
+
+def load_run_reports(artifact_dir: str = ARTIFACT_DIR, last: int = 5) -> List[dict]:
+    """
+    Returns the run reports of the last runs, oldest first, each tagged with its run directory
+    """
+    report_paths = sorted(glob.glob(os.path.join(artifact_dir, "*", RUN_REPORT_FILE_NAME)), key=os.path.getmtime)
+    reports = []
+    for report_path in report_paths[-last:]:
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+        report["run"] = os.path.basename(os.path.dirname(report_path))
+        reports.append(report)
+    return reports
+
+
+def _format_task(task: dict) -> str:
+    if task is None:
+        return "-"
+    cell = f"{task['seconds']:.1f}s cpu {task.get('cpu_seconds', 0):.1f}s"
+    if task.get("peak_rss_delta_mb") is not None:
+        cell += f" +{task['peak_rss_delta_mb']:.0f}MB"
+    if task.get("input_rows") is not None:
+        cell += f" {task['input_rows']} rows"
+    return cell
+
+
+def comparison_table(reports: List[dict]) -> List[List[str]]:
+    """
+    Returns one row per stage (and per run total) with one column per run
+    """
+    stages = []
+    for report in reports:
+        for stage in report.get("dag", {}).get("tasks", {}):
+            if stage not in stages:
+                stages.append(stage)
+
+    rows = [["stage"] + [report["run"] for report in reports]]
+    for stage in stages:
+        rows.append([stage] + [_format_task(report.get("dag", {}).get("tasks", {}).get(stage)) for report in reports])
+    rows.append(["wall time"] + [f"{report.get('dag', {}).get('wall_seconds', 0):.1f}s" for report in reports])
+    rows.append(["peak memory"] + [f"{report.get('dag', {}).get('peak_rss_mb') or 0:.0f}MB" for report in reports])
+    rows.append(["saved by concurrency"] + [f"{report.get('dag', {}).get('saved_seconds', 0):.1f}s" for report in reports])
+    rows.append(["sample rows"] + [str(report.get("sample", {}).get("sample_rows", "full")) for report in reports])
+    rows.append(["f1 score"] + [f"{report['metrics']['f1_score']:.4f}" if "metrics" in report else "-" for report in reports])
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--last", type=int, default=5, help="number of most recent runs to compare")
+    parser.add_argument("--artifact-dir", default=ARTIFACT_DIR)
+    args = parser.parse_args()
+
+    run_reports = load_run_reports(args.artifact_dir, args.last)
+    if not run_reports:
+        raise SystemExit(f"No {RUN_REPORT_FILE_NAME} found under {args.artifact_dir}")
+    table = comparison_table(run_reports)
+    widths = [max(len(row[column]) for row in table) for column in range(len(table[0]))]
+    for row in table:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
@@ -13,16 +13,16 @@ class VehicleData:
                 Driving_License,
                 Region_Code,
                 Previously_Insured,
+                Vehicle_Age,
+                Vehicle_Damage,
                 Annual_Premium,
                 Policy_Sales_Channel,
-                Vintage,
-                Vehicle_Age_lt_1_Year,
-                Vehicle_Age_gt_2_Years,
-                Vehicle_Damage_Yes
+                Vintage
                 ):
         """
         Vehicle Data constructor
-        Input: all features of the trained model for prediction
+        Input: the raw record to predict, categories as they are in the data (e.g. Gender "Male",
+        Vehicle_Age "< 1 Year"); the model's feature encoder encodes it
         """
         try:
             self.Gender = Gender
@@ -30,12 +30,11 @@ class VehicleData:
             self.Driving_License = Driving_License
             self.Region_Code = Region_Code
             self.Previously_Insured = Previously_Insured
+            self.Vehicle_Age = Vehicle_Age
+            self.Vehicle_Damage = Vehicle_Damage
             self.Annual_Premium = Annual_Premium
             self.Policy_Sales_Channel = Policy_Sales_Channel
             self.Vintage = Vintage
-            self.Vehicle_Age_lt_1_Year = Vehicle_Age_lt_1_Year
-            self.Vehicle_Age_gt_2_Years = Vehicle_Age_gt_2_Years
-            self.Vehicle_Damage_Yes = Vehicle_Damage_Yes
 
         except Exception as e:
             raise MyException(e, sys) from e
@@ -66,12 +65,11 @@ class VehicleData:
                 "Driving_License": [self.Driving_License],
                 "Region_Code": [self.Region_Code],
                 "Previously_Insured": [self.Previously_Insured],
+                "Vehicle_Age": [self.Vehicle_Age],
+                "Vehicle_Damage": [self.Vehicle_Damage],
                 "Annual_Premium": [self.Annual_Premium],
                 "Policy_Sales_Channel": [self.Policy_Sales_Channel],
-                "Vintage": [self.Vintage],
-                "Vehicle_Age_lt_1_Year": [self.Vehicle_Age_lt_1_Year],
-                "Vehicle_Age_gt_2_Years": [self.Vehicle_Age_gt_2_Years],
-                "Vehicle_Damage_Yes": [self.Vehicle_Damage_Yes]
+                "Vintage": [self.Vintage]
             }
 
             logging.info("Created vehicle data dict")
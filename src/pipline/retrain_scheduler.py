@@ -0,0 +1,530 @@
+"""
+Starts training runs when they are due: on a cron schedule, when enough documents were added to
+the collection, or when the served model's inputs drift.
+
+    python -m src.pipline.retrain_scheduler
+"""
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, a lock file left by a dead process is then removed by hand
+    fcntl = None
+
+from src.configuration.mongo_db_connection import MongoDBClient
+from src.constants import DATABASE_NAME, DATA_VALIDATION_DRIFT_PSI_THRESHOLD, DATA_VALIDATION_DRIFT_KS_THRESHOLD, \
+    RETRAIN_DRIFT_COOLDOWN_SECONDS
+from src.entity.config_entity import RetrainSchedulerConfig
+from src.exception import MyException
+from src.logger import logging
+
+# lock files held by the schedulers of this process: a lock with this process's pid is only
+# stale if no scheduler of the process holds it, e.g. after the pid was reused
+_HELD_LOCKS = set()
+_HELD_LOCKS_GUARD = threading.Lock()
+
+# minute, hour, day of month, month, day of week (0 is Sunday, 7 is accepted for Sunday too)
+CRON_FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> set:
+    values = set()
+    for part in field.split(","):
+        value_range, _, step = part.partition("/")
+        if value_range == "*":
+            start, end = low, high
+        elif "-" in value_range:
+            start, end = (int(bound) for bound in value_range.split("-"))
+        else:
+            start = int(value_range)
+            end = high if step else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"Cron field {field} is out of range {low}-{high}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+
+class CronSchedule:
+    """
+    A five field cron expression ("minute hour day-of-month month day-of-week") with numbers,
+    ranges, lists, "*" and steps. As in cron, a day matches if either day field matches when
+    both are restricted.
+    """
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression {expression!r} must have 5 fields")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_cron_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELD_RANGES))
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self._any_day, self._any_weekday = fields[2] == "*", fields[4] == "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_matches = moment.day in self.days
+        weekday_matches = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_matches and weekday_matches
+        return day_matches or weekday_matches
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Returns the first minute after moment the expression matches"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=5 * 366)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = (candidate.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression {self.expression!r} never matches")
+
+
+class RetrainTrigger:
+    """
+    Decides whether a retraining is due. check() returns the reason, or None when it is not due;
+    triggers keep what they need between checks in the scheduler's persisted state.
+    """
+    name = "trigger"
+
+    def check(self, now: datetime, state: dict) -> Optional[str]:
+        raise NotImplementedError
+
+    def on_run_started(self, now: datetime, state: dict) -> None:
+        pass
+
+
+class CronTrigger(RetrainTrigger):
+    name = "cron"
+
+    def __init__(self, expression: str):
+        self.schedule = CronSchedule(expression)
+
+    def check(self, now: datetime, state: dict) -> Optional[str]:
+        due_at = state.get("next_cron_at")
+        if due_at is None:
+            state["next_cron_at"] = self.schedule.next_after(now).isoformat()
+            return None
+        if now < datetime.fromisoformat(due_at):
+            return None
+        # runs missed while the scheduler was down collapse into this one
+        state["next_cron_at"] = self.schedule.next_after(now).isoformat()
+        return f"cron {self.schedule.expression} due at {due_at}"
+
+
+class RowDeltaTrigger(RetrainTrigger):
+    """Fires when the collection gained (or lost) at least min_new_rows documents since the last run"""
+    name = "row_delta"
+
+    def __init__(self, min_new_rows: int, count_rows: Callable[[], int]):
+        self.min_new_rows = min_new_rows
+        self.count_rows = count_rows
+
+    def check(self, now: datetime, state: dict) -> Optional[str]:
+        rows = self.count_rows()
+        if state.get("rows_at_last_run") is None:
+            state["rows_at_last_run"] = rows
+            return None
+        delta = rows - state["rows_at_last_run"]
+        if abs(delta) >= self.min_new_rows:
+            return f"{delta:+d} rows since the last run"
+        return None
+
+    def on_run_started(self, now: datetime, state: dict) -> None:
+        state["rows_at_last_run"] = self.count_rows()
+
+
+class DriftTrigger(RetrainTrigger):
+    """
+    Fires when drift_score, e.g. the population stability index of the served model's inputs, reaches
+    threshold. A run does not change the score when its model is rejected, so after a run the trigger
+    only fires again when the score changed or cooldown_seconds passed.
+    """
+    name = "drift"
+
+    def __init__(self, drift_score: Callable[[], Optional[float]], threshold: float,
+                 cooldown_seconds: float = RETRAIN_DRIFT_COOLDOWN_SECONDS):
+        self.drift_score = drift_score
+        self.threshold = threshold
+        self.cooldown_seconds = cooldown_seconds
+
+    def check(self, now: datetime, state: dict) -> Optional[str]:
+        score = self.drift_score()
+        if score is None or score < self.threshold:
+            return None
+        last_run_at = state.get("drift_at_last_run_at")
+        if last_run_at is not None and score == state.get("drift_at_last_run") \
+                and now < datetime.fromisoformat(last_run_at) + timedelta(seconds=self.cooldown_seconds):
+            return None
+        return f"drift score {score:.3f} >= {self.threshold}"
+
+    def on_run_started(self, now: datetime, state: dict) -> None:
+        state["drift_at_last_run"] = self.drift_score()
+        state["drift_at_last_run_at"] = now.isoformat()
+
+
+def collection_row_counter(collection_name: str) -> Callable[[], int]:
+    def count_rows() -> int:
+        return MongoDBClient(database_name=DATABASE_NAME).database[collection_name].estimated_document_count()
+    return count_rows
+
+
+def production_drift_score(config: RetrainSchedulerConfig) -> Callable[[], Optional[float]]:
+    """
+    Returns a drift_score for DriftTrigger: the largest population stability index of the collection
+    against the reference profile of the production model. The counts are computed by MongoDB and
+    recomputed only when the collection or the production model changed.
+    """
+    from src.data_access.proj1_profiler import Proj1DataProfiler
+    from src.entity.s3_estimator import Proj1Estimator
+    last = {"key": None, "score": None}
+
+    def drift_score() -> Optional[float]:
+        try:
+            reference = Proj1Estimator(bucket_name=config.model_bucket_name,
+                                       model_path=config.s3_model_key_path).load_reference_profile()
+            if reference is None:
+                return None
+            profiler = Proj1DataProfiler()
+            key = (profiler.get_cache_key(config.collection_name), reference.get("created_at"))
+            if key != last["key"]:
+                drift = profiler.drift_sketch(reference, config.collection_name).compare(DATA_VALIDATION_DRIFT_PSI_THRESHOLD,
+                                                                                        DATA_VALIDATION_DRIFT_KS_THRESHOLD)
+                last.update(key=key, score=drift["max_psi"])
+                logging.info(f"Drift of {config.collection_name}: max PSI {drift['max_psi']}, "
+                             f"drifted columns {drift['drifted_columns']}")
+            return last["score"]
+        except Exception as e:
+            logging.info(f"Drift score not available: {e}")
+            return None
+    return drift_score
+
+
+def default_triggers(config: RetrainSchedulerConfig, drift_score: Optional[Callable[[], Optional[float]]] = None) -> List[RetrainTrigger]:
+    triggers = []
+    if config.cron_expression:
+        triggers.append(CronTrigger(config.cron_expression))
+    if config.min_new_rows is not None:
+        triggers.append(RowDeltaTrigger(config.min_new_rows, collection_row_counter(config.collection_name)))
+    if drift_score is not None:
+        triggers.append(DriftTrigger(drift_score, config.drift_threshold, config.drift_cooldown_seconds))
+    return triggers
+
+
+def run_training_job() -> str:
+    """Runs the training pipeline and returns its run directory"""
+    from src.pipline.training_pipeline import TrainPipeline
+    pipeline = TrainPipeline()
+    pipeline.run_pipeline()
+    return pipeline.run_dir
+
+
+class RetrainScheduler:
+    """
+    Starts at most one training run of a model at a time (single flight). Triggers that fire while
+    a run is active, or while the scheduler backs off after a failure, are merged into one pending
+    run. A failed run is retried after a backoff that doubles with each consecutive failure.
+    The state (pending triggers, failures, cron and row count bookmarks, run history) is saved to
+    <scheduler_dir>/<model_name>.json, so it survives restarts. A lock on a file next to it keeps
+    schedulers of other processes (e.g. the web app and the scheduler service) from starting a
+    second run.
+    clock returns the current time in seconds, it is replaced by a fake clock in tests.
+    """
+
+    def __init__(self, config: RetrainSchedulerConfig = RetrainSchedulerConfig(),
+                 triggers: Optional[List[RetrainTrigger]] = None,
+                 training_job: Callable[[], str] = run_training_job,
+                 clock: Callable[[], float] = time.time):
+        try:
+            self.config = config
+            self.triggers = default_triggers(config) if triggers is None else triggers
+            self.training_job = training_job
+            self.clock = clock
+            self.state_file_path = os.path.join(config.scheduler_dir, f"{config.model_name}.json")
+            self.lock_file_path = os.path.join(config.scheduler_dir, f"{config.model_name}.lock")
+            self._lock = threading.Lock()
+            self._lock_fd: Optional[int] = None
+            self._running = False
+            self._run_thread: Optional[threading.Thread] = None
+            os.makedirs(config.scheduler_dir, exist_ok=True)
+            self.state = self._load_state()
+            self._recover_interrupted_run()
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def _read_state_file(self) -> dict:
+        if not os.path.exists(self.state_file_path):
+            return {}
+        with open(self.state_file_path) as state_file:
+            return json.load(state_file)
+
+    def _load_state(self) -> dict:
+        state = {"model_name": self.config.model_name, "pending_reasons": [], "merged_triggers": 0,
+                 "consecutive_failures": 0, "next_attempt_at": None, "active_run": None, "history": []}
+        state.update(self._read_state_file())
+        self._remember_saved(state)
+        return state
+
+    def _remember_saved(self, state: dict) -> None:
+        # what the file held when this scheduler last read or wrote it
+        self._saved_pending = list(state["pending_reasons"])
+        self._saved_merged_triggers = state["merged_triggers"]
+
+    def _save_state(self) -> None:
+        """
+        Writes the state, first merging in the triggers other schedulers saved since this one last
+        read or wrote the file: while a run is active the state is not reloaded, and writing it as
+        it is would drop them
+        """
+        on_disk = self._read_state_file()
+        self._merge([reason for reason in on_disk.get("pending_reasons", []) if reason not in self._saved_pending])
+        self.state["merged_triggers"] += on_disk.get("merged_triggers", 0) - self._saved_merged_triggers
+        tmp_path = self.state_file_path + ".tmp"
+        with open(tmp_path, "w") as state_file:
+            json.dump(self.state, state_file, indent=4, default=str)
+        os.replace(tmp_path, self.state_file_path)
+        self._remember_saved(self.state)
+
+    def _now(self) -> datetime:
+        return datetime.fromtimestamp(self.clock())
+
+    def _lock_owner(self) -> Optional[int]:
+        try:
+            with open(self.lock_file_path) as lock_file:
+                content = lock_file.read().strip()
+            return int(content) if content else None
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _process_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _held_in_process(self) -> bool:
+        with _HELD_LOCKS_GUARD:
+            return os.path.realpath(self.lock_file_path) in _HELD_LOCKS
+
+    def _lock_taken(self) -> bool:
+        """Tells whether a process holds the lock of the model, without taking it"""
+        if fcntl is None:
+            owner = self._lock_owner()
+            return owner is not None and self._process_alive(owner)
+        with open(self.lock_file_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return False
+
+    def _try_acquire(self) -> bool:
+        """
+        Takes the lock of the model: an flock on the lock file, which the system releases when the
+        holding process dies, so a crashed run leaves no lock to take over. The file then holds the
+        pid of the run's process. Schedulers of the same process are told apart by the registry of
+        held locks.
+        """
+        with _HELD_LOCKS_GUARD:
+            lock_key = os.path.realpath(self.lock_file_path)
+            if lock_key in _HELD_LOCKS:
+                return False
+            if fcntl is None:
+                try:
+                    lock_fd = os.open(self.lock_file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    owner = self._lock_owner()
+                    if owner is None or not self._process_alive(owner):
+                        logging.info(f"Retraining lock {self.lock_file_path} of process {owner} is stale, "
+                                     f"remove it to start runs again")
+                    return False
+            else:
+                lock_fd = os.open(self.lock_file_path, os.O_CREAT | os.O_RDWR)
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(lock_fd)
+                    return False
+                os.ftruncate(lock_fd, 0)
+            os.write(lock_fd, str(os.getpid()).encode())
+            self._lock_fd = lock_fd
+            _HELD_LOCKS.add(lock_key)
+            return True
+
+    def _release(self) -> None:
+        with _HELD_LOCKS_GUARD:
+            _HELD_LOCKS.discard(os.path.realpath(self.lock_file_path))
+            if self._lock_fd is None:
+                return
+            if fcntl is None:
+                os.remove(self.lock_file_path)
+            else:
+                # the file stays: were it removed, a process could lock a new file while another
+                # still holds the old one. Closing it releases the flock.
+                os.ftruncate(self._lock_fd, 0)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _recover_interrupted_run(self) -> None:
+        """A run recorded as active whose process is gone was interrupted; it counts as a failure"""
+        active_run = self.state.get("active_run")
+        if active_run is None:
+            return
+        if active_run["pid"] == os.getpid():
+            if self._held_in_process():
+                # a run of another scheduler of this process
+                return
+        elif self._lock_owner() == active_run["pid"] and self._lock_taken():
+            return
+        logging.info(f"Training run started at {active_run['started_at']} was interrupted")
+        self._finish_run(active_run, status="interrupted", error="the scheduler process stopped during the run")
+
+    def _merge(self, reasons: List[str]) -> None:
+        for reason in reasons:
+            if reason not in self.state["pending_reasons"]:
+                self.state["pending_reasons"].append(reason)
+
+    def _refresh_state(self) -> None:
+        """Reloads the state another process may have changed, unless a run of this process owns it"""
+        if not self._running:
+            self.state = self._load_state()
+
+    def _start_run(self, reasons: List[str]) -> dict:
+        now = self._now()
+        for trigger in self.triggers:
+            trigger.on_run_started(now, self.state)
+        active_run = {"started_at": now.isoformat(timespec="seconds"), "reasons": reasons, "pid": os.getpid()}
+        self.state["active_run"] = active_run
+        self.state["pending_reasons"] = []
+        self._running = True
+        self._save_state()
+        logging.info(f"Starting training run of {self.config.model_name}: {'; '.join(reasons)}")
+        return active_run
+
+    def _finish_run(self, active_run: dict, status: str, run_dir: Optional[str] = None, error: Optional[str] = None) -> None:
+        finished_at = self.clock()
+        record = {**active_run, "finished_at": datetime.fromtimestamp(finished_at).isoformat(timespec="seconds"),
+                  "status": status, "run_dir": run_dir, "error": error}
+        record.pop("pid", None)
+        self.state["history"] = (self.state["history"] + [record])[-self.config.history_size:]
+        if status == "succeeded":
+            self.state["consecutive_failures"] = 0
+            self.state["next_attempt_at"] = None
+        else:
+            failures = self.state["consecutive_failures"] = self.state["consecutive_failures"] + 1
+            delay = min(self.config.backoff_seconds * 2 ** (failures - 1), self.config.max_backoff_seconds)
+            self.state["next_attempt_at"] = finished_at + delay
+            # the triggers of the failed run are still due once the backoff is over
+            self._merge(active_run["reasons"])
+            logging.info(f"Training run failed ({error}), retrying in {delay:.0f}s")
+        self.state["active_run"] = None
+        self._running = False
+        self._release()
+        self._save_state()
+
+    def _run(self, active_run: dict) -> None:
+        run_dir, error = None, None
+        try:
+            run_dir = self.training_job()
+        except Exception as e:
+            error = str(e)
+        with self._lock:
+            self._finish_run(active_run, status="failed" if error else "succeeded", run_dir=run_dir, error=error)
+
+    def _launch(self, active_run: dict, wait: bool) -> None:
+        if wait:
+            self._run(active_run)
+        else:
+            self._run_thread = threading.Thread(target=self._run, args=(active_run,), name="retrain-run", daemon=True)
+            self._run_thread.start()
+
+    def tick(self) -> Optional[str]:
+        """
+        Checks the triggers and starts a run when one is due.
+        Returns None when nothing is due, "started", "merged" when a run is already active, or
+        "backoff" when the pending run waits for the backoff after a failure to pass.
+        """
+        try:
+            with self._lock:
+                self._refresh_state()
+                now = self._now()
+                reasons = [reason for reason in (trigger.check(now, self.state) for trigger in self.triggers) if reason]
+                if reasons:
+                    logging.info(f"Retraining triggered: {'; '.join(reasons)}")
+                    self._merge(reasons)
+                self._save_state()
+                if not self.state["pending_reasons"]:
+                    return None
+                if self.state["next_attempt_at"] is not None and self.clock() < self.state["next_attempt_at"]:
+                    self.state["merged_triggers"] += len(reasons)
+                    self._save_state()
+                    return "backoff"
+                if self._running or not self._try_acquire():
+                    self.state["merged_triggers"] += len(reasons)
+                    self._save_state()
+                    return "merged"
+                active_run = self._start_run(list(self.state["pending_reasons"]))
+            self._launch(active_run, wait=False)
+            return "started"
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def request_run(self, reason: str, wait: bool = False) -> str:
+        """
+        Asks for a run now, e.g. from the /train endpoint; a manual request does not wait for a
+        backoff. Returns "merged" when a run is already active, otherwise "started", or with wait
+        the status of the finished run ("succeeded" or "failed").
+        """
+        try:
+            with self._lock:
+                self._refresh_state()
+                if self._running or not self._try_acquire():
+                    self._merge([reason])
+                    self.state["merged_triggers"] += 1
+                    self._save_state()
+                    return "merged"
+                active_run = self._start_run(self.state["pending_reasons"] + [reason])
+            self._launch(active_run, wait=wait)
+            return self.state["history"][-1]["status"] if wait else "started"
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    @property
+    def last_run(self) -> Optional[dict]:
+        return self.state["history"][-1] if self.state["history"] else None
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Waits for the active run started by this scheduler to finish"""
+        if self._run_thread is not None:
+            self._run_thread.join(timeout)
+
+    def serve_forever(self, stop_event: Optional[threading.Event] = None) -> None:
+        stop_event = stop_event or threading.Event()
+        logging.info(f"Retraining scheduler of {self.config.model_name} started with triggers "
+                     f"{[trigger.name for trigger in self.triggers]}")
+        while not stop_event.is_set():
+            self.tick()
+            stop_event.wait(self.config.poll_seconds)
+
+
+if __name__ == "__main__":
+    scheduler_config = RetrainSchedulerConfig()
+    RetrainScheduler(scheduler_config,
+                     triggers=default_triggers(scheduler_config, production_drift_score(scheduler_config))).serve_forever()
@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Optional, Tuple
+
+from src.constants import RUN_STATE_DIR_NAME
+from src.entity.artifact_entity import artifact_to_dict, artifact_from_dict
+from src.exception import MyException
+from src.logger import logging
+from src.pipline.stage_cache import artifact_files_exist
+
+
+class RunState:
+    """
+    Completion markers of the stages of a run, kept in <run_dir>/.state. A marker holds the
+    serialized artifact of the stage, so a resumed run rebuilds the stage's result from it
+    instead of running the stage again.
+    """
+
+    def __init__(self, run_dir: str):
+        self.run_dir = run_dir
+        self.state_dir = os.path.join(run_dir, RUN_STATE_DIR_NAME)
+
+    def _marker_path(self, stage: str) -> str:
+        return os.path.join(self.state_dir, f"{stage}.done.json")
+
+    def mark_done(self, stage: str, result) -> None:
+        """
+        Records that the stage finished. result is what the stage task returned: its artifact,
+        None, or an (artifact, fingerprint key) pair for stages going through the stage cache.
+        """
+        try:
+            artifact, key = result if isinstance(result, tuple) else (result, None)
+            marker = {"stage": stage,
+                      "completed_at": datetime.now().isoformat(timespec="seconds"),
+                      "key": key,
+                      "artifact": None if artifact is None else artifact_to_dict(artifact)}
+            os.makedirs(self.state_dir, exist_ok=True)
+            tmp_path = self._marker_path(stage) + ".tmp"
+            with open(tmp_path, "w") as marker_file:
+                json.dump(marker, marker_file, indent=4, default=str)
+            # the marker only appears once it is complete
+            os.replace(tmp_path, self._marker_path(stage))
+            logging.info(f"Stage {stage} marked done in {self.state_dir}")
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def load(self, stage: str) -> Tuple[bool, Optional[object]]:
+        """
+        Returns whether the stage is done, with the result its task returned. A stage whose
+        artifact files were removed since is not done.
+        """
+        try:
+            if not os.path.exists(self._marker_path(stage)):
+                return False, None
+            with open(self._marker_path(stage)) as marker_file:
+                marker = json.load(marker_file)
+            if marker["artifact"] is None:
+                artifact = None
+            elif artifact_files_exist(marker["artifact"]["fields"]):
+                artifact = artifact_from_dict(marker["artifact"])
+            else:
+                logging.info(f"Artifacts of stage {stage} were removed, it will run again")
+                return False, None
+            return True, artifact if marker["key"] is None else (artifact, marker["key"])
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def completed_stages(self) -> list:
+        if not os.path.isdir(self.state_dir):
+            return []
+        return sorted(name[:-len(".done.json")] for name in os.listdir(self.state_dir) if name.endswith(".done.json"))
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import sys
+from dataclasses import dataclass, asdict
+from typing import Iterable, Optional, Tuple
+
+import pandas as pd
+
+from src.constants import STAGE_CACHE_DIR
+from src.entity.artifact_entity import artifact_to_dict, artifact_from_dict
+from src.exception import MyException
+from src.utils.main_utils import load_dataframe
+from src.logger import logging
+
+# Config fields that only say where a run writes, not what it computes
+RUN_LOCATION_SUFFIXES = ("_dir", "_path", "timestamp")
+
+
+def _digest(content: object) -> str:
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def config_fingerprint(config) -> str:
+    """
+    Hashes the settings of a config dataclass, leaving out the run directory paths that differ
+    between otherwise identical runs
+    """
+    settings = {name: value for name, value in asdict(config).items() if not name.endswith(RUN_LOCATION_SUFFIXES)}
+    return _digest(settings)
+
+
+def code_fingerprint(modules: Iterable, extra_files: Iterable[str] = ()) -> str:
+    """
+    Hashes the source of the modules a stage runs and of extra files it reads (e.g. schema.yaml)
+    """
+    sha = hashlib.sha256()
+    for file_path in [module.__file__ for module in modules] + list(extra_files):
+        with open(file_path, "rb") as source_file:
+            sha.update(source_file.read())
+    return sha.hexdigest()
+
+
+def export_fingerprint(data_ingestion_artifacts) -> str:
+    """
+    Hashes the rows an ingestion run exported, from the DataFrames when they are handed over in
+    memory and else read from the train and test files, so the key does not depend on the hand-off
+    """
+    sha = hashlib.sha256()
+    for dataframe, file_path in ((data_ingestion_artifacts.train_df, data_ingestion_artifacts.trained_file_path),
+                                 (data_ingestion_artifacts.test_df, data_ingestion_artifacts.test_file_path)):
+        if dataframe is None:
+            dataframe = load_dataframe(file_path)
+        sha.update(str([str(column) for column in dataframe.columns]).encode())
+        sha.update(pd.util.hash_pandas_object(dataframe, index=False).to_numpy().tobytes())
+    return sha.hexdigest()[:24]
+
+
+@dataclass
+class StageFingerprint:
+    config: str
+    inputs: str
+    code: str
+
+    @property
+    def key(self) -> str:
+        return _digest([self.config, self.inputs, self.code])[:24]
+
+
+def artifact_files_exist(artifact_fields: dict) -> bool:
+    """Tells whether every file path among the serialized fields of an artifact is still on disk"""
+    for name, value in artifact_fields.items():
+        if isinstance(value, dict):
+            if not artifact_files_exist(value):
+                return False
+        elif isinstance(value, str) and ("path" in name or "file" in name) and not name.startswith("s3_") \
+                and not os.path.exists(value):
+            return False
+    return True
+
+
+class StageCache:
+    """
+    Content addressed index of stage outputs. A stage is identified by the fingerprint of its
+    config, its inputs (the fingerprint of the upstream stage or of the source data) and the code
+    it runs. When an entry with the same fingerprint exists and its files are still on disk, the
+    stage's artifact dataclass is returned instead of running the stage again.
+    """
+
+    def __init__(self, cache_dir: str = STAGE_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _entry_path(self, stage: str, name: str) -> str:
+        return os.path.join(self.cache_dir, stage, f"{name}.json")
+
+    def _miss_reason(self, stage: str, fingerprint: StageFingerprint) -> str:
+        last_path = self._entry_path(stage, "last")
+        if not os.path.exists(last_path):
+            return "no previous run"
+        with open(last_path) as last_file:
+            last = json.load(last_file)["fingerprint"]
+        changed = [part for part, value in asdict(fingerprint).items() if last.get(part) != value]
+        return ", ".join(f"{part} changed" for part in changed) + " since the last run"
+
+    def lookup(self, stage: str, fingerprint: StageFingerprint) -> Tuple[Optional[object], str]:
+        """
+        Returns the cached artifact of the stage (None on a miss) and why it was a hit or a miss
+        """
+        try:
+            entry_path = self._entry_path(stage, fingerprint.key)
+            if not os.path.exists(entry_path):
+                return None, f"miss: {self._miss_reason(stage, fingerprint)}"
+            with open(entry_path) as entry_file:
+                entry = json.load(entry_file)
+            if not artifact_files_exist(entry["artifact"]["fields"]):
+                return None, f"miss: artifacts of run {entry['run_dir']} were removed"
+            return artifact_from_dict(entry["artifact"]), f"hit: same inputs, config and code as run {entry['run_dir']}"
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def store(self, stage: str, fingerprint: StageFingerprint, artifact, run_dir: str) -> None:
+        """
+        Records the artifact under its fingerprint and as the last run of the stage
+        """
+        try:
+            os.makedirs(os.path.join(self.cache_dir, stage), exist_ok=True)
+            entry = {"run_dir": run_dir, "fingerprint": asdict(fingerprint), "artifact": artifact_to_dict(artifact)}
+            for name in (fingerprint.key, "last"):
+                tmp_path = self._entry_path(stage, name) + ".tmp"
+                with open(tmp_path, "w") as entry_file:
+                    json.dump(entry, entry_file, indent=4, default=str)
+                os.replace(tmp_path, self._entry_path(stage, name))
+        except Exception as e:
+            raise MyException(e, sys) from e
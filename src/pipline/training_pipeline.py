@@ -1,4 +1,12 @@
+import os
 import sys
+import argparse
+import inspect
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, replace
+from typing import Iterable, List, Optional
 from src.exception import MyException
 from src.logger import logging
 
@@ -6,74 +14,274 @@ from src.components.data_ingestion import DataIngestion
 from src.components.data_validation import DataValidation
 from src.components.data_transformation import DataTransformation
 from src.components.model_trainer import ModelTrainer
+from src.components.model_search import ModelSearch
+from src.components import partitioned_training
+from src.components.resampling import get_resampler
 from src.components.model_evaluation import ModelEvaluation
 from src.components.model_pusher import ModelPusher
+from src.data_access.proj1_profiler import Proj1DataProfiler
+from src.components.feature_store_sync import list_feature_store_parts
+from src.data_access import proj1_data
+from src.entity import estimator, model_backends
+from src.entity.estimator import MyModel
+from src.entity.model_backends import get_model_backend
+from src.utils import main_utils
+from src.utils.main_utils import update_run_report, count_array_rows
+from src.utils.drift_utils import reference_fingerprint
+from src.utils.dag_executor import DagExecutor, Task
+from src.utils.artifact_store import ArtifactStore
+from src.pipline.run_state import RunState
+from src.pipline.stage_cache import StageCache, StageFingerprint, config_fingerprint, code_fingerprint, export_fingerprint
+from src.constants import SCHEMA_FILE_PATH, STAGE_CACHE_ENABLED, STAGE_CACHE_INGESTION, FEATURE_STORE_SYNC_PARTS_DIR, PIPELINE_MAX_CONCURRENCY, \
+    PIPELINE_IN_MEMORY_HANDOFF, PIPELINE_PERSIST_MODE
 
-from src.entity.config_entity import DataIngestionConfig , DataValidationConfig , DataTransformationConfig ,ModelTraninerConfig,ModelEvaluationConfig, ModelPusherConfig
+from src.entity.config_entity import PipelineConfigs, build_pipeline_configs, DataIngestionConfig , DataValidationConfig , DataTransformationConfig ,ModelTraninerConfig,ModelEvaluationConfig, ModelPusherConfig
 
-from src.entity.artifact_entity import DataIngestionArtifacts, DataValidationArtifacts , DataTransformedArtifacts , ModelTrainerArtifacts , ModelEvaluationArtifact , ModelPusherArtifact
+from src.entity.artifact_entity import DataIngestionArtifacts, DataValidationArtifacts , DataTransformedArtifacts , ModelTrainerArtifacts , ModelEvaluationArtifact , ModelPusherArtifact, ModelSearchArtifact
+
+# Code each cached stage runs; editing any of these files invalidates the stage
+STAGE_CODE_MODULES = {
+    "data_ingestion": [inspect.getmodule(DataIngestion), proj1_data, main_utils],
+    "data_validation": [inspect.getmodule(DataValidation), main_utils],
+    "data_transformation": [inspect.getmodule(DataTransformation), estimator, main_utils],
+    "model_trainer": [inspect.getmodule(ModelTrainer), partitioned_training, estimator, model_backends, main_utils],
+    "model_search": [inspect.getmodule(ModelSearch), inspect.getmodule(get_resampler), model_backends, main_utils],
+}
+# Tasks without a completion marker: the production model is downloaded again when a resumed run needs it
+UNMARKED_TASKS = {"prefetch_best_model"}
+
+def run_model_trainer(data_transformation_artifacts: DataTransformedArtifacts,
+                      model_trainer_config: ModelTraninerConfig,
+                      artifact_store: Optional[ArtifactStore] = None,
+                      previous_model: Optional[MyModel] = None,
+                      watermark: Optional[str] = None) -> ModelTrainerArtifacts:
+    """Fits the model; module level so it can run in a worker process"""
+    model_trainer = ModelTrainer(data_transformation_artifacts= data_transformation_artifacts,
+                                 model_trainer_config = model_trainer_config,
+                                 artifact_store = artifact_store,
+                                 previous_model = previous_model,
+                                 watermark = watermark)
+    return model_trainer.initiate_model_trainer()
 
 class TrainPipeline:
-    def __init__(self):
-        self.data_ingestion_config = DataIngestionConfig()
-        self.data_validation_config = DataValidationConfig()
-        self.data_transformation_config = DataTransformationConfig()
-        self.model_training_config = ModelTraninerConfig()
-        self.model_evaluation_config = ModelEvaluationConfig()
-        self.model_pusher_config = ModelPusherConfig()
-    def start_data_ingestion(self) -> DataIngestionArtifacts:
+    def __init__(self, force_stages: Iterable[str] = (), use_stage_cache: bool = STAGE_CACHE_ENABLED,
+                 max_concurrency: int = PIPELINE_MAX_CONCURRENCY, train_in_process: bool = True,
+                 in_memory: bool = PIPELINE_IN_MEMORY_HANDOFF, persist: str = PIPELINE_PERSIST_MODE,
+                 resume_dir: Optional[str] = None, configs: Optional[PipelineConfigs] = None, push: bool = True,
+                 cache_ingestion: bool = STAGE_CACHE_INGESTION):
+        """
+        force_stages: stages to rerun even when the stage cache has their output, "all" for every stage
+        use_stage_cache: reuse the outputs of earlier runs whose inputs, config and code were identical
+        max_concurrency: tasks of the run that may execute at the same time
+        train_in_process: fit the model in a worker process so it does not compete with the
+                          pipeline's I/O threads for the GIL; ignored with in_memory, where
+                          shipping the arrays to a worker would cost what the hand-off saves
+        in_memory: stages hand DataFrames, arrays and models to each other in memory
+        persist: when artifact files are written with in_memory: "async" in the background,
+                 "end" once the run is done ("sync" writes them before each stage returns)
+        resume_dir: run directory of an earlier run to finish; its completed stages are reused and
+                    the remaining ones write into it
+        configs: the configs of the run from build_pipeline_configs; by default every pipeline
+                 gets a new run directory, so runs in one process never share files
+        push: upload an accepted model to S3; experiment runs turn it off
+        cache_ingestion: reuse an earlier export while the collection has the same document count and
+                         max _id. Updates of existing documents (e.g. label corrections) change neither,
+                         so they would reuse the stale export; by default ingestion always runs and the
+                         later stages are keyed by the rows it exported
+        """
+        if configs is None:
+            configs = build_pipeline_configs(run_dir=resume_dir)
+        if resume_dir is not None and os.path.normpath(configs.training_pipeline_config.artifact_dir) != os.path.normpath(resume_dir):
+            raise MyException(Exception(f"The configs write to {configs.training_pipeline_config.artifact_dir}, not to the resumed run {resume_dir}"), sys)
+        self.configs = configs
+        self.data_ingestion_config = configs.data_ingestion_config
+        self.data_validation_config = configs.data_validation_config
+        self.data_transformation_config = configs.data_transformation_config
+        self.model_training_config = configs.model_trainer_config
+        if self.model_training_config.search:
+            # the search validates its candidates on training rows that were not resampled
+            self.data_transformation_config = replace(self.data_transformation_config, keep_unresampled_train=True)
+        self.model_evaluation_config = configs.model_evaluation_config
+        self.model_pusher_config = configs.model_pusher_config
+        self.run_report_file_path = configs.training_pipeline_config.run_report_file_path
+        self.run_dir = configs.training_pipeline_config.artifact_dir
+        self.force_stages = set(force_stages)
+        self.stage_cache = StageCache() if use_stage_cache else None
+        self.cache_ingestion = cache_ingestion
+        self.stage_cache_report = {}
+        self.executor = DagExecutor(max_concurrency=max_concurrency)
+        self.artifact_store = ArtifactStore(in_memory=in_memory, persist=persist)
+        self.train_in_process = train_in_process and not in_memory
+        self.push = push
+        self.incremental_report = None
+        self.resume = resume_dir is not None
+        if self.resume and not os.path.isdir(resume_dir):
+            raise MyException(Exception(f"Cannot resume, run directory {resume_dir} does not exist"), sys)
+        self.run_state = RunState(self.run_dir)
+
+    def source_fingerprint(self) -> str:
+        """
+        Returns a key that changes when documents are added to the source: the document count and
+        max _id of the collection, or the part files of the live feature store. In-place updates of
+        documents do not change it, which is why ingestion is only cached with cache_ingestion
+        """
+        try:
+            if self.data_ingestion_config.use_live_feature_store:
+                parts = list_feature_store_parts(os.path.join(self.data_ingestion_config.live_feature_store_dir,
+                                                              FEATURE_STORE_SYNC_PARTS_DIR))
+                return str([(os.path.basename(part), os.path.getsize(part), os.path.getmtime(part)) for part in parts])
+            return Proj1DataProfiler().get_cache_key(self.data_ingestion_config.collection_name)
+        except Exception as e:
+            raise MyException(e, sys)
+
+    def run_cached_stage(self, stage: str, config, upstream: str, run_stage, extra_files: Iterable[str] = ()):
+        """
+        Runs a stage unless the stage cache holds the output of a run with the same fingerprint.
+        Returns the stage artifact and the fingerprint key, which is the upstream input of the next stage.
+        extra_files: files besides the schema the stage reads its settings from
+        """
+        fingerprint = StageFingerprint(config=config_fingerprint(config),
+                                       inputs=upstream,
+                                       code=code_fingerprint(STAGE_CODE_MODULES[stage], extra_files=[SCHEMA_FILE_PATH, *extra_files]))
+        artifact, reason = None, "miss: stage cache disabled"
+        if self.stage_cache is not None:
+            if stage in self.force_stages or "all" in self.force_stages:
+                reason = "miss: forced"
+            else:
+                artifact, reason = self.stage_cache.lookup(stage, fingerprint)
+        logging.info(f"Stage cache {reason} for {stage} (fingerprint {fingerprint.key})")
+        self.stage_cache_report[stage] = reason
+
+        if artifact is None:
+            artifact = run_stage()
+            if self.stage_cache is not None:
+                self.stage_cache.store(stage, fingerprint, artifact, self.run_dir)
+        return artifact, fingerprint.key
+    def start_source_validation(self) -> DataValidationArtifacts:
+        """
+        Profiles the source collection inside MongoDB and validates the profile, so a bad
+        dataset stops the pipeline before anything is exported
+        """
+        try:
+            logging.info("Profiling the source collection before export")
+            profile = Proj1DataProfiler().profile_collection(self.data_ingestion_config.collection_name)
+            data_validation = DataValidation(data_ingestion_artifacts=None, data_validation_config=self.data_validation_config)
+            source_validation_artifacts = data_validation.validate_source_profile(profile)
+            if not source_validation_artifacts.validation_status:
+                raise Exception(f"Source data failed validation: {source_validation_artifacts.message}")
+            return source_validation_artifacts
+        except Exception as e:
+            raise MyException(e, sys)
+
+    def incremental_base_model(self, best_model) -> Optional[MyModel]:
+        """
+        The production model to update with the new data when the trainer is incremental, None to
+        train from scratch: there is no production model, or it has no watermark (models trained
+        before the watermark, on a sample or from the live feature store) or cannot be warm started
+        """
+        if not self.model_training_config.incremental or best_model is None:
+            return None
+        model = best_model.loaded_model
+        if getattr(model, "watermark", None) is None or getattr(model, "feature_encoder", None) is None \
+                or not get_model_backend(model.backend).incremental:
+            logging.info("The production model cannot be updated incrementally, training from scratch")
+            return None
+        return model
+
+    def start_data_ingestion(self, data_ingestion_config: Optional[DataIngestionConfig] = None) -> DataIngestionArtifacts:
         try:
             logging.info("Entered the start_data_ingestion method of TrainPipeline class")
             logging.info("Getting the data from mongodb")
-            data_ingestion = DataIngestion(data_ingestion_config= self.data_ingestion_config)
+            data_ingestion = DataIngestion(data_ingestion_config= data_ingestion_config or self.data_ingestion_config,
+                                           artifact_store= self.artifact_store)
             data_ingestion_artifact = data_ingestion.initiate_data_ingestion()
             logging.info("Got the train_set and test_set from mongodb")
             logging.info("Exited the start_data_ingestion method of TrainPipeline class")
             return data_ingestion_artifact
         except Exception as e:
-            MyException(e , sys)
+            raise MyException(e , sys)
     
-    def start_validation(self, data_ingestion_articats:DataIngestionArtifacts) -> DataValidationConfig:
+    def start_validation(self, data_ingestion_articats:DataIngestionArtifacts,
+                         data_validation: Optional[DataValidation] = None) -> DataValidationConfig:
         try:
             logging.info("Entering into Validation")
-            data_validation = DataValidation(data_ingestion_artifacts= data_ingestion_articats , data_validation_config= self.data_validation_config)
+            if data_validation is None:
+                data_validation = DataValidation(data_ingestion_artifacts= data_ingestion_articats , data_validation_config= self.data_validation_config)
             data_validation_artifacts = data_validation.initiate_data_validation()
             
             logging.info("Performed the data validation operation")
             logging.info("Exited the start_data_validation method of TrainPipeline class")
             return data_validation_artifacts
         except Exception as e:
-            MyException(e , sys)    
+            raise MyException(e , sys)
             
-    def start_transformation(self, data_ingestion_artifacts: DataIngestionArtifacts , data_validation_artifacts:DataValidationArtifacts)-> DataTransformedArtifacts:
+    def start_transformation(self, data_ingestion_artifacts: DataIngestionArtifacts , data_validation_artifacts:DataValidationArtifacts,
+                             fitted_model: Optional[MyModel] = None)-> DataTransformedArtifacts:
         try:
             data_transformation = DataTransformation(data_ingestion_artifacts= data_ingestion_artifacts , 
                                                      data_validation_artifacts= data_validation_artifacts,
-                                                     data_transformation_config= self.data_transformation_config)
+                                                     data_transformation_config= self.data_transformation_config,
+                                                     artifact_store= self.artifact_store,
+                                                     fitted_model= fitted_model)
             data_transformation_artifacts = data_transformation.initiate_data_transformation()
             return data_transformation_artifacts
         except Exception as e:
             raise MyException(e, sys)
         
-    def start_model_trainer(self, data_transformation_artifacts : DataTransformation)-> ModelTraninerConfig:
+    def start_model_search(self, data_transformation_artifacts: DataTransformedArtifacts) -> ModelSearchArtifact:
+        """
+        Searches the hyperparameters of config/model.yaml; the workers map the transformed arrays
+        from their files, so those have to be written first
+        """
         try:
-            model_trainer = ModelTrainer(data_transformation_artifacts= data_transformation_artifacts,
-                                         model_trainer_config = self.model_training_config)
-            
-            model_trainer_artifacts = model_trainer.initiate_model_trainer()
-            return model_trainer_artifacts        
+            self.artifact_store.flush()
+            model_search = ModelSearch(data_transformation_artifacts=data_transformation_artifacts,
+                                       model_trainer_config=self.model_training_config,
+                                       data_transformation_config=self.data_transformation_config)
+            return model_search.initiate_model_search()
+        except Exception as e:
+            raise MyException(e, sys)
+
+    def start_model_trainer(self, data_transformation_artifacts : DataTransformation,
+                            model_trainer_config: Optional[ModelTraninerConfig] = None,
+                            previous_model: Optional[MyModel] = None, watermark: Optional[str] = None)-> ModelTraninerConfig:
+        try:
+            model_trainer_config = model_trainer_config or self.model_training_config
+            if model_trainer_config.partitions > 1:
+                # the partition workers read the transformed arrays from disk
+                self.artifact_store.flush()
+            if self.train_in_process:
+                return self.executor.run_in_process(run_model_trainer, data_transformation_artifacts, model_trainer_config,
+                                                    previous_model=previous_model, watermark=watermark)
+            return run_model_trainer(data_transformation_artifacts, model_trainer_config, self.artifact_store,
+                                     previous_model=previous_model, watermark=watermark)
         except Exception as e:
             raise MyException(e,sys)
     
+    def prefetch_best_model(self):
+        """
+        Downloads the production model from S3, independently of the stages that build the new model
+        """
+        try:
+            model_evaluation = ModelEvaluation(model_eval_config=self.model_evaluation_config,
+                                               data_ingestion_artifact=None, model_trainer_artifact=None)
+            return model_evaluation.prefetch_best_model()
+        except Exception as e:
+            raise MyException(e, sys)
+
     def start_model_evaluation(self, data_ingestion_artifact: DataIngestionArtifacts,
-                               model_trainer_artifact: ModelTrainerArtifacts) -> ModelEvaluationArtifact:
+                               model_trainer_artifact: ModelTrainerArtifacts, best_model=None,
+                               data_transformation_artifact: Optional[DataTransformedArtifacts] = None) -> ModelEvaluationArtifact:
         """S
         This method of TrainPipeline class is responsible for starting modle evaluation
+        best_model: the prefetched production model, None when there is none
         """
         try:
             model_evaluation = ModelEvaluation(model_eval_config=self.model_evaluation_config,
                                                data_ingestion_artifact=data_ingestion_artifact,
-                                               model_trainer_artifact=model_trainer_artifact)
+                                               model_trainer_artifact=model_trainer_artifact,
+                                               best_model=best_model,
+                                               data_transformation_artifact=data_transformation_artifact)
             model_evaluation_artifact = model_evaluation.initiate_model_evaluation()
             return model_evaluation_artifact
         except Exception as e:
@@ -92,17 +300,252 @@ class TrainPipeline:
         except Exception as e:
             raise MyException(e, sys)
         
-    def run_pipeline(self , )-> None:
-        try:
-            data_ingestion_artifacts = self.start_data_ingestion()
-            data_validation_artifacts = self.start_validation(data_ingestion_articats= data_ingestion_artifacts )
-            data_transformation_artifacts = self.start_transformation(data_ingestion_artifacts= data_ingestion_artifacts , data_validation_artifacts= data_validation_artifacts )
-            model_trainer_artifacts = self.start_model_trainer(data_transformation_artifacts=data_transformation_artifacts)
-            model_evaluation_artifact = self.start_model_evaluation(data_ingestion_artifact=data_ingestion_artifacts,
-                                                                    model_trainer_artifact=model_trainer_artifacts)
-            if not model_evaluation_artifact.is_model_accepted:
+    def build_tasks(self) -> list:
+        """
+        Describes a training run as a graph of tasks. Stages depend on each other through their
+        artifacts; downloading the production model only depends on S3, so it overlaps with the
+        stages that build the new model.
+        """
+        def data_ingestion(source_validation=None, prefetch_best_model=None):
+            # source_validation only orders the export after the source profile passed validation
+            source_key = self.source_fingerprint() if self.stage_cache is not None and self.cache_ingestion else ""
+            data_ingestion_config = self.data_ingestion_config
+            base_model = self.incremental_base_model(prefetch_best_model)
+            if base_model is not None:
+                # only the documents the production model has not seen yet
+                data_ingestion_config = replace(data_ingestion_config, since_object_id=base_model.watermark)
+            if self.cache_ingestion:
+                result = self.run_cached_stage("data_ingestion", data_ingestion_config, source_key,
+                                               lambda: self.start_data_ingestion(data_ingestion_config))
+            else:
+                data_ingestion_artifacts = self.start_data_ingestion(data_ingestion_config)
+                self.stage_cache_report["data_ingestion"] = "miss: ingestion is not cached"
+                export_key = export_fingerprint(data_ingestion_artifacts) if self.stage_cache is not None else ""
+                result = data_ingestion_artifacts, export_key
+            if base_model is not None:
+                self.incremental_report = {"since_object_id": base_model.watermark, "watermark": result[0].watermark,
+                                           "new_rows": result[0].source_rows}
+            return result
+
+        def data_validation(data_ingestion):
+            data_ingestion_artifacts, ingestion_key = data_ingestion
+            data_validation = DataValidation(data_ingestion_artifacts= data_ingestion_artifacts,
+                                             data_validation_config= self.data_validation_config)
+            upstream = ingestion_key
+            if self.stage_cache is not None:
+                # the drift verdict depends on the reference profile as much as on the data
+                reference, reference_source = data_validation.load_drift_reference()
+                upstream = f"{ingestion_key}_{reference_source}_{reference_fingerprint(reference)}"
+            return self.run_cached_stage("data_validation", self.data_validation_config, upstream,
+                                         lambda: self.start_validation(data_ingestion_articats= data_ingestion_artifacts,
+                                                                       data_validation= data_validation))
+
+        def data_transformation(data_ingestion, data_validation, prefetch_best_model=None):
+            (data_ingestion_artifacts, _), (data_validation_artifacts, validation_key) = data_ingestion, data_validation
+            return self.run_cached_stage("data_transformation", self.data_transformation_config, validation_key,
+                                         lambda: self.start_transformation(data_ingestion_artifacts= data_ingestion_artifacts,
+                                                                           data_validation_artifacts= data_validation_artifacts,
+                                                                           fitted_model= self.incremental_base_model(prefetch_best_model)))
+
+        def model_search(data_transformation):
+            data_transformation_artifacts, transformation_key = data_transformation
+            return self.run_cached_stage("model_search", self.model_training_config, transformation_key,
+                                         lambda: self.start_model_search(data_transformation_artifacts=data_transformation_artifacts),
+                                         extra_files=[self.model_training_config.model_config_file_path])
+
+        def model_trainer(data_ingestion, data_transformation, model_search=None, prefetch_best_model=None):
+            data_transformation_artifacts, transformation_key = data_transformation
+            model_trainer_config = self.model_training_config
+            if model_search is not None:
+                # the trainer fits the best candidate of the search on all of the training data
+                model_trainer_config = replace(model_trainer_config, **model_search[0].best_params)
+            return self.run_cached_stage("model_trainer", model_trainer_config, transformation_key,
+                                         lambda: self.start_model_trainer(data_transformation_artifacts=data_transformation_artifacts,
+                                                                          model_trainer_config=model_trainer_config,
+                                                                          previous_model=self.incremental_base_model(prefetch_best_model),
+                                                                          watermark=data_ingestion[0].watermark))
+
+        def model_evaluation(data_ingestion, data_transformation, model_trainer, prefetch_best_model):
+            return self.start_model_evaluation(data_ingestion_artifact=data_ingestion[0],
+                                               model_trainer_artifact=model_trainer[0],
+                                               best_model=prefetch_best_model,
+                                               data_transformation_artifact=data_transformation[0])
+
+        def model_pusher(model_evaluation) -> Optional[ModelPusherArtifact]:
+            if not model_evaluation.is_model_accepted:
                 logging.info(f"Model not accepted.")
                 return None
-            model_pusher_artifact = self.start_model_pusher(model_evaluation_artifact=model_evaluation_artifact)
+            if not self.push:
+                logging.info("Model accepted, not pushed since pushing is turned off for this run")
+                return None
+            # the model file has to be on disk before it is uploaded
+            self.artifact_store.flush()
+            return self.start_model_pusher(model_evaluation_artifact=model_evaluation)
+
+        def ingestion_rows(result, **_):
+            data_ingestion_artifacts = result[0]
+            if data_ingestion_artifacts.train_rows is None:
+                return data_ingestion_artifacts.source_rows, None
+            return data_ingestion_artifacts.source_rows, data_ingestion_artifacts.train_rows + data_ingestion_artifacts.test_rows
+
+        def transformation_rows(result, **_):
+            data_transformation_artifacts = result[0]
+            # rows of the feature arrays, their targets have as many
+            if data_transformation_artifacts.train_arr is not None:
+                return None, len(data_transformation_artifacts.train_arr) + len(data_transformation_artifacts.test_arr)
+            return None, (count_array_rows(data_transformation_artifacts.transformed_train_file)
+                          + count_array_rows(data_transformation_artifacts.transformed_test_file))
+
+        ingestion_dependencies = []
+        tasks = []
+        if self.data_validation_config.profile_source:
+            tasks.append(Task("source_validation", self.start_source_validation))
+            ingestion_dependencies = ["source_validation"]
+        search_tasks, trainer_dependencies = [], ["data_ingestion", "data_transformation"]
+        if self.model_training_config.search:
+            search_tasks = [Task("model_search", model_search, ["data_transformation"])]
+            trainer_dependencies.append("model_search")
+        # an incremental update starts from the production model: its watermark selects the data to
+        # export and its encoder and preprocessor are reused, so the download comes first
+        prefetch_tasks, transformation_dependencies = [Task("prefetch_best_model", self.prefetch_best_model)], []
+        if self.model_training_config.incremental:
+            tasks, prefetch_tasks = tasks + prefetch_tasks, []
+            ingestion_dependencies = ingestion_dependencies + ["prefetch_best_model"]
+            transformation_dependencies = ["prefetch_best_model"]
+            trainer_dependencies.append("prefetch_best_model")
+        return tasks + [
+            Task("data_ingestion", data_ingestion, ingestion_dependencies, rows=ingestion_rows),
+            Task("data_validation", data_validation, ["data_ingestion"]),
+            Task("data_transformation", data_transformation, ["data_ingestion", "data_validation", *transformation_dependencies],
+                 rows=transformation_rows),
+            *search_tasks,
+            Task("model_trainer", model_trainer, trainer_dependencies),
+            *prefetch_tasks,
+            Task("model_evaluation", model_evaluation, ["data_ingestion", "data_transformation", "model_trainer", "prefetch_best_model"],
+                 rows=lambda result, data_ingestion, **_: (data_ingestion[0].test_rows, None)),
+            Task("model_pusher", model_pusher, ["model_evaluation"]),
+        ]
+
+    def _marking(self, stage: str, func):
+        def run_and_mark(**dependencies):
+            result = func(**dependencies)
+            # queued behind the stage's own files, so the marker never precedes them on disk
+            self.artifact_store.save(self.run_state.mark_done, stage, result)
+            return result
+        return run_and_mark
+
+    def resumable_tasks(self, tasks: list) -> list:
+        """
+        Makes every task record a completion marker when it finishes. When resuming, a task whose
+        marker exists and whose marked dependencies are all reused returns the result recorded in
+        its marker instead of running, so the run restarts from the first incomplete stage.
+        Unmarked tasks only run if a task that is not reused needs them.
+        """
+        reused = {}
+        if self.resume:
+            # build_tasks lists every task after the tasks it depends on
+            for task in tasks:
+                if task.name in UNMARKED_TASKS:
+                    continue
+                if any(dependency not in reused and dependency not in UNMARKED_TASKS for dependency in task.depends_on):
+                    continue
+                done, result = self.run_state.load(task.name)
+                if done:
+                    reused[task.name] = result
+                    self.stage_cache_report[task.name] = f"resumed from {self.run_dir}"
+            logging.info(f"Resuming run {self.run_dir}, reusing stages {list(reused)}")
+
+        needed = {dependency for task in tasks if task.name not in reused for dependency in task.depends_on}
+        resumable = []
+        for task in tasks:
+            if task.name in reused:
+                resumable.append(Task(task.name, lambda result=reused[task.name]: result))
+            elif task.name in UNMARKED_TASKS:
+                if task.name in needed:
+                    resumable.append(task)
+            else:
+                resumable.append(Task(task.name, self._marking(task.name, task.func), task.depends_on, task.kind, task.rows))
+        return resumable
+
+    def run_pipeline(self , )-> None:
+        try:
+            try:
+                results = self.executor.run(self.resumable_tasks(self.build_tasks()))
+            finally:
+                self.artifact_store.close()
+                dag_summary = self.executor.summary()
+                update_run_report(self.run_report_file_path, dag= dag_summary, stage_cache= self.stage_cache_report,
+                                  stage_seconds= {name: task["seconds"] for name, task in dag_summary["tasks"].items()})
+            data_ingestion_artifacts, _ = results["data_ingestion"]
+            data_transformation_artifacts, _ = results["data_transformation"]
+            model_trainer_artifacts, _ = results["model_trainer"]
+            # a full run is recorded too, so sampled runs can be compared against it
+            if self.resume:
+                update_run_report(self.run_report_file_path,
+                                  resume= {"stages": [name for name, reason in self.stage_cache_report.items()
+                                                      if reason.startswith("resumed")]})
+            if self.incremental_report is not None:
+                update_run_report(self.run_report_file_path, incremental= self.incremental_report)
+            if "model_search" in results:
+                update_run_report(self.run_report_file_path, search= asdict(results["model_search"][0]))
+            update_run_report(self.run_report_file_path,
+                              sample= data_ingestion_artifacts.sample_report or {"method": "full"},
+                              resampling= data_transformation_artifacts.resampling_report,
+                              metrics= asdict(model_trainer_artifacts.metric_artifact))
+            logging.info(f"Critical path: {dag_summary['critical_path']}, "
+                         f"{dag_summary['saved_seconds']}s saved by running tasks concurrently")
         except Exception as e:
-            raise MyException(e,sys)
\ No newline at end of file
+            raise MyException(e,sys)
+
+
+def run_training(overrides: dict, pipeline_options: dict) -> dict:
+    """
+    Runs one training with its own configs; module level so it can run in a worker process.
+    A failure is returned as its message: the exception would not unpickle in the parent and
+    would break the pool of the other runs.
+    """
+    configs = build_pipeline_configs(**overrides)
+    try:
+        TrainPipeline(configs=configs, **pipeline_options).run_pipeline()
+    except Exception as e:
+        return {"run_dir": configs.training_pipeline_config.artifact_dir, "error": str(e)}
+    with open(configs.training_pipeline_config.run_report_file_path) as report_file:
+        report = json.load(report_file)
+    return {"run_dir": configs.training_pipeline_config.artifact_dir, "metrics": report.get("metrics")}
+
+def run_trainings_in_parallel(variants: List[dict], max_workers: int = 2, **pipeline_options) -> List[dict]:
+    """
+    Runs several trainings at the same time, e.g. different hyperparameters or samples, each in a
+    worker process and its own run directory.
+    variants: config overrides of each run as taken by build_pipeline_configs,
+              e.g. [{"model_trainer": {"_n_estimators": 100}}, {"model_trainer": {"_n_estimators": 300}}]
+    pipeline_options: TrainPipeline arguments shared by the runs; models are not pushed unless push=True
+    Returns, in the order of the variants, the run directory and metrics of each run or the error it failed with.
+    """
+    try:
+        # the runs already have a process each, training in yet another one would only add copies
+        pipeline_options = {"push": False, "train_in_process": False, **pipeline_options}
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(run_training, overrides, pipeline_options) for overrides in variants]
+            results = []
+            for overrides, future in zip(variants, futures):
+                try:
+                    result = future.result()
+                    if "error" in result:
+                        logging.info(f"Training run with {overrides} failed: {result['error']}")
+                    results.append({"overrides": overrides, **result})
+                except Exception as e:
+                    logging.info(f"Training run with {overrides} failed: {e}")
+                    results.append({"overrides": overrides, "error": str(e)})
+        return results
+    except Exception as e:
+        raise MyException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the training pipeline")
+    parser.add_argument("--resume", metavar="RUN_DIR",
+                        help="finish an earlier run (e.g. artifact/<timestamp>) from its first incomplete stage")
+    args = parser.parse_args()
+
+    TrainPipeline(resume_dir=args.resume).run_pipeline()
@@ -0,0 +1,61 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, List
+
+from src.exception import MyException
+from src.logger import logging
+
+PERSIST_MODES = ("sync", "async", "end")
+
+
+class ArtifactStore:
+    """
+    Decides how stages hand their outputs to each other.
+    in_memory: artifacts also carry the DataFrames, arrays and objects themselves, so the next
+               stage does not read back what the previous one just wrote
+    persist:   "sync" writes the files before the stage returns, "async" writes them on a
+               background thread while the next stages run, "end" writes them in flush()
+    Files are always written eventually, so every run stays reproducible from its artifacts.
+    """
+
+    def __init__(self, in_memory: bool = False, persist: str = "sync"):
+        if persist not in PERSIST_MODES:
+            raise ValueError(f"Unknown persist mode {persist}, expected one of {PERSIST_MODES}")
+        self.in_memory = in_memory
+        self.persist = persist if in_memory else "sync"
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifact-writer") \
+            if self.persist == "async" else None
+        self._pending: List[Future] = []
+        self._deferred: List[tuple] = []
+
+    def keep(self, obj):
+        """Returns obj to attach to an artifact when handing off in memory, None otherwise"""
+        return obj if self.in_memory else None
+
+    def save(self, save_function: Callable, *args, **kwargs) -> None:
+        """Writes an artifact file with save_function according to the persist mode"""
+        if self.persist == "sync":
+            save_function(*args, **kwargs)
+        elif self.persist == "async":
+            self._pending.append(self._writer.submit(save_function, *args, **kwargs))
+        else:
+            self._deferred.append((save_function, args, kwargs))
+
+    def flush(self) -> None:
+        """Blocks until every artifact file is written and raises the first write failure"""
+        try:
+            for save_function, args, kwargs in self._deferred:
+                save_function(*args, **kwargs)
+            self._deferred = []
+            pending, self._pending = self._pending, []
+            for future in pending:
+                future.result()
+            if pending:
+                logging.info(f"{len(pending)} artifact files written in the background")
+        except Exception as e:
+            raise MyException(e, sys) from e
+
+    def close(self) -> None:
+        self.flush()
+        if self._writer is not None:
+            self._writer.shutdown()
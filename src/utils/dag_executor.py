@@ -0,0 +1,263 @@
+import multiprocessing
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak memory is then not reported
+    resource = None
+
+from src.constants import PIPELINE_MAX_CONCURRENCY, PIPELINE_MAX_PROCESSES
+from src.exception import MyException
+from src.logger import logging
+
+
+@dataclass
+class Task:
+    """
+    A unit of work in a pipeline graph. func receives the results of the tasks it depends on as
+    keyword arguments named after them.
+    kind: "io" tasks run on a thread; "cpu" tasks run in a worker process, so func and the
+          results it receives must be picklable (module level functions, artifact dataclasses)
+    rows: returns the (input, output) row counts of the task, called with its result and the
+          results of its dependencies; an unknown input count (None) is taken as the sum of the
+          output rows of the tasks it depends on
+    """
+    name: str
+    func: Callable
+    depends_on: List[str] = field(default_factory=list)
+    kind: str = "io"
+    rows: Optional[Callable[..., Tuple[Optional[int], Optional[int]]]] = None
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Returns the peak resident memory of the current process so far"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class WorkerError(Exception):
+    """
+    A failure in a worker process, sent back as the type name and message of the exception:
+    exceptions such as MyException cannot be unpickled in the parent, which breaks the pool
+    """
+
+
+def _profiled_call(func: Callable, *args, **kwargs):
+    """Runs func in a worker process and returns its result with the CPU time and peak memory it added"""
+    cpu_start, rss_start = time.process_time(), peak_rss_mb()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        raise WorkerError(f"{type(e).__name__}: {e}") from None
+    rss_end = peak_rss_mb()
+    return result, time.process_time() - cpu_start, None if rss_end is None else rss_end - rss_start
+
+
+@dataclass
+class TaskProfile:
+    """
+    Wall time, CPU time and peak memory growth of a task. CPU time and peak memory are process
+    wide counters, so tasks that overlap share what they add; work done in worker processes is
+    counted for the task that waited on it.
+    """
+    kind: str
+    start: float
+    end: float
+    cpu_seconds: float = 0.0
+    peak_rss_mb: Optional[float] = None
+    peak_rss_delta_mb: Optional[float] = None
+    input_rows: Optional[int] = None
+    output_rows: Optional[int] = None
+
+    @property
+    def seconds(self) -> float:
+        return self.end - self.start
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind,
+                "seconds": round(self.seconds, 3),
+                "cpu_seconds": round(self.cpu_seconds, 3),
+                "peak_rss_mb": None if self.peak_rss_mb is None else round(self.peak_rss_mb, 1),
+                "peak_rss_delta_mb": None if self.peak_rss_delta_mb is None else round(self.peak_rss_delta_mb, 1),
+                "input_rows": self.input_rows,
+                "output_rows": self.output_rows,
+                "rows_per_second": round(self.input_rows / self.seconds) if self.input_rows and self.seconds else None}
+
+
+def _topological_order(tasks: Dict[str, Task]) -> List[str]:
+    order, state = [], {}
+
+    def visit(name: str, path: List[str]) -> None:
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Dependency cycle between tasks: {' -> '.join(path + [name])}")
+        if name not in tasks:
+            raise ValueError(f"Task {path[-1]} depends on unknown task {name}")
+        state[name] = "visiting"
+        for dependency in tasks[name].depends_on:
+            visit(dependency, path + [name])
+        state[name] = "done"
+        order.append(name)
+
+    for name in tasks:
+        visit(name, [])
+    return order
+
+
+class DagExecutor:
+    """
+    Runs a graph of tasks, starting every task as soon as the tasks it depends on are done.
+    At most max_concurrency tasks run at the same time, cpu tasks on up to max_processes processes.
+    If a task fails no new task is started, the running ones are allowed to finish (so their
+    outputs are kept) and the failure is raised.
+    """
+
+    def __init__(self, max_concurrency: int = PIPELINE_MAX_CONCURRENCY, max_processes: int = PIPELINE_MAX_PROCESSES):
+        self.max_concurrency = max_concurrency
+        self.max_processes = max_processes
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self.profiles: Dict[str, TaskProfile] = {}
+        self._worker_usage = threading.local()
+        self._tasks: Dict[str, Task] = {}
+        self._wall_seconds = 0.0
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            # spawned workers do not inherit the locks held by the pipeline's threads
+            self._process_pool = ProcessPoolExecutor(max_workers=self.max_processes,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+        return self._process_pool
+
+    def run_in_process(self, func: Callable, *args, **kwargs):
+        """Runs CPU bound work from inside an io task in a worker process and returns its result"""
+        try:
+            result, cpu_seconds, rss_delta_mb = self._get_process_pool().submit(_profiled_call, func, *args, **kwargs).result()
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for memory): the next call starts a new pool
+            self._process_pool = None
+            raise
+        usage = getattr(self._worker_usage, "usage", None)
+        if usage is not None:
+            usage["cpu_seconds"] += cpu_seconds
+            usage["peak_rss_delta_mb"] = max(usage["peak_rss_delta_mb"], rss_delta_mb or 0.0)
+        return result
+
+    def _row_counts(self, task: Task, result, arguments: dict) -> Tuple[Optional[int], Optional[int]]:
+        input_rows, output_rows = task.rows(result, **arguments) if task.rows is not None else (None, None)
+        if input_rows is None:
+            upstream = [self.profiles[dependency].output_rows for dependency in task.depends_on
+                        if dependency in self.profiles and self.profiles[dependency].output_rows is not None]
+            input_rows = sum(upstream) if upstream else None
+        return input_rows, output_rows
+
+    def _run_task(self, task: Task, results: Dict[str, object]):
+        arguments = {dependency: results[dependency] for dependency in task.depends_on}
+        self._worker_usage.usage = {"cpu_seconds": 0.0, "peak_rss_delta_mb": 0.0}
+        start, cpu_start, rss_start = time.perf_counter(), time.process_time(), peak_rss_mb()
+        result = None
+        try:
+            if task.kind == "cpu":
+                result = self.run_in_process(task.func, **arguments)
+            else:
+                result = task.func(**arguments)
+            return result
+        finally:
+            end, rss_end = time.perf_counter(), peak_rss_mb()
+            usage = self._worker_usage.usage
+            profile = TaskProfile(kind=task.kind, start=start, end=end,
+                                  cpu_seconds=time.process_time() - cpu_start + usage["cpu_seconds"],
+                                  peak_rss_mb=rss_end,
+                                  peak_rss_delta_mb=None if rss_end is None else max(rss_end - rss_start, usage["peak_rss_delta_mb"]))
+            if result is not None:
+                try:
+                    profile.input_rows, profile.output_rows = self._row_counts(task, result, arguments)
+                except Exception as e:
+                    logging.info(f"Could not count the rows of task {task.name}: {e}")
+            self.profiles[task.name] = profile
+
+    def run(self, tasks: List[Task]) -> Dict[str, object]:
+        """
+        Runs the tasks and returns their results by task name
+        """
+        try:
+            self._tasks = {task.name: task for task in tasks}
+            _topological_order(self._tasks)
+            results: Dict[str, object] = {}
+            pending = dict(self._tasks)
+            running = {}
+            failure = None
+            run_start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="pipeline") as threads:
+                while pending or running:
+                    if failure is None:
+                        ready = [task for task in pending.values() if all(dependency in results for dependency in task.depends_on)]
+                        for task in ready[:self.max_concurrency - len(running)]:
+                            logging.info(f"Starting task {task.name} ({task.kind})")
+                            running[threads.submit(self._run_task, task, results)] = task.name
+                            del pending[task.name]
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        if future.exception() is not None:
+                            logging.info(f"Task {name} failed, not starting any new task")
+                            failure = failure or (name, future.exception())
+                        else:
+                            results[name] = future.result()
+                            logging.info(f"Finished task {name} in {self.profiles[name].seconds:.2f}s")
+            self._wall_seconds = time.perf_counter() - run_start
+            if failure is not None:
+                raise Exception(f"Task {failure[0]} failed: {failure[1]}") from failure[1]
+            return results
+        except Exception as e:
+            raise MyException(e, sys) from e
+        finally:
+            if self._process_pool is not None:
+                self._process_pool.shutdown()
+                self._process_pool = None
+
+    def critical_path(self) -> List[str]:
+        """
+        Returns the chain of dependent tasks with the longest total duration, which bounds the
+        wall time of the run however much concurrency is available
+        """
+        finish, previous = {}, {}
+        for name in _topological_order(self._tasks):
+            if name not in self.profiles:
+                continue
+            dependencies = [dependency for dependency in self._tasks[name].depends_on if dependency in finish]
+            slowest = max(dependencies, key=finish.get, default=None)
+            previous[name] = slowest
+            finish[name] = self.profiles[name].seconds + (finish[slowest] if slowest else 0.0)
+        path, name = [], max(finish, key=finish.get, default=None)
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1]
+
+    def summary(self) -> dict:
+        """
+        Returns the profile of the last run: per task wall time, CPU time, peak memory and row
+        counts, the critical path and the wall time saved compared to running the same tasks one
+        after another
+        """
+        sequential_seconds = sum(profile.seconds for profile in self.profiles.values())
+        critical_path = self.critical_path()
+        return {"wall_seconds": round(self._wall_seconds, 3),
+                "peak_rss_mb": peak_rss_mb(),
+                "sequential_seconds": round(sequential_seconds, 3),
+                "saved_seconds": round(sequential_seconds - self._wall_seconds, 3),
+                "critical_path": critical_path,
+                "critical_path_seconds": round(sum(self.profiles[name].seconds for name in critical_path), 3),
+                "tasks": {name: profile.to_dict() for name, profile in self.profiles.items()}}
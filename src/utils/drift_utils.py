@@ -0,0 +1,206 @@
+import hashlib
+import json
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pandas.api.types import is_numeric_dtype
+
+from src.constants import DRIFT_REFERENCE_QUANTILES, DRIFT_MAX_DISCRETE_VALUES, DRIFT_PSI_BINS
+from src.exception import MyException
+from src.logger import logging
+
+# floor of the bin proportions in the PSI, an empty bin would make it infinite
+PSI_EPSILON = 1e-4
+
+
+def category_counts(series: pd.Series) -> Dict[str, int]:
+    """Value counts keyed by the string of the value; integral floats count with their ints (1.0 as "1")"""
+    values = series.dropna()
+    if is_numeric_dtype(values) and len(values) and bool((values == np.floor(values)).all()):
+        values = values.astype(np.int64)
+    return {str(value): int(count) for value, count in values.astype(str).value_counts().items()}
+
+
+def numeric_bin_counts(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    Counts values in the bins of the reference quantiles: below the first edge, [edge i, edge i+1)
+    for each pair of edges, the last bin closed on the right, and above the last edge.
+    """
+    values = values[~np.isnan(values)]
+    bins = np.searchsorted(edges, values, side="right")
+    bins[values == edges[-1]] = len(edges) - 1
+    return np.bincount(bins, minlength=len(edges) + 1)
+
+
+def build_reference_profile(dataframe: DataFrame, columns: List[str],
+                            quantiles: int = DRIFT_REFERENCE_QUANTILES,
+                            max_discrete_values: int = DRIFT_MAX_DISCRETE_VALUES) -> dict:
+    """
+    Builds the compact profile of the training data new data is compared with: for numeric columns
+    the quantiles (the bin edges) with the proportion of rows in each bin, for categorical columns
+    and numeric columns with few distinct values the proportion of each value.
+    """
+    try:
+        profile_columns = {}
+        for column in columns:
+            series = dataframe[column]
+            if is_numeric_dtype(series) and series.nunique() > max_discrete_values:
+                values = series.to_numpy(dtype="float64")
+                edges = np.unique(np.nanquantile(values, np.linspace(0, 1, quantiles)))
+                counts = numeric_bin_counts(values, edges)
+                profile_columns[column] = {"kind": "numeric", "edges": edges.tolist(),
+                                           "fractions": (counts / max(counts.sum(), 1)).tolist()}
+            else:
+                counts = category_counts(series)
+                total = max(sum(counts.values()), 1)
+                profile_columns[column] = {"kind": "categorical",
+                                           "fractions": {value: count / total for value, count in counts.items()}}
+        logging.info(f"Reference profile built from {len(dataframe)} rows and {len(profile_columns)} columns")
+        return {"created_at": datetime.now().isoformat(timespec="seconds"),
+                "rows": len(dataframe),
+                "columns": profile_columns}
+    except Exception as e:
+        raise MyException(e, sys) from e
+
+
+class RowSample:
+    """
+    Uniform random sample of at most max_rows rows of a DataFrame read in chunks: every row gets a
+    random priority and the rows with the smallest priorities are kept, so memory stays bounded
+    whatever the number of rows.
+    """
+
+    def __init__(self, max_rows: int, seed: int = 42):
+        self.max_rows = max_rows
+        self.rng = np.random.default_rng(seed)
+        self.rows = None
+        self.priorities = np.empty(0)
+
+    def update(self, chunk: DataFrame) -> None:
+        rows = chunk if self.rows is None else pd.concat([self.rows, chunk], ignore_index=True)
+        priorities = np.concatenate([self.priorities, self.rng.random(len(chunk))])
+        if len(rows) > self.max_rows:
+            kept = np.argpartition(priorities, self.max_rows)[:self.max_rows]
+            rows, priorities = rows.iloc[kept].reset_index(drop=True), priorities[kept]
+        self.rows, self.priorities = rows, priorities
+
+    def dataframe(self) -> DataFrame:
+        return self.rows
+
+
+def save_reference_profile(file_path: str, profile: dict) -> None:
+    with open(file_path, "w") as profile_file:
+        json.dump(profile, profile_file)
+
+
+def load_reference_profile(file_path: str) -> dict:
+    with open(file_path) as profile_file:
+        return json.load(profile_file)
+
+
+def reference_fingerprint(profile: Optional[dict]) -> str:
+    """Hashes a reference profile, so results computed against it are not reused against another"""
+    return hashlib.sha256(json.dumps(profile, sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+
+def population_stability_index(expected: np.ndarray, actual: np.ndarray) -> float:
+    expected = np.clip(expected, PSI_EPSILON, None)
+    actual = np.clip(actual, PSI_EPSILON, None)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def _coarsen(expected: np.ndarray, actual: np.ndarray, groups: int):
+    """Merges consecutive quantile bins into about `groups` bins of equal reference mass"""
+    group_ids = np.minimum(((np.cumsum(expected) - expected) * groups).astype(int), groups - 1)
+    return (np.bincount(group_ids, weights=expected, minlength=groups),
+            np.bincount(group_ids, weights=actual, minlength=groups))
+
+
+class DriftSketch:
+    """
+    Counts of new data in the bins and categories of a reference profile. It is filled chunk by
+    chunk (or from counts computed elsewhere, e.g. by MongoDB), sketches of several splits merge
+    by adding their counts, and the drift statistics are computed from the counts alone.
+    """
+
+    def __init__(self, reference: dict):
+        self.reference = reference
+        self.rows = 0
+        self.counts = {}
+        for column, column_reference in reference["columns"].items():
+            if column_reference["kind"] == "numeric":
+                self.counts[column] = np.zeros(len(column_reference["edges"]) + 1, dtype=np.int64)
+            else:
+                self.counts[column] = {}
+
+    def update(self, chunk: DataFrame) -> None:
+        self.rows += len(chunk)
+        for column, column_reference in self.reference["columns"].items():
+            if column not in chunk.columns:
+                continue
+            if column_reference["kind"] == "numeric":
+                values = pd.to_numeric(chunk[column], errors="coerce").to_numpy(dtype="float64")
+                self.counts[column] += numeric_bin_counts(values, np.asarray(column_reference["edges"]))
+            else:
+                self.add_category_counts(column, category_counts(chunk[column]))
+
+    def add_category_counts(self, column: str, counts: Dict[str, int]) -> None:
+        for value, count in counts.items():
+            self.counts[column][value] = self.counts[column].get(value, 0) + count
+
+    def merge(self, other: "DriftSketch") -> "DriftSketch":
+        self.rows += other.rows
+        for column, counts in other.counts.items():
+            if isinstance(counts, dict):
+                self.add_category_counts(column, counts)
+            else:
+                self.counts[column] += counts
+        return self
+
+    def compare(self, psi_threshold: float, ks_threshold: float, psi_bins: int = DRIFT_PSI_BINS) -> dict:
+        """
+        Returns the drift of every column against the reference: the population stability index
+        over bins of equal reference mass (or over the categories), and for numeric columns the
+        Kolmogorov-Smirnov statistic evaluated at the reference quantiles. Columns at or above a
+        threshold are listed as drifted.
+        """
+        start = time.perf_counter()
+        columns, drifted_columns = {}, []
+        for column, column_reference in self.reference["columns"].items():
+            counts = self.counts[column]
+            if column_reference["kind"] == "numeric":
+                total = counts.sum()
+                if not total:
+                    continue
+                expected = np.asarray(column_reference["fractions"])
+                actual = counts / total
+                psi = population_stability_index(*_coarsen(expected, actual, psi_bins))
+                ks = float(np.abs(np.cumsum(expected) - np.cumsum(actual)).max())
+                columns[column] = {"kind": "numeric", "psi": round(psi, 6), "ks": round(ks, 6)}
+            else:
+                total = sum(counts.values())
+                if not total:
+                    continue
+                categories = sorted(set(column_reference["fractions"]) | set(counts))
+                expected = np.array([column_reference["fractions"].get(value, 0.0) for value in categories])
+                actual = np.array([counts.get(value, 0) / total for value in categories])
+                psi = population_stability_index(expected, actual)
+                ks = None
+                columns[column] = {"kind": "categorical", "psi": round(psi, 6),
+                                   "new_values": [value for value in counts if value not in column_reference["fractions"]]}
+            if psi >= psi_threshold or (ks is not None and ks >= ks_threshold):
+                drifted_columns.append(column)
+
+        return {"reference_created_at": self.reference.get("created_at"),
+                "reference_rows": self.reference.get("rows"),
+                "rows": self.rows,
+                "max_psi": max((stats["psi"] for stats in columns.values()), default=None),
+                "max_ks": max((stats["ks"] for stats in columns.values() if stats.get("ks") is not None), default=None),
+                "drifted_columns": drifted_columns,
+                "seconds": round(time.perf_counter() - start, 6),
+                "columns": columns}
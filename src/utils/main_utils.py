@@ -1,13 +1,17 @@
 import os
 import sys
+import json
 
 import numpy as np
 import dill
 import yaml
+import pandas as pd
 from pandas import DataFrame
+from typing import List, Optional
 
 from src.exception import MyException
 from src.logger import logging
+from src.constants import ARTIFACT_FILE_EXTENSIONS, ARTIFACT_FILE_COMPRESSION
 
 def read_yaml_file(file_path: str) -> dict:
     try:
@@ -29,6 +33,23 @@ def write_yaml_file(file_path: str, content: object , replace: bool = False) ->
     except Exception as e:
         raise MyException(e, sys) from e
     
+def update_run_report(file_path: str, **sections) -> None:
+    """
+    Merges the given sections into the JSON run report of a pipeline run
+    """
+    try:
+        report = {}
+        if os.path.exists(file_path):
+            with open(file_path) as report_file:
+                report = json.load(report_file)
+        report.update(sections)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w") as report_file:
+            json.dump(report, report_file, indent=4, default=str)
+    except Exception as e:
+        raise MyException(e, sys) from e
+
+
 def load_object(file_path: str) -> object:
     """
     Returns model/object from project directory.
@@ -42,33 +63,74 @@ def load_object(file_path: str) -> object:
     except Exception as e:
         raise MyException(e, sys) from e
     
-def save_numpy_array_data(file_path: str, array: np.array):
+def save_numpy_array_data(file_path: str, array: np.array, dtype=None):
     """
     Save numpy array data to file
     file_path: str location of file to save
     array: np.array data to save
+    dtype: the dtype to save the array as, e.g. np.float32 to halve a float64 array
     """
     try:
         dir_path = os.path.dirname(file_path)
         os.makedirs(dir_path, exist_ok=True)
         with open(file_path, 'wb') as file_obj:
-            np.save(file_obj, array)
+            np.save(file_obj, array if dtype is None else np.asarray(array, dtype=dtype))
     except Exception as e:
         raise MyException(e, sys) from e
     
-def load_numpy_array_data(file_path: str) -> np.array:
+def load_numpy_array_data(file_path: str, mmap_mode: Optional[str] = None) -> np.array:
     """
     load numpy array data from file
     file_path: str location of file to load
+    mmap_mode: "r" maps the file instead of reading it, rows are then paged in when they are used
     return: np.array data loaded
     """
     try:
+        if mmap_mode is not None:
+            return np.load(file_path, mmap_mode=mmap_mode)
         with open(file_path, 'rb') as file_obj:
             return np.load(file_obj)
     except Exception as e:
         raise MyException(e, sys) from e
 
 
+def create_numpy_array_memmap(file_path: str, shape: tuple, dtype=np.float64) -> np.memmap:
+    """
+    Creates a .npy file of the given shape and returns it memory mapped for writing, so an array
+    larger than memory can be filled in chunks and later read with load_numpy_array_data
+    """
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return np.lib.format.open_memmap(file_path, mode="w+", dtype=dtype, shape=shape)
+    except Exception as e:
+        raise MyException(e, sys) from e
+
+
+def compact_target_dtype(labels) -> np.dtype:
+    """
+    Returns the smallest integer dtype holding the given class labels (uint8 for 0/1), or their
+    own dtype when they are not integral
+    """
+    labels = np.asarray(labels)
+    if labels.size == 0:
+        return np.dtype(np.uint8)
+    if labels.dtype.kind == "f" and not np.array_equal(labels, np.floor(labels)):
+        return labels.dtype
+    if labels.dtype.kind not in "biuf":
+        return labels.dtype
+    return np.result_type(np.min_scalar_type(int(labels.min())), np.min_scalar_type(int(labels.max())))
+
+
+def count_array_rows(file_path: str) -> int:
+    """
+    Returns the number of rows of a saved numpy array without reading its data
+    """
+    try:
+        return np.load(file_path, mmap_mode="r").shape[0]
+    except Exception as e:
+        raise MyException(e, sys) from e
+
+
 def save_object(file_path: str, obj: object) -> None:
     logging.info("Entered the save_object method of utils")
 
@@ -80,4 +142,228 @@ def save_object(file_path: str, obj: object) -> None:
         logging.info("Exited the save_object method of utils")
 
     except Exception as e:
-        raise MyException(e, sys) from e
\ No newline at end of file
+        raise MyException(e, sys) from e
+
+
+def get_schema_columns(schema_config: dict) -> List[tuple]:
+    """
+    Returns the (column, type) pairs declared under `columns` in schema.yaml
+    """
+    return [next(iter(column.items())) for column in schema_config["columns"]]
+
+
+def get_model_columns(schema_config: dict) -> List[str]:
+    """
+    Returns the schema columns without the drop columns, i.e. the columns the model is built from
+    """
+    return [column for column, _ in get_schema_columns(schema_config)
+            if column not in schema_config["drop_columns"]]
+
+
+def dataframe_memory_mb(dataframe: DataFrame) -> float:
+    """
+    Returns the memory used by the DataFrame in MB, including the contents of object columns
+    """
+    return float(dataframe.memory_usage(deep=True).sum()) / 2 ** 20
+
+
+def _to_compact_dtype(series: pd.Series, schema_type: str, pinned_dtype: Optional[str]) -> pd.Series:
+    """
+    Casts one column to the dtype pinned in the schema, or to the smallest dtype that holds its
+    values exactly. Raises OverflowError instead of silently wrapping or rounding values.
+    """
+    if schema_type == "category" or pinned_dtype == "category":
+        return series.astype("category")
+
+    values = pd.to_numeric(series)
+    non_null = values.dropna()
+
+    if schema_type == "int":
+        if not np.array_equal(non_null, np.floor(non_null)):
+            raise ValueError(f"Column '{series.name}' is declared int but holds fractional values")
+        for dtype in ([pinned_dtype] if pinned_dtype else ["int8", "int16", "int32", "int64"]):
+            dtype_info = np.iinfo(dtype)
+            if non_null.empty or (dtype_info.min <= non_null.min() and non_null.max() <= dtype_info.max):
+                # nullable integer dtype when there are missing values
+                return values.astype(dtype.capitalize() if len(non_null) < len(values) else dtype)
+        raise OverflowError(f"Column '{series.name}' range [{non_null.min()}, {non_null.max()}] "
+                            f"does not fit {pinned_dtype or 'int64'}")
+
+    finite = non_null[np.isfinite(non_null)]
+    largest = float(finite.abs().max()) if not finite.empty else 0.0
+    for dtype in ([pinned_dtype] if pinned_dtype else ["float32", "float64"]):
+        if largest > np.finfo(dtype).max:
+            if pinned_dtype:
+                raise OverflowError(f"Column '{series.name}' value {largest} does not fit {pinned_dtype}")
+            continue
+        converted = values.astype(dtype)
+        if pinned_dtype or np.array_equal(converted.to_numpy(dtype="float64"), values.to_numpy(dtype="float64"),
+                                          equal_nan=True):
+            return converted
+    return values.astype("float64")
+
+
+def apply_schema_dtypes(dataframe: DataFrame, schema_config: dict, name: str = "dataframe") -> DataFrame:
+    """
+    Casts the schema columns of the DataFrame to compact dtypes: the `dtypes` pinned in schema.yaml,
+    otherwise the smallest int/float dtype holding the values exactly and categoricals for categories.
+    The footprint before and after is logged and kept in dataframe.attrs["memory_footprint_mb"].
+    """
+    try:
+        before_mb = dataframe_memory_mb(dataframe)
+        pinned_dtypes = schema_config.get("dtypes", {})
+        dataframe = dataframe.copy(deep=False)
+        for column, schema_type in get_schema_columns(schema_config):
+            if column in dataframe.columns:
+                dataframe[column] = _to_compact_dtype(dataframe[column], schema_type, pinned_dtypes.get(column))
+        after_mb = dataframe_memory_mb(dataframe)
+        dataframe.attrs["memory_footprint_mb"] = {"before": round(before_mb, 3), "after": round(after_mb, 3)}
+        logging.info(f"Memory footprint of {name}: {before_mb:.2f} MB -> {after_mb:.2f} MB with schema dtypes")
+        return dataframe
+    except Exception as e:
+        raise MyException(e, sys) from e
+
+
+def with_file_format(file_path: str, file_format: str) -> str:
+    """
+    Returns file_path with the extension of the given artifact file format
+    """
+    if file_format not in ARTIFACT_FILE_EXTENSIONS:
+        raise ValueError(f"Unknown artifact file format '{file_format}', expected one of {list(ARTIFACT_FILE_EXTENSIONS)}")
+    return os.path.splitext(file_path)[0] + ARTIFACT_FILE_EXTENSIONS[file_format]
+
+
+def get_file_format(file_path: str) -> str:
+    """
+    Returns the artifact file format of file_path from its extension
+    """
+    extension = os.path.splitext(file_path)[1]
+    for file_format, format_extension in ARTIFACT_FILE_EXTENSIONS.items():
+        if extension == format_extension:
+            return file_format
+    raise ValueError(f"Unknown artifact file extension '{extension}' of {file_path}")
+
+
+def save_dataframe(file_path: str, dataframe: DataFrame) -> None:
+    """
+    Save a DataFrame in the format given by the extension of file_path.
+    Columnar formats are compressed and keep the dtypes, so nothing is re-inferred on load.
+    file_path: str location of file to save
+    dataframe: DataFrame data to save
+    """
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        file_format = get_file_format(file_path)
+        if file_format == "csv":
+            dataframe.to_csv(file_path, index=False, header=True)
+        elif file_format == "parquet":
+            dataframe.to_parquet(file_path, index=False, compression=ARTIFACT_FILE_COMPRESSION["parquet"])
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(dataframe.reset_index(drop=True), file_path,
+                                  compression=ARTIFACT_FILE_COMPRESSION["feather"])
+    except Exception as e:
+        raise MyException(e, sys) from e
+
+
+def load_dataframe(file_path: str, columns: Optional[List[str]] = None, memory_map: bool = True,
+                   schema_config: Optional[dict] = None) -> DataFrame:
+    """
+    Load a DataFrame saved with save_dataframe.
+    file_path: str location of file to load
+    columns: only read these columns, the others are never decoded from columnar files
+    memory_map: map columnar files into memory instead of reading them through a buffer
+    schema_config: when given, the compact schema dtypes are applied to the loaded data
+    return: DataFrame data loaded
+    """
+    try:
+        file_format = get_file_format(file_path)
+        if file_format == "csv":
+            dataframe = pd.read_csv(file_path, usecols=columns)
+        elif file_format == "parquet":
+            dataframe = pd.read_parquet(file_path, columns=columns, memory_map=memory_map)
+        else:
+            import pyarrow.feather as feather
+            dataframe = feather.read_table(file_path, columns=columns, memory_map=memory_map).to_pandas()
+        if schema_config is not None:
+            dataframe = apply_schema_dtypes(dataframe, schema_config, name=os.path.basename(file_path))
+        return dataframe
+    except Exception as e:
+        raise MyException(e, sys) from e
+
+
+def read_columns(file_path: str) -> List[str]:
+    """
+    Returns the column names of a file saved with save_dataframe without reading its data:
+    the header line of a csv, the schema of a columnar file
+    """
+    try:
+        file_format = get_file_format(file_path)
+        if file_format == "csv":
+            return list(pd.read_csv(file_path, nrows=0).columns)
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+            return pq.read_schema(file_path).names
+        import pyarrow as pa
+        return pa.ipc.open_file(pa.memory_map(file_path)).schema.names
+    except Exception as e:
+        raise MyException(e, sys) from e
+
+
+def iter_dataframe_chunks(file_path: str, chunk_rows: int, columns: Optional[List[str]] = None):
+    """
+    Yields a file saved with save_dataframe as DataFrames of at most chunk_rows rows, so memory
+    stays bounded by the chunk size whatever the size of the file
+    """
+    try:
+        file_format = get_file_format(file_path)
+        if file_format == "csv":
+            yield from pd.read_csv(file_path, usecols=columns, chunksize=chunk_rows)
+        elif file_format == "parquet":
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_rows, columns=columns):
+                yield batch.to_pandas()
+        else:
+            import pyarrow as pa
+            reader = pa.ipc.open_file(pa.memory_map(file_path))
+            for batch_index in range(reader.num_record_batches):
+                batch = reader.get_batch(batch_index)
+                if columns is not None:
+                    batch = batch.select(columns)
+                for offset in range(0, batch.num_rows, chunk_rows):
+                    yield batch.slice(offset, chunk_rows).to_pandas()
+    except Exception as e:
+        raise MyException(e, sys) from e
+
+
+def hash_split_mask(keys, test_ratio: float, salt: str = "") -> np.ndarray:
+    """
+    Returns a boolean array that is True for the keys assigned to the test set.
+    Each key is hashed on its own, so a record always lands on the same side no matter which
+    other records are in the batch: new documents get their split without re-reading old ones.
+    salt: changing it reshuffles every assignment on purpose
+    """
+    keys = np.asarray(keys)
+    if test_ratio >= 1:
+        return np.ones(len(keys), dtype=bool)
+    if keys.dtype.kind in "iu":
+        # same hash whatever integer width the key column was loaded with
+        keys = keys.astype(np.int64)
+    else:
+        keys = keys.astype(str).astype(object)
+    if salt:
+        keys = np.char.add(np.asarray(keys, dtype=str), f"|{salt}").astype(object)
+    hashes = pd.util.hash_array(keys, categorize=False)
+    return hashes < np.uint64(test_ratio * 2 ** 64)
+
+
+def get_split_keys(dataframe: DataFrame, key_columns: List[str]) -> np.ndarray:
+    """
+    Returns the stable record keys used to split the data: the first of key_columns present in
+    the frame, or a hash of the whole row when none of them is
+    """
+    for key_column in key_columns:
+        if key_column in dataframe.columns:
+            return dataframe[key_column].to_numpy()
+    logging.info(f"None of the key columns {key_columns} found, hashing row contents instead")
+    return pd.util.hash_pandas_object(dataframe, index=False).to_numpy()
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from src.entity.model_backends import RandomForestBackend
+
+
+def test_warm_start_rejects_rows_missing_a_class():
+    rng = np.random.default_rng(0)
+    features, target = rng.random((100, 3)), np.arange(100) % 2
+    forest = RandomForestClassifier(n_estimators=5, random_state=0).fit(features, target)
+
+    with pytest.raises(ValueError, match="train from scratch"):
+        RandomForestBackend().warm_start(forest, features[:10], np.ones(10, dtype=int), new_models=3, max_models=8)
+
+    forest = RandomForestBackend().warm_start(forest, features[:20], target[:20], new_models=3, max_models=6)
+    assert len(forest.estimators_) == 6
+    assert forest.predict(features[:5]).shape == (5,)
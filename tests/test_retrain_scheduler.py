@@ -0,0 +1,77 @@
+"""
+Tests of the retraining scheduler with a fake clock and a training job the test finishes itself
+"""
+import json
+import threading
+
+from src.entity.config_entity import RetrainSchedulerConfig
+from src.pipline.retrain_scheduler import RetrainScheduler, DriftTrigger
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class BlockingJob:
+    """A training job that runs until the test releases it"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        self.release.wait(10)
+        return f"run_{self.calls}"
+
+
+def make_scheduler(tmp_path, job, clock, triggers=(), **config) -> RetrainScheduler:
+    config = RetrainSchedulerConfig(scheduler_dir=str(tmp_path), **config)
+    return RetrainScheduler(config, triggers=list(triggers), training_job=job, clock=clock)
+
+
+def test_active_run_keeps_triggers_merged_by_another_scheduler(tmp_path):
+    clock, job = FakeClock(), BlockingJob()
+    first = make_scheduler(tmp_path, job, clock)
+    second = make_scheduler(tmp_path, job, clock)
+
+    assert first.request_run("a") == "started"
+    assert second.request_run("b") == "merged"
+    assert first.request_run("c") == "merged"
+    with open(first.state_file_path) as state_file:
+        saved = json.load(state_file)
+    assert sorted(saved["pending_reasons"]) == ["b", "c"]
+    assert saved["merged_triggers"] == 2
+
+    job.release.set()
+    first.wait()
+    assert first.last_run["status"] == "succeeded"
+    assert sorted(first.state["pending_reasons"]) == ["b", "c"]
+    # the merged triggers start the next run
+    assert first.tick() == "started"
+    first.wait()
+    assert sorted(first.last_run["reasons"]) == ["b", "c"]
+
+
+def test_drift_trigger_waits_for_a_new_score_or_the_cooldown(tmp_path):
+    clock, job, score = FakeClock(), BlockingJob(), {"value": 0.5}
+    job.release.set()
+    trigger = DriftTrigger(lambda: score["value"], threshold=0.2, cooldown_seconds=3600)
+    scheduler = make_scheduler(tmp_path, job, clock, triggers=[trigger])
+
+    assert scheduler.tick() == "started"
+    scheduler.wait()
+    # the model of the run was rejected, the production reference and so the score did not change
+    clock.now += 60
+    assert scheduler.tick() is None
+    clock.now += 3600
+    assert scheduler.tick() == "started"
+    scheduler.wait()
+    score["value"] = 0.6
+    assert scheduler.tick() == "started"
+    scheduler.wait()
+    assert job.calls == 3
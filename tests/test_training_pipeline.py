@@ -0,0 +1,39 @@
+"""
+Smoke test of the task graph of a training run: every task accepts the results of the tasks it
+depends on. The stages are stubbed out, so neither MongoDB nor S3 is needed.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from src.entity.artifact_entity import DataIngestionArtifacts, DataValidationArtifacts
+from src.entity.config_entity import build_pipeline_configs
+from src.pipline.training_pipeline import TrainPipeline
+from src.utils.dag_executor import DagExecutor
+
+
+def stub_stages(pipeline: TrainPipeline) -> None:
+    validation = DataValidationArtifacts(validation_status=True, message="", validation_report_file_path="")
+    pipeline.start_source_validation = lambda: validation
+    pipeline.prefetch_best_model = lambda: None
+    pipeline.start_data_ingestion = lambda config: DataIngestionArtifacts(trained_file_path="train.feather",
+                                                                          test_file_path="test.feather",
+                                                                          source_rows=10, train_rows=8, test_rows=2)
+    pipeline.start_validation = lambda **_: validation
+    pipeline.start_transformation = lambda **_: SimpleNamespace(train_arr=[0] * 8, test_arr=[0] * 2)
+    pipeline.start_model_search = lambda **_: SimpleNamespace(best_params={})
+    pipeline.start_model_trainer = lambda **_: SimpleNamespace()
+    pipeline.start_model_evaluation = lambda **_: SimpleNamespace(is_model_accepted=False)
+
+
+@pytest.mark.parametrize("model_trainer", [{}, {"search": True}, {"incremental": True}])
+def test_build_tasks_runs_with_default_configs(tmp_path, model_trainer):
+    configs = build_pipeline_configs(run_dir=str(tmp_path / "run"), model_trainer=model_trainer)
+    pipeline = TrainPipeline(configs=configs, use_stage_cache=False, train_in_process=False, push=False)
+    stub_stages(pipeline)
+    tasks = pipeline.build_tasks()
+
+    results = DagExecutor().run(tasks)
+
+    assert set(results) == {task.name for task in tasks}
+    assert ("source_validation" in results) == configs.data_validation_config.profile_source